@@ -1,11 +1,15 @@
 import os
-import tempfile
+import sys
 import json
 import yaml
 
 from termcolor import colored
+from kubernetes.client.exceptions import ApiException
 
 from api.core.base_configuration import BaseConfiguration
+from api.core.backup_store import BackupStore, backup_copy
+from api.core.plan import HelmRelease, helm_values
+from api.core.teardown import DeletionTarget
 
 
 class InstallCertManagerHelmChart(BaseConfiguration):
@@ -19,24 +23,19 @@ class InstallCertManagerHelmChart(BaseConfiguration):
             self.install_cert_manager_helm_chart,
         ]
 
+    def desired_state(self):
+        return [HelmRelease("cert-manager", "cert-manager", "jetstack/cert-manager",
+                            helm_values([self.certmanager_values]))]
+
     def add_cert_manager_helm_repo(self, log_prefix: str):
         self.log(log_prefix, colored("Adding CertManager Helm Repo", "green"))
-        self.run_process([
-            "helm", "repo", "add", "jetstack",
-            "https://charts.jetstack.io"
-        ], log_prefix=log_prefix)
-        self.run_process([
-            "helm", "repo", "update"
-        ], log_prefix=log_prefix)
+        self.ensure_helm_repo(log_prefix, "jetstack", "https://charts.jetstack.io")
 
     def install_cert_manager_helm_chart(self, log_prefix: str):
         self.log(log_prefix, colored(
             "Installing Cert Manager Helm Chart with CRDs", "green"))
-        self.run_process([
-            "helm", "install", "cert-manager", "jetstack/cert-manager",
-            "--create-namespace", "--namespace", "cert-manager",
-            "--values", f"{self.certmanager_values}"
-        ], log_prefix=log_prefix)
+        self.helm_upgrade(log_prefix, "cert-manager", "jetstack/cert-manager", "cert-manager",
+                          values=[self.certmanager_values], create_namespace=True)
 
 
 class CreateClusterIssuer(BaseConfiguration):
@@ -101,28 +100,23 @@ class CreateClusterIssuer(BaseConfiguration):
             self.create_cloudflare_token_secret,
             self.create_cluster_issuer
         ]
+        # The ClusterIssuer only references the token secret by name
+        self.dependencies = {}
+
+    def desired_state(self):
+        return [self.secret_cloudflare_token, self.cluster_issuer]
 
     def create_cloudflare_token_secret(self, log_prefix: str):
         self.log(log_prefix, colored(
             "Creating Cloudflare Token Secret", "green"))
         self.log(log_prefix, json.dumps(
             self.secret_cloudflare_token, indent=4))
-        with tempfile.NamedTemporaryFile(mode="w") as f:
-            json.dump(self.secret_cloudflare_token, f)
-            f.flush()
-            self.run_process([
-                "kubectl", "apply", "-f", f.name
-            ], log_prefix=log_prefix)
+        self.apply_objects(log_prefix, [self.secret_cloudflare_token])
 
     def create_cluster_issuer(self, log_prefix: str):
         self.log(log_prefix, colored("Creating Cluster Issuer", "green"))
         self.log(log_prefix, json.dumps(self.cluster_issuer, indent=4))
-        with tempfile.NamedTemporaryFile(mode="w") as f:
-            json.dump(self.cluster_issuer, f)
-            f.flush()
-            self.run_process([
-                "kubectl", "apply", "-f", f.name
-            ], log_prefix=log_prefix)
+        self.apply_objects(log_prefix, [self.cluster_issuer])
 
 
 class CreateCertificate(BaseConfiguration):
@@ -167,15 +161,13 @@ class CreateCertificate(BaseConfiguration):
             self.create_certificate
         ]
 
+    def desired_state(self):
+        return [self.certificate]
+
     def create_certificate(self, log_prefix: str):
         self.log(log_prefix, colored("Creating Certificate", "green"))
         self.log(log_prefix, json.dumps(self.certificate, indent=4))
-        with tempfile.NamedTemporaryFile(mode="w") as f:
-            json.dump(self.certificate, f)
-            f.flush()
-            self.run_process([
-                "kubectl", "apply", "-f", f.name
-            ], log_prefix=log_prefix)
+        self.apply_objects(log_prefix, [self.certificate])
 
 
 class BackupCertManager(BaseConfiguration):
@@ -183,6 +175,7 @@ class BackupCertManager(BaseConfiguration):
         super().__init__()
         self.kubeconfig = kubeconfig
         self.backup_dir = backup_dir
+        self.store = BackupStore(backup_dir)
         self.letsencrypt_environment = letsencrypt_environment
         self.tls_secret_name = f"letsencrypt-{letsencrypt_environment}"
         self.certificate_namespace = certificate_namespace
@@ -190,86 +183,76 @@ class BackupCertManager(BaseConfiguration):
             self.backup_x509_certificates,
             self.backup_cloudflare_token_secret,
             self.backup_cluster_issuer,
-            self.backup_certificates
+            self.backup_certificates,
+            self.write_snapshot,
         ]
+        backups = [self.backup_x509_certificates, self.backup_cloudflare_token_secret,
+                   self.backup_cluster_issuer, self.backup_certificates]
+        self.dependencies = {self.write_snapshot: backups}
+
+    def store_objects(self, log_prefix: str, role: str, objects: list) -> list:
+        entries = []
+        for obj in objects:
+            metadata = obj["metadata"]
+            digest, written = self.store.put(backup_copy(obj))
+            name = f"{metadata['namespace']}/{metadata['name']}" if metadata.get("namespace") else metadata["name"]
+            self.log(log_prefix, colored(f"{obj['kind']} {name} {'stored' if written else 'unchanged'} ({digest[:12]})",
+                                         "green" if written else "yellow"))
+            entries.append({"role": role, "apiVersion": obj["apiVersion"], "kind": obj["kind"],
+                            "name": metadata["name"], "namespace": metadata.get("namespace"), "digest": digest})
+        return entries
+
+    def fetch(self, log_prefix: str, api_version: str, kind: str, name: str, namespace: str = None) -> dict:
+        """
+        Get an object that has to be in the backup, the backup fails without writing a snapshot when it can not be read
+        """
+        try:
+            obj = self.resources.get(self.resources.resource(api_version, kind), name, namespace)
+        except (ValueError, ApiException) as e:
+            self.log(log_prefix, colored(f"Failed to get {kind.lower()} {name}: {e}", "red"))
+            sys.exit(1)
+        if obj is None:
+            self.log(log_prefix, colored(f"Failed to get {kind.lower()} {name}, it does not exist", "red"))
+            sys.exit(1)
+        return obj
 
     def backup_x509_certificates(self, log_prefix: str):
         self.log(log_prefix, colored(f"Backing up x509 certificate {self.tls_secret_name}", "green"))
-        rcode, out, err = self.run_process([
-            "kubectl", "-n", "cert-manager",
-            "get", "secret", self.tls_secret_name,
-            "-o", "yaml"
-        ], log_prefix=log_prefix)
-        if rcode != 0:
-            self.log(log_prefix, colored(f"Failed to get secret {self.tls_secret_name}", "red"))
-            self.log(log_prefix, colored(err, "red"))
-            return
-        secret = yaml.safe_load(out)
-        secret["metadata"].pop("resourceVersion")
-        secret["metadata"].pop("uid")
-        backup_path = os.path.join(self.backup_dir, "x509_secret.yaml")
-        self.log(log_prefix, colored(f"Backing up x509 certificate {self.tls_secret_name} at {backup_path}", "green"))
-        with open(backup_path, "w") as f:
-            yaml.dump(secret, f)
+        secret = self.fetch(log_prefix, "v1", "Secret", self.tls_secret_name, "cert-manager")
+        return self.store_objects(log_prefix, "x509_secret", [secret])
 
     def backup_cloudflare_token_secret(self, log_prefix: str):
         self.log(log_prefix, colored(f"Backing up Cloudflare Token Secret", "green"))
-        rcode, out, err = self.run_process([
-            "kubectl", "-n", "cert-manager",
-            "get", "secret", "cloudflare-token-secret",
-            "-o", "yaml"
-        ], log_prefix=log_prefix)
-        if rcode != 0:
-            self.log(log_prefix, colored(f"Failed to get secret cloudflare-token-secret", "red"))
-            self.log(log_prefix, colored(err, "red"))
-            return
-        secret = yaml.safe_load(out)
-        secret["metadata"].pop("resourceVersion")
-        secret["metadata"].pop("uid")
-        backup_path = os.path.join(self.backup_dir, "cloudflare_token_secret.yaml")
-        self.log(log_prefix, colored(f"Backing up Cloudflare Token Secret at {backup_path}", "green"))
-        with open(backup_path, "w") as f:
-            yaml.dump(secret, f)
-
-    
+        secret = self.fetch(log_prefix, "v1", "Secret", "cloudflare-token-secret", "cert-manager")
+        return self.store_objects(log_prefix, "cloudflare_token_secret", [secret])
+
     def backup_cluster_issuer(self, log_prefix: str):
         self.log(log_prefix, colored(f"Backing up ClusterIssuer", "green"))
-        rcode, out, err = self.run_process([
-            "kubectl", "-n", "cert-manager",
-            "get", "clusterissuer", f"letsencrypt-{self.letsencrypt_environment}",
-            "-o", "yaml"
-        ], log_prefix=log_prefix)
-        if rcode != 0:
-            self.log(log_prefix, colored(f"Failed to get clusterissuer letsencrypt-{self.letsencrypt_environment}", "red"))
-            self.log(log_prefix, colored(err, "red"))
-            return
-        cluster_issuer = yaml.safe_load(out)
-        cluster_issuer["metadata"].pop("resourceVersion")
-        cluster_issuer["metadata"].pop("uid")
-        backup_path = os.path.join(self.backup_dir, "cluster_issuer.yaml")
-        self.log(log_prefix, colored(f"Backing up ClusterIssuer at {backup_path}", "green"))
-        with open(backup_path, "w") as f:
-            yaml.dump(cluster_issuer, f)
+        cluster_issuer = self.fetch(log_prefix, "cert-manager.io/v1", "ClusterIssuer",
+                                    f"letsencrypt-{self.letsencrypt_environment}")
+        return self.store_objects(log_prefix, "cluster_issuer", [cluster_issuer])
 
     def backup_certificates(self, log_prefix: str):
         self.log(log_prefix, colored(f"Backing up Certificates", "green"))
-        rcode, out, err = self.run_process([
-            "kubectl", "-n", self.certificate_namespace,
-            "get", "certificates",
-            "-o", "yaml"
-        ], log_prefix=log_prefix)
-        if rcode != 0:
-            self.log(log_prefix, colored(f"Failed to get certificates", "red"))
-            self.log(log_prefix, colored(err, "red"))
-            return
-        certificates = yaml.safe_load(out)
-        for certificate in certificates["items"]:
-            certificate["metadata"].pop("resourceVersion")
-            certificate["metadata"].pop("uid")
-        backup_path = os.path.join(self.backup_dir, "certificates.yaml")
-        self.log(log_prefix, colored(f"Backing up Certificates at {backup_path}", "green"))
-        with open(backup_path, "w") as f:
-            yaml.dump(certificates, f)
+        try:
+            resource = self.resources.resource("cert-manager.io/v1", "Certificate")
+            certificates = self.resources.list(resource, self.certificate_namespace)
+        except (ValueError, ApiException) as e:
+            self.log(log_prefix, colored(f"Failed to get certificates: {e}", "red"))
+            sys.exit(1)
+        # items of a list do not carry their apiVersion and kind
+        items = [dict(item, apiVersion=resource.api_version, kind=resource.kind) for item in certificates["items"]]
+        return self.store_objects(log_prefix, "certificate", items)
+
+    def write_snapshot(self, log_prefix: str):
+        outputs = {result.name: result.output for result in self.scheduler.results}
+        entries = [entry for step in self.dependencies[self.write_snapshot] for entry in outputs[step.__name__] or []]
+        if not entries:
+            self.log(log_prefix, colored("Nothing was backed up", "red"))
+            sys.exit(1)
+        path = self.store.write_snapshot(entries)
+        self.log(log_prefix, colored(f"Backed up {len(entries)} objects at {path}", "green"))
+        return path
 
 
 class RestoreCertManager(BaseConfiguration):
@@ -277,67 +260,55 @@ class RestoreCertManager(BaseConfiguration):
         super().__init__()
         self.kubeconfig = kubeconfig
         self.backup_dir = backup_dir
+        self.store = BackupStore(backup_dir)
+        self.cluster_issuers = []
         self.steps = [
-            self.restore_x509_certificates,
-            self.wait_10s,
-            self.restore_cloudflare_token_secret,
-            self.wait_10s,
-            self.restore_certificates,
-            self.wait_10s,
+            self.restore_secrets,
             self.restore_cluster_issuer,
+            self.wait_for_cluster_issuer,
+            self.restore_certificates,
         ]
 
-    def restore_x509_certificates(self, log_prefix: str):
-        backup_path = os.path.join(self.backup_dir, "x509_secret.yaml")
-        self.log(log_prefix, colored(f"Restoring x509 certificate from {backup_path}", "green"))
-        with open(backup_path, "r") as f:
-            secret = yaml.safe_load(f)
-        with tempfile.NamedTemporaryFile(mode="w") as f:
-            yaml.dump(secret, f)
-            f.flush()
-            self.run_process([
-                "kubectl", "-n", "cert-manager",
-                "apply", "-f", f.name
-            ], log_prefix=log_prefix)
-
-    def restore_cloudflare_token_secret(self, log_prefix: str):
-        backup_path = os.path.join(self.backup_dir, "cloudflare_token_secret.yaml")
-        self.log(log_prefix, colored(f"Restoring Cloudflare Token Secret from {backup_path}", "green"))
+    def load_backup(self, log_prefix: str, role: str, legacy_file: str, required: bool = True) -> list:
+        """
+        Objects of a role from the latest snapshot, or from the YAML file of a backup taken before snapshots.
+        A required role without objects fails the restore.
+        """
+        snapshot = self.store.latest_snapshot()
+        if snapshot is not None:
+            self.log(log_prefix, colored(f"Restoring {role.replace('_', ' ')} from {snapshot}", "green"))
+            objects = [self.store.get(entry["digest"]) for entry in self.store.load_snapshot(snapshot)["objects"]
+                       if entry["role"] == role]
+            if not objects:
+                self.log(log_prefix, colored(f"{snapshot} has no {role.replace('_', ' ')}",
+                                             "red" if required else "yellow"))
+                if required:
+                    sys.exit(1)
+            return objects
+        backup_path = os.path.join(self.backup_dir, legacy_file)
+        self.log(log_prefix, colored(f"Restoring {role.replace('_', ' ')} from {backup_path}", "green"))
         with open(backup_path, "r") as f:
-            secret = yaml.safe_load(f)
-        with tempfile.NamedTemporaryFile(mode="w") as f:
-            yaml.dump(secret, f)
-            f.flush()
-            self.run_process([
-                "kubectl", "-n", "cert-manager",
-                "apply", "-f", f.name
-            ], log_prefix=log_prefix)
+            return [yaml.safe_load(f)]
+
+    def restore_secrets(self, log_prefix: str):
+        secrets = self.load_backup(log_prefix, "x509_secret", "x509_secret.yaml") + \
+            self.load_backup(log_prefix, "cloudflare_token_secret", "cloudflare_token_secret.yaml")
+        self.apply_objects(log_prefix, secrets, namespace="cert-manager")
 
     def restore_cluster_issuer(self, log_prefix: str):
-        backup_path = os.path.join(self.backup_dir, "cluster_issuer.yaml")
-        self.log(log_prefix, colored(f"Restoring ClusterIssuer from {backup_path}", "green"))
-        with open(backup_path, "r") as f:
-            cluster_issuer = yaml.safe_load(f)
-        with tempfile.NamedTemporaryFile(mode="w") as f:
-            yaml.dump(cluster_issuer, f)
-            f.flush()
-            self.run_process([
-                "kubectl", "-n", "cert-manager",
-                "apply", "-f", f.name
-            ], log_prefix=log_prefix)
+        self.cluster_issuers = self.load_backup(log_prefix, "cluster_issuer", "cluster_issuer.yaml")
+        self.apply_objects(log_prefix, self.cluster_issuers, namespace="cert-manager")
+
+    def wait_for_cluster_issuer(self, log_prefix: str):
+        # loaded again when the issuer was restored by a previous run that is being resumed
+        cluster_issuers = self.cluster_issuers or self.load_backup(log_prefix, "cluster_issuer", "cluster_issuer.yaml")
+        for cluster_issuer in cluster_issuers:
+            self.wait_for_condition(log_prefix, cluster_issuer["apiVersion"], cluster_issuer["kind"],
+                                    cluster_issuer["metadata"]["name"])
 
     def restore_certificates(self, log_prefix: str):
-        backup_path = os.path.join(self.backup_dir, "certificates.yaml")
-        self.log(log_prefix, colored(f"Restoring Certificates from {backup_path}", "green"))
-        with open(backup_path, "r") as f:
-            certificates = yaml.safe_load(f)
-        with tempfile.NamedTemporaryFile(mode="w") as f:
-            yaml.dump(certificates, f)
-            f.flush()
-            self.run_process([
-                "kubectl",
-                "apply", "-f", f.name
-            ], log_prefix=log_prefix)
+        # a namespace without Certificates is backed up as an empty list
+        self.apply_objects(log_prefix, self.load_backup(log_prefix, "certificate", "certificates.yaml", required=False))
 
 
 class UninstallCertManagerHelmChart(BaseConfiguration):
@@ -366,9 +337,7 @@ class DeleteCertManagerNamespace(BaseConfiguration):
 
     def uninstall_cert_manager_namespace(self, log_prefix: str):
         self.log(log_prefix, colored(f"Uninstalling cert-manager namespace", "green"))
-        self.run_process([
-            "kubectl", "delete", "namespace", "cert-manager"
-        ], log_prefix=log_prefix)
+        self.delete_objects(log_prefix, [DeletionTarget("v1", "Namespace", "cert-manager")])
 
 
 class UninstallCertificateAndX509Secret(BaseConfiguration):
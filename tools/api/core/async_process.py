@@ -0,0 +1,83 @@
+import asyncio
+import os
+import time
+import typing
+from dataclasses import dataclass
+
+from termcolor import colored
+
+from api.core.metrics import metrics
+
+
+DEFAULT_CONCURRENCY = 8
+
+
+@dataclass
+class ProcessResult:
+    cmd: typing.List[str]
+    log_prefix: str
+    returncode: typing.Optional[int]
+    stdout: str
+    stderr: str
+    duration: float
+    timed_out: bool = False
+
+    @property
+    def ok(self) -> bool:
+        return self.returncode == 0
+
+
+class AsyncProcessRunner:
+    """
+    Run external commands on an asyncio event loop, at most `max_concurrency` at a time.
+    Every command logs with its own prefix and the results are returned in submission order.
+    """
+
+    def __init__(self, max_concurrency: int = DEFAULT_CONCURRENCY,
+                 log: typing.Callable[[str], None] = print) -> None:
+        self.max_concurrency = max_concurrency
+        self.log = log
+        self._semaphore = None
+
+    def semaphore(self) -> asyncio.Semaphore:
+        # created lazily, a semaphore is bound to the loop it is first used on
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def run(self, cmd: typing.List[str], log_prefix: str, timeout: typing.Optional[float] = None) -> ProcessResult:
+        async with self.semaphore():
+            self.log(colored(f"{log_prefix} {' '.join(cmd)}", "yellow"))
+            start = time.monotonic()
+            proc = await asyncio.create_subprocess_exec(
+                *cmd, env=os.environ.copy(), stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+            timed_out = False
+            try:
+                out, err = await asyncio.wait_for(proc.communicate(), timeout)
+            except asyncio.TimeoutError:
+                timed_out = True
+                proc.kill()
+                out, err = await proc.communicate()
+            duration = time.monotonic() - start
+            returncode = None if timed_out else proc.returncode
+            metrics.record_process(list(cmd), returncode, duration, len(out), len(err))
+            result = ProcessResult(cmd=list(cmd), log_prefix=log_prefix, returncode=returncode,
+                                   stdout=out.decode(), stderr=err.decode(), duration=duration, timed_out=timed_out)
+            self.report(result, timeout)
+            return result
+
+    def report(self, result: ProcessResult, timeout: typing.Optional[float]) -> None:
+        if result.timed_out:
+            self.log(colored(f"{result.log_prefix} Command timed out after {timeout}s", "red", attrs=["bold"]))
+            return
+        self.log(colored(
+            f"{result.log_prefix} Command completed with exit code {result.returncode} in {result.duration:.1f}s",
+            "blue", attrs=["bold"]))
+        if result.stdout:
+            self.log(f"{result.log_prefix} {result.stdout.rstrip()}")
+        if result.stderr:
+            self.log(colored(f"{result.log_prefix} {result.stderr.rstrip()}", "green" if result.ok else "red"))
+
+    async def run_all(self, commands: typing.Iterable[typing.Tuple[typing.List[str], str]],
+                      timeout: typing.Optional[float] = None) -> typing.List[ProcessResult]:
+        return list(await asyncio.gather(*(self.run(cmd, log_prefix, timeout) for cmd, log_prefix in commands)))
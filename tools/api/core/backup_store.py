@@ -0,0 +1,90 @@
+import os
+import gzip
+import json
+import hashlib
+import time
+import typing
+
+
+# Metadata the API server sets, it changes without the object changing and is rejected on restore
+VOLATILE_METADATA = ["resourceVersion", "uid", "creationTimestamp", "generation", "managedFields", "selfLink"]
+
+OBJECTS_DIR = "objects"
+SNAPSHOTS_DIR = "snapshots"
+
+
+def backup_copy(obj: dict) -> dict:
+    """
+    The part of a live object that is backed up: without its status and server-set metadata,
+    so that an object that did not change has the same content in every backup
+    """
+    obj = {key: value for key, value in obj.items() if key != "status"}
+    obj["metadata"] = {key: value for key, value in (obj.get("metadata") or {}).items()
+                       if key not in VOLATILE_METADATA}
+    return obj
+
+
+def canonical(obj: dict) -> bytes:
+    return json.dumps(obj, sort_keys=True, separators=(",", ":")).encode()
+
+
+class BackupStore:
+    """
+    Backups as gzip-compressed timestamped snapshots that reference content-addressed objects.
+    Every object is stored once under the sha256 of its canonical JSON, so objects that did not
+    change since the previous backup are not written again and only the small snapshot index is.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+
+    def blob_path(self, digest: str) -> str:
+        return os.path.join(self.directory, OBJECTS_DIR, digest[:2], f"{digest}.json.gz")
+
+    def write_gzip(self, path: str, content: bytes) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        # mtime=0 keeps the compressed bytes of identical content identical
+        with gzip.GzipFile(tmp_path, "wb", mtime=0) as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def put(self, obj: dict) -> typing.Tuple[str, bool]:
+        """
+        Store an object, returns its digest and whether it had to be written
+        """
+        content = canonical(obj)
+        digest = hashlib.sha256(content).hexdigest()
+        path = self.blob_path(digest)
+        if os.path.exists(path):
+            return digest, False
+        self.write_gzip(path, content)
+        return digest, True
+
+    def get(self, digest: str) -> dict:
+        with gzip.open(self.blob_path(digest), "rb") as f:
+            return json.loads(f.read())
+
+    def write_snapshot(self, entries: typing.List[dict], timestamp: typing.Optional[float] = None) -> str:
+        """
+        Write the index of a backup, entries describe each object and carry its digest
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        name = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime(timestamp))
+        path = os.path.join(self.directory, SNAPSHOTS_DIR, f"{name}.json.gz")
+        self.write_gzip(path, json.dumps({"created": timestamp, "objects": entries}, indent=2).encode())
+        return path
+
+    def snapshots(self) -> typing.List[str]:
+        directory = os.path.join(self.directory, SNAPSHOTS_DIR)
+        if not os.path.isdir(directory):
+            return []
+        return [os.path.join(directory, name) for name in sorted(os.listdir(directory)) if name.endswith(".json.gz")]
+
+    def latest_snapshot(self) -> typing.Optional[str]:
+        snapshots = self.snapshots()
+        return snapshots[-1] if snapshots else None
+
+    def load_snapshot(self, path: str) -> dict:
+        with gzip.open(path, "rb") as f:
+            return json.loads(f.read())
@@ -1,27 +1,64 @@
 import requests
+import asyncio
 import json
 import time
 import os
 import sys
+import inspect
 import subprocess
+from contextlib import contextmanager, nullcontext
+from tempfile import NamedTemporaryFile
 from termcolor import colored
-from kubernetes import client, utils, watch
-from kubernetes.client import Configuration, ApiClient
+from kubernetes import client, utils
+from kubernetes.client.exceptions import ApiException
 
 import logging
 
+from api.core.client_factory import clients
+from api.core.scheduler import StepScheduler
+from api.core.apply import ApplyEngine
+from api.core.readiness import ReadinessWaiter, DEFAULT_TIMEOUT
+from api.core.helm import helm_repositories
+from api.core.loadbalancer import loadbalancers
+from api.core.metrics import metrics
+from api.core.checkpoint import Checkpoint, is_resuming
+from api.core.desired_state import desired_state_hash, file_contents, is_forced, is_planning, HELM_DESCRIPTION_PREFIX
+from api.core.teardown import (TeardownEngine, DEFAULT_TEARDOWN_TIMEOUT, DELETED, ABSENT, STUCK,
+                                is_purging_finalizers)
+from api.core.events import EventWatcher, DEFAULT_QUEUE_SIZE, format_event
+from api.core.event_digest import EventAggregator, DEFAULT_WINDOW, DEFAULT_TOP
+from api.core.dns_sync import HostsSync, HOSTS_FILE, HOSTS
+from api.core.plan import Planner, CREATE, UPDATE, UNCHANGED
+from api.core.async_process import AsyncProcessRunner, DEFAULT_CONCURRENCY
+from api.core.process import OutputTail, StreamedOutput, DEFAULT_TAIL_LINES, drain, kill_after
+
 logger = logging.getLogger(__name__)
 
 
 class BaseConfiguration:
+    # Upper bound on the number of steps that run at the same time
+    max_parallel_steps = 4
+
+    def __new__(cls, *args, **kwargs):
+        configuration = super().__new__(cls)
+        # the arguments the configuration is constructed with identify its checkpoint; attributes
+        # derived from them in the constructor can differ between runs, e.g. a salted password hash
+        bound = inspect.signature(cls.__init__).bind_partial(configuration, *args, **kwargs)
+        bound.apply_defaults()
+        configuration.arguments = dict(list(bound.arguments.items())[1:])
+        return configuration
+
     def __init__(self, **kwargs) -> None:
         self.kwargs = kwargs
-        kubeconfig = Configuration()
-        kubeconfig.host = "http://127.0.0.1:8080"
-        self.api_client = ApiClient(configuration=kubeconfig)
-        self.v1 = client.CoreV1Api(api_client=self.api_client)
+        self.api_client = clients.api_client()
+        self.v1 = clients.api(client.CoreV1Api)
+        self.resources = clients.resources()
+        self.apply_engine = ApplyEngine(self.resources)
 
         self.steps = []
+        # Maps a step to the steps it requires. None runs the steps strictly in order.
+        self.dependencies = None
+        self.scheduler = None
 
     def log(self, log_prefix: str, message, log_level = None):
         if log_level == None:
@@ -42,27 +79,87 @@ class BaseConfiguration:
             if reason != "AlreadyExists":
                 print(colored(f"{log_prefix} {err}", "red", attrs=["bold"]))
 
+    def desired_state(self):
+        """
+        Manifests and HelmReleases this configuration applies, compared with the cluster by --plan.
+        None when the configuration can not be planned.
+        """
+        return None
+
+    def plan(self):
+        name = self.__class__.__name__
+        desired = self.desired_state()
+        if desired is None:
+            print(colored(f"{name} can not be planned, nothing was changed", "yellow", attrs=["bold"]))
+            return []
+        print(colored(f"Planning {name}", "green", "on_yellow", attrs=["bold"]))
+        changes = Planner(self.apply_engine).plan(desired)
+        for change in changes:
+            color = {CREATE: "green", UPDATE: "yellow", UNCHANGED: "blue"}[change.action]
+            note = f" ({change.note})" if change.note else ""
+            print(colored(f"{change.action.ljust(9)} {change.description}{note}", color, attrs=["bold"]))
+            if change.action == UNCHANGED:
+                continue
+            for line in change.diff[2:]:
+                line_color = "green" if line.startswith("+") else "red" if line.startswith("-") else None
+                print(colored(f"    {line}", line_color) if line_color else f"    {line}")
+        counts = {action: len([c for c in changes if c.action == action]) for action in (CREATE, UPDATE, UNCHANGED)}
+        print(colored(f"{name}: {counts[CREATE]} to create, {counts[UPDATE]} to change, "
+                      f"{counts[UNCHANGED]} unchanged", attrs=["bold"]))
+        return changes
+
     def run(self):
+        if is_planning():
+            return self.plan()
         total_steps = len(self.steps)
         print(colored(f"Running {self.__class__.__name__} with {total_steps} steps",
               "green", "on_yellow", attrs=["bold"]))
-        for idx, step in enumerate(self.steps):
-            log_prefix = "[{}/{}]: {} : ".format(idx + 1,
-                                                 total_steps, step.__name__)
-            print(colored(log_prefix + "Starting", "magenta", attrs=["bold"]))
-            step(log_prefix, **self.kwargs)
+        checkpoint = Checkpoint.for_configuration(self.__class__.__name__, getattr(self, "kubeconfig", None),
+                                                  self.arguments)
+        completed = {}
+        if is_resuming():
+            completed = {step: state["output"] for step, state in checkpoint.load().items()}
+        else:
+            checkpoint.clear()
+        self.scheduler = StepScheduler(
+            self.steps, self.dependencies, max_workers=self.max_parallel_steps, completed=completed,
+            on_success=lambda result: checkpoint.mark_completed(result.key, result.output))
+        try:
+            results = self.scheduler.run(
+                lambda idx, step: "[{}/{}]: {} : ".format(idx + 1, total_steps, step.__name__),
+                self.kwargs
+            )
+            checkpoint.clear()
+            return results
+        finally:
+            for result in self.scheduler.results:
+                metrics.record_step(self.__class__.__name__, result.name, result.status, result.duration)
 
-    def run_process(self, *cmd, log_prefix: str, handle_error=True):
+    def run_process(self, *cmd, log_prefix: str, handle_error=True, stream=False, timeout=None,
+                    tail_lines=DEFAULT_TAIL_LINES):
+        """
+        Run a command and return its exit code, stdout and stderr.
+        With stream=True output lines are relayed as they arrive, stderr is merged into stdout and only
+        the last tail_lines lines are kept and returned. The command is killed after timeout seconds.
+        """
+        if stream:
+            return self.run_streaming_process(*cmd, log_prefix=log_prefix, handle_error=handle_error,
+                                              timeout=timeout, tail_lines=tail_lines)
         completed_process = None
         print(colored(f"{log_prefix} {' '.join(cmd[0])}", "yellow"))
+        start = time.monotonic()
         try:
             completed_process = subprocess.run(
-                *cmd, env=os.environ.copy(), capture_output=True)
-        except subprocess.CalledProcessError as e:
-            print(colored(log_prefix, "Error running command: {}".format(
-                e), "red", attrs=["bold"]))
-            sys.exit(1)
+                *cmd, env=os.environ.copy(), capture_output=True, timeout=timeout)
+        except subprocess.TimeoutExpired as e:
+            metrics.record_process(list(cmd[0]), None, time.monotonic() - start,
+                                   len(e.stdout or b""), len(e.stderr or b""))
+            print(colored(f"{log_prefix} Command timed out after {timeout}s", "red", attrs=["bold"]))
+            if handle_error:
+                sys.exit(1)
+            return None, (e.stdout or b"").decode(), (e.stderr or b"").decode()
         return_code, out, err = completed_process.returncode, completed_process.stdout, completed_process.stderr
+        metrics.record_process(list(cmd[0]), return_code, time.monotonic() - start, len(out), len(err))
         out, err = out.decode(), err.decode()
         print(colored(
             f"{log_prefix} Command completed with exit code {return_code}", "blue", attrs=["bold"]))
@@ -73,13 +170,128 @@ class BaseConfiguration:
             sys.exit(1)
         return return_code, out, err
 
-    def watch_namespace_events(self, namespace: str, log_prefix: str):
-        event_watcher = watch.Watch()
-        self.log(log_prefix, colored(f"Watching namespace {namespace} events", "grey"), logging.INFO)
+    def run_streaming_process(self, *cmd, log_prefix: str, handle_error=True, timeout=None,
+                              tail_lines=DEFAULT_TAIL_LINES):
+        print(colored(f"{log_prefix} {' '.join(cmd[0])}", "yellow"))
+        tail = OutputTail(tail_lines)
+        start = time.monotonic()
+        proc = subprocess.Popen(*cmd, env=os.environ.copy(), stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                text=True, bufsize=1)
+        timer = kill_after(proc, timeout)
+        try:
+            for line in proc.stdout:
+                print(f"{log_prefix} {line}", end="", flush=True)
+                tail.append(line)
+            return_code = proc.wait()
+        finally:
+            if timer is not None:
+                timer.cancel()
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+        elapsed = time.monotonic() - start
+        timed_out = timeout is not None and elapsed >= timeout
+        metrics.record_process(list(cmd[0]), None if timed_out else return_code, elapsed, tail.bytes, 0)
+        if timed_out:
+            print(colored(f"{log_prefix} Command timed out after {timeout}s", "red", attrs=["bold"]))
+        print(colored(
+            f"{log_prefix} Command completed with exit code {return_code}", "blue", attrs=["bold"]))
+        if return_code != 0:
+            print(colored(f"{log_prefix} Last {len(tail.lines)} lines of output:\n{tail.text()}", "red"))
+            if handle_error:
+                sys.exit(1)
+        return return_code, tail.text(), ""
+
+    @contextmanager
+    def stream_process(self, *cmd, log_prefix: str, handle_error=True, timeout=None, tail_lines=DEFAULT_TAIL_LINES):
+        """
+        Run a command and hand its stdout to the caller as a stream of lines instead of a string.
+        stderr is kept as a bounded tail and reported if the command fails.
+        """
+        print(colored(f"{log_prefix} {' '.join(cmd[0])}", "yellow"))
+        err_tail = OutputTail(tail_lines)
+        start = time.monotonic()
+        proc = subprocess.Popen(*cmd, env=os.environ.copy(), stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                text=True)
+        timer = kill_after(proc, timeout)
+        err_reader = drain(proc.stderr, err_tail)
+        out = StreamedOutput(proc.stdout)
+        try:
+            yield out
+        finally:
+            proc.stdout.close()
+            return_code = proc.wait()
+            err_reader.join()
+            if timer is not None:
+                timer.cancel()
+            out.returncode, out.stderr = return_code, err_tail.text()
+            metrics.record_process(list(cmd[0]), return_code, time.monotonic() - start, out.bytes, err_tail.bytes)
+            print(colored(
+                f"{log_prefix} Command completed with exit code {return_code}", "blue", attrs=["bold"]))
+            if return_code != 0:
+                print(colored(f"{log_prefix} {err_tail.text()}", "red"))
+                if handle_error:
+                    sys.exit(1)
+
+    def run_processes(self, commands: list, log_prefix: str, handle_error=True, timeout=None,
+                      max_concurrency=DEFAULT_CONCURRENCY) -> list:
+        """
+        Run many commands concurrently and wait for all of them. Returns a ProcessResult per command,
+        in the order given.
+        """
+        total = len(commands)
+        runner = AsyncProcessRunner(max_concurrency=max_concurrency)
+        results = asyncio.run(runner.run_all(
+            ((cmd, f"{log_prefix}[{idx + 1}/{total}]") for idx, cmd in enumerate(commands)), timeout=timeout))
+        failed = [result for result in results if not result.ok]
+        self.log(log_prefix, colored(f"{total - len(failed)}/{total} commands succeeded",
+                                     "green" if not failed else "red", attrs=["bold"]))
+        for result in failed:
+            self.log(result.log_prefix, colored(f"Failed: {' '.join(result.cmd)}", "red"))
+        if handle_error and failed:
+            sys.exit(1)
+        return results
+
+    def watch_namespace_events(self, namespace: str, log_prefix: str, aggregate: bool = False,
+                               window: float = DEFAULT_WINDOW, top: int = DEFAULT_TOP):
+        self.watch_events(log_prefix, [namespace], aggregate=aggregate, window=window, top=top)
+
+    def watch_events(self, log_prefix: str, namespaces: list = None, queue_size: int = DEFAULT_QUEUE_SIZE,
+                     aggregate: bool = False, window: float = DEFAULT_WINDOW, top: int = DEFAULT_TOP):
+        """
+        Print the events of the given namespaces, or of all namespaces, until interrupted.
+        With aggregate, repeats of an event are only counted and summarised in a digest every window seconds.
+        """
+        scope = ", ".join(namespaces) if namespaces else "all namespaces"
+        self.log(log_prefix, colored(f"Watching events of {scope}", "grey"), logging.INFO)
         self.log(log_prefix, colored("Press Ctrl+C to stop watching", "red"), logging.WARN)
-        for event in event_watcher.stream(self.v1.list_namespaced_event, namespace=namespace):
-            self.log(log_prefix, event["object"].message, logging.INFO)
-    
+        watcher = EventWatcher(self.resources, namespaces, queue_size=queue_size,
+                               log=lambda message: self.log(log_prefix, colored(message, "yellow"), logging.WARN))
+        aggregator = EventAggregator(window=window, top=top) if aggregate else None
+
+        def print_digest():
+            for line in aggregator.digest():
+                self.log(log_prefix, colored(line, "cyan"), logging.INFO)
+
+        try:
+            for event in watcher.events():
+                if aggregator is not None and aggregator.digest_due():
+                    print_digest()
+                if event is None:
+                    continue
+                if isinstance(event, int):
+                    self.log(log_prefix, colored(f"{event} events dropped, the output can not keep up", "red"),
+                             logging.WARN)
+                    continue
+                if aggregator is not None and not aggregator.add(event):
+                    continue
+                self.log(log_prefix, colored(format_event(event), "yellow" if event.get("type") == "Warning" else None),
+                         logging.INFO)
+        except KeyboardInterrupt:
+            if aggregator is not None:
+                print_digest()
+            self.log(log_prefix, colored("Stopped watching events", "grey"), logging.INFO)
+
     def is_gh_repo_private(self, gh_user, gh_repo: str) -> bool:
         r = requests.get(f"https://api.github.com/repos/{gh_user}/{gh_repo}")
         return r.status_code == 404
@@ -90,6 +302,148 @@ class BaseConfiguration:
         except utils.FailToCreateError as err:
             self.log_k8s_api_error(log_prefix, err)
 
+    def apply_objects(self, log_prefix: str, objects: list, namespace: str = None, handle_error=True):
+        results = self.apply_engine.apply_all(objects, namespace=namespace)
+        failed = False
+        for result in results:
+            if result.skipped:
+                self.log(log_prefix, colored(f"{result.description} unchanged, skipped", "yellow"))
+                continue
+            if result.error is None:
+                self.log(log_prefix, colored(f"{result.description} applied", "green"))
+                continue
+            failed = True
+            message = result.error
+            if isinstance(result.error, ApiException) and result.error.body:
+                try:
+                    message = json.loads(result.error.body).get("message", result.error.body)
+                except ValueError:
+                    message = result.error.body
+            self.log(log_prefix, colored(f"{result.description} failed: {message}", "red", attrs=["bold"]))
+        if handle_error and failed:
+            sys.exit(1)
+        return results
+
+    def ensure_helm_repo(self, log_prefix: str, name: str, url: str):
+        helm_repositories.ensure(
+            name, url, self.run_process,
+            lambda message: self.log(log_prefix, colored(message, "blue")),
+            log_prefix
+        )
+
+    def helm_upgrade(self, log_prefix: str, release: str, chart: str, namespace: str, values: list = (),
+                     set_values: list = (), version: str = None, create_namespace: bool = False,
+                     rendered_values: dict = None, **kwargs) -> bool:
+        """
+        `helm upgrade --install` a release, unless its last revision was deployed from the same chart, version,
+        values files and --set values. The hash of those is kept as the description of the release revision.
+        `rendered_values` are values built in memory, they are only written to a file when helm has to run.
+        Returns whether helm was run.
+        """
+        parts = [file_contents(path) for path in values]
+        if rendered_values is not None:
+            parts.append(rendered_values)
+        state = desired_state_hash(chart, version, parts, list(set_values))
+        description = f"{HELM_DESCRIPTION_PREFIX}{state}"
+        if not is_forced():
+            rcode, out, err = self.run_process([
+                "helm", "history", release, "--namespace", namespace, "--max", "1", "-o", "json"
+            ], log_prefix=log_prefix, handle_error=False)
+            history = json.loads(out) if rcode == 0 and out.strip() else []
+            if history and history[-1].get("status") == "deployed" and history[-1].get("description") == description:
+                self.log(log_prefix, colored(f"Helm release {release} is up to date, skipping", "yellow"))
+                return False
+        with NamedTemporaryFile(mode="w", suffix=".json") if rendered_values is not None else nullcontext() as rendered:
+            files = list(values)
+            if rendered_values is not None:
+                json.dump(rendered_values, rendered, indent=4)
+                rendered.flush()
+                files.append(rendered.name)
+            cmd = ["helm", "upgrade", "--install", release, chart, "--namespace", namespace, "--description", description]
+            if create_namespace:
+                cmd.append("--create-namespace")
+            if version:
+                cmd.extend(["--version", version])
+            for path in files:
+                cmd.extend(["-f", path])
+            for value in set_values:
+                cmd.extend(["--set", value])
+            self.run_process(cmd, log_prefix=log_prefix, **kwargs)
+        return True
+
+    def delete_objects(self, log_prefix: str, targets: list, timeout: float = DEFAULT_TEARDOWN_TIMEOUT,
+                       handle_error=True):
+        """
+        Delete DeletionTargets concurrently and wait until they are gone
+        """
+        engine = TeardownEngine(self.resources, log=lambda message: self.log(log_prefix, colored(message, "cyan")))
+        self.log(log_prefix, colored(f"Deleting {', '.join(target.description for target in targets)}", "blue"))
+        results = engine.teardown(targets, timeout=timeout, purge=is_purging_finalizers())
+        failed = False
+        for result in results:
+            description = result.target.description
+            if result.status == DELETED:
+                purged = " after purging its finalizers" if result.purged else ""
+                self.log(log_prefix, colored(f"{description} deleted in {result.duration:.1f}s{purged}", "green"))
+            elif result.status == ABSENT:
+                self.log(log_prefix, colored(f"{description} does not exist", "yellow"))
+            elif result.status == STUCK:
+                failed = True
+                self.log(log_prefix, colored(
+                    f"{description} is still terminating, held by finalizers {', '.join(result.finalizers) or '-'}",
+                    "red", attrs=["bold"]))
+                for message in result.blocked_by:
+                    self.log(log_prefix, colored(f"  {message}", "red"))
+                self.log(log_prefix, colored("Re-run with --purge-finalizers to remove them", "yellow"))
+            else:
+                failed = True
+                self.log(log_prefix, colored(f"{description} could not be deleted: {result.error}", "red", attrs=["bold"]))
+        if handle_error and failed:
+            sys.exit(1)
+        return results
+
+    def wait_until_ready(self, log_prefix: str, wait):
+        waiter = ReadinessWaiter(self.api_client, self.resources,
+                                 log=lambda message: self.log(log_prefix, colored(message, "cyan")))
+        try:
+            return wait(waiter)
+        except TimeoutError as e:
+            self.log(log_prefix, colored(str(e), "red", attrs=["bold"]))
+            sys.exit(1)
+
+    def wait_for_deployment(self, log_prefix: str, namespace: str, name: str, timeout: float = DEFAULT_TIMEOUT):
+        return self.wait_until_ready(log_prefix, lambda waiter: waiter.deployment(namespace, name, timeout))
+
+    def wait_for_daemonset(self, log_prefix: str, namespace: str, name: str, timeout: float = DEFAULT_TIMEOUT):
+        return self.wait_until_ready(log_prefix, lambda waiter: waiter.daemonset(namespace, name, timeout))
+
+    def wait_for_loadbalancer_ip(self, log_prefix: str, namespace: str, name: str, timeout: float = DEFAULT_TIMEOUT) -> str:
+        """
+        Address of a LoadBalancer Service, cached for the rest of the process, see LoadBalancerResolver
+        """
+        return self.wait_until_ready(log_prefix, lambda waiter: loadbalancers.resolve(waiter, namespace, name, timeout))
+
+    def wait_for_condition(self, log_prefix: str, api_version: str, kind: str, name: str, namespace: str = None,
+                           condition: str = "Ready", timeout: float = DEFAULT_TIMEOUT) -> dict:
+        return self.wait_until_ready(log_prefix, lambda waiter: waiter.condition(
+            api_version, kind, name, namespace=namespace, condition=condition, timeout=timeout))
+
+    def sync_hostnames(self, log_prefix: str, records: dict, path: str = HOSTS_FILE, output_format: str = HOSTS,
+                       prune: bool = False) -> bool:
+        """
+        Point hostnames at addresses in a hosts, dnsmasq or CoreDNS file, see HostsSync
+        """
+        try:
+            changed = HostsSync(path, output_format).sync(records, prune=prune)
+        except OSError as e:
+            self.log(log_prefix, colored(f"Failed to update {path}: {e}", "red", attrs=["bold"]))
+            sys.exit(1)
+        if changed:
+            self.log(log_prefix, colored(f"Updated {len(records)} hostnames in {path}", "green"))
+        else:
+            self.log(log_prefix, colored(f"{len(records)} hostnames already up to date in {path}", "yellow"))
+        return changed
+
     def wait_10s(self, log_prefix: str):
         self.log(log_prefix, "Waiting 10s")
         time.sleep(10)
\ No newline at end of file
@@ -0,0 +1,76 @@
+import os
+import json
+import hashlib
+import threading
+import typing
+
+from api.core.metrics import write_atomically
+
+
+DEFAULT_STATE_DIR = os.path.join(os.path.expanduser("~"), ".k8s-admin-setup-utils", "state")
+
+_options = {"resume": False, "state_dir": DEFAULT_STATE_DIR}
+
+
+def resume_runs(resume: bool, state_dir: str = DEFAULT_STATE_DIR) -> None:
+    """
+    Continue configurations from the steps that did not complete in their previous run
+    """
+    _options["resume"] = resume
+    _options["state_dir"] = state_dir
+
+
+def is_resuming() -> bool:
+    return _options["resume"]
+
+
+def is_plain(value: typing.Any) -> bool:
+    """
+    Whether a value is plain data that identifies a configuration, rather than a client or a step
+    """
+    if isinstance(value, (list, tuple)):
+        return all(is_plain(item) for item in value)
+    if isinstance(value, dict):
+        return all(isinstance(key, str) and is_plain(item) for key, item in value.items())
+    return value is None or isinstance(value, (str, int, float, bool))
+
+
+class Checkpoint:
+    """
+    State file of a configuration run, recording the steps that completed and what they returned.
+    It is written after every completed step and removed once the whole configuration succeeded.
+    Steps are recorded by their position and name, as a configuration can run the same step twice,
+    and the file is specific to the cluster and the arguments of the configuration.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self.completed = {}
+
+    @classmethod
+    def for_configuration(cls, name: str, kubeconfig: typing.Optional[str],
+                          arguments: typing.Optional[dict] = None) -> "Checkpoint":
+        identity = json.dumps({"kubeconfig": os.path.abspath(kubeconfig or ""),
+                               "arguments": {key: value for key, value in (arguments or {}).items() if is_plain(value)}},
+                              sort_keys=True)
+        digest = hashlib.sha256(identity.encode()).hexdigest()[:12]
+        return cls(os.path.join(_options["state_dir"], f"{name}-{digest}.json"))
+
+    def load(self) -> typing.Dict[str, typing.Any]:
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                self.completed = json.load(f).get("completed", {})
+        return self.completed
+
+    def mark_completed(self, step: str, output: typing.Any) -> None:
+        with self._lock:
+            self.completed[step] = {"output": output}
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            write_atomically(self.path, json.dumps({"completed": self.completed}, indent=4, default=str))
+
+    def clear(self) -> None:
+        with self._lock:
+            self.completed = {}
+            if os.path.exists(self.path):
+                os.remove(self.path)
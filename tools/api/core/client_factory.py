@@ -0,0 +1,138 @@
+import functools
+import socket
+import threading
+import time
+import typing
+from urllib.parse import urlparse
+
+from urllib3.connection import HTTPConnection
+from kubernetes.client import ApiClient
+from kubernetes.client.exceptions import ApiException
+
+from api.core.resources import ResourceClient
+from api.core.run_context import api_configuration
+from api.core.metrics import metrics
+from api.core.constants import DEFAULT_POOL_SIZE
+
+
+# TCP keep-alive so idle pooled connections survive between steps
+KEEPALIVE_SOCKET_OPTIONS = HTTPConnection.default_socket_options + [
+    (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+]
+
+
+def count_on_read(response, call: dict) -> None:
+    """
+    Add the size of a response body to its recorded call once the caller reads it. Newer kubernetes
+    clients return responses whose body is only read after the request method returned.
+    """
+    read = response.read
+
+    def counted_read(*args, **kwargs):
+        unread = response.data is None
+        data = read(*args, **kwargs)
+        if unread and isinstance(data, (bytes, str)):
+            metrics.add_bytes_read(call, len(data))
+        return data
+    response.read = counted_read
+
+
+def instrumented(request: typing.Callable) -> typing.Callable:
+    """
+    Wrap the request method of a REST client to record the duration, status and response size of every
+    request. Responses are never read here, reading a streamed one (as used by watches) would drain the
+    stream: a body that is already loaded is counted right away, one that is not is counted when the
+    caller reads it.
+    """
+    @functools.wraps(request)
+    def instrumented_request(method, url, *args, **kwargs):
+        start = time.monotonic()
+        status, bytes_read, response = None, 0, None
+        preloaded = kwargs.get("_preload_content", True)
+        try:
+            response = request(method, url, *args, **kwargs)
+            status = getattr(response, "status", None)
+            if preloaded:
+                data = getattr(response, "data", None)
+                if isinstance(data, (bytes, str)):
+                    bytes_read = len(data)
+            return response
+        except ApiException as e:
+            status = e.status
+            bytes_read = len(e.body or "")
+            raise
+        finally:
+            call = metrics.record_api_call(method, urlparse(url).path, status, time.monotonic() - start, bytes_read)
+            if preloaded and response is not None and getattr(response, "data", b"") is None \
+                    and callable(getattr(response, "read", None)):
+                count_on_read(response, call)
+    return instrumented_request
+
+
+class InstrumentedApiClient(ApiClient):
+    """
+    ApiClient that records every request. The hook is on the request method of its REST client,
+    which every API call goes through in old and new versions of the kubernetes client alike.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.rest_client.request = instrumented(self.rest_client.request)
+
+
+class ClientFactory:
+    """
+    Process-wide Kubernetes clients. Every BaseConfiguration shares one ApiClient, and with it one
+    urllib3 connection pool, plus one instance per API group class (CoreV1Api, AppsV1Api, ...).
+    The clients are rebuilt when kube_proxy switches to another connection.
+    """
+
+    def __init__(self, pool_size: int = DEFAULT_POOL_SIZE) -> None:
+        self.pool_size = pool_size
+        self._lock = threading.RLock()
+        self._configuration = None
+        self._api_client = None
+        self._resources = None
+        self._apis = {}
+
+    def configure(self, pool_size: int) -> None:
+        with self._lock:
+            self.pool_size = pool_size
+            self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            if self._api_client is not None:
+                self._api_client.close()
+            self._configuration = None
+            self._api_client = None
+            self._resources = None
+            self._apis = {}
+
+    def api_client(self) -> ApiClient:
+        with self._lock:
+            configuration = api_configuration()
+            if self._api_client is None or self._configuration is not configuration:
+                self.reset()
+                configuration.connection_pool_maxsize = self.pool_size
+                configuration.socket_options = KEEPALIVE_SOCKET_OPTIONS
+                self._configuration = configuration
+                self._api_client = InstrumentedApiClient(configuration=configuration)
+            return self._api_client
+
+    def api(self, api_class: typing.Type):
+        with self._lock:
+            api_client = self.api_client()
+            if api_class not in self._apis:
+                self._apis[api_class] = api_class(api_client=api_client)
+            return self._apis[api_class]
+
+    def resources(self) -> ResourceClient:
+        with self._lock:
+            api_client = self.api_client()
+            if self._resources is None:
+                self._resources = ResourceClient(api_client)
+            return self._resources
+
+
+clients = ClientFactory()
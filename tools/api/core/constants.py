@@ -9,4 +9,9 @@ $$ |      $$ |  $$ |$$ |  $$ |$$ |__$$ |$$ |  $$ |      $$$$$$  \ $$ \__$$ | $$$
 $$ |      $$ |  $$ |$$ |  $$ |$$    $$/ $$ |  $$ |      $$ | $$  |$$    $$/ /     $$/ 
 $$/       $$/   $$/ $$/   $$/ $$$$$$$/  $$/   $$/       $$/   $$/  $$$$$$/  $$$$$$$/ 
 
-"""
\ No newline at end of file
+"""
+
+# Maximum number of pooled connections to the Kubernetes API
+DEFAULT_POOL_SIZE = 16
+# Seconds a cached helm repository index is used before it is updated
+DEFAULT_REPO_TTL = 3600
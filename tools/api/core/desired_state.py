@@ -0,0 +1,65 @@
+import hashlib
+import json
+import typing
+
+
+HASH_ANNOTATION = "k8s-admin-setup-utils/desired-state-hash"
+HELM_DESCRIPTION_PREFIX = "desired-state-hash="
+
+_options = {"force": False, "plan": False}
+
+
+def force_reapply(force: bool) -> None:
+    """
+    Re-apply every manifest and helm release even when its desired state is unchanged
+    """
+    _options["force"] = force
+
+
+def is_forced() -> bool:
+    return _options["force"]
+
+
+def plan_only(plan: bool) -> None:
+    """
+    Print what configurations would change instead of running them
+    """
+    _options["plan"] = plan
+
+
+def is_planning() -> bool:
+    return _options["plan"]
+
+
+def desired_state_hash(*parts) -> str:
+    """
+    Stable sha256 of JSON-serialisable parts: manifests, rendered values, chart names and versions
+    """
+    canonical = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def file_contents(path: str) -> str:
+    with open(path, "r") as f:
+        return f.read()
+
+
+def object_hash(obj: dict) -> str:
+    """
+    Hash of a manifest, ignoring its status and any hash annotation it already carries
+    """
+    obj = {key: value for key, value in obj.items() if key != "status"}
+    metadata = dict(obj.get("metadata") or {})
+    annotations = {key: value for key, value in (metadata.get("annotations") or {}).items() if key != HASH_ANNOTATION}
+    if annotations:
+        metadata["annotations"] = annotations
+    else:
+        metadata.pop("annotations", None)
+    obj["metadata"] = metadata
+    return desired_state_hash(obj)
+
+
+def annotated_hash(obj: typing.Optional[dict]) -> typing.Optional[str]:
+    if obj is None:
+        return None
+    return ((obj.get("metadata") or {}).get("annotations") or {}).get(HASH_ANNOTATION)
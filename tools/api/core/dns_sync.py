@@ -0,0 +1,180 @@
+import os
+import errno
+import fcntl
+import hashlib
+import tempfile
+import typing
+from contextlib import contextmanager
+
+
+HOSTS_FILE = "/etc/hosts"
+
+HOSTS = "hosts"
+DNSMASQ = "dnsmasq"
+# file for the CoreDNS hosts plugin, which reloads it when it changes
+COREDNS = "coredns"
+FORMATS = [HOSTS, DNSMASQ, COREDNS]
+
+BEGIN_MARKER = "# BEGIN k8s-admin-setup-utils managed block, do not edit"
+END_MARKER = "# END k8s-admin-setup-utils managed block"
+
+
+def parse_record(line: str, output_format: str) -> typing.List[typing.Tuple[str, str]]:
+    """
+    (hostname, address) pairs of a line in the given format
+    """
+    line = line.split("#", 1)[0].strip()
+    if not line:
+        return []
+    if output_format == DNSMASQ:
+        if not line.startswith("host-record="):
+            return []
+        *names, address = line[len("host-record="):].split(",")
+        return [(name, address) for name in names]
+    address, *names = line.split()
+    return [(name, address) for name in names]
+
+
+def render_records(records: typing.Dict[str, str], output_format: str) -> typing.List[str]:
+    if output_format == DNSMASQ:
+        return [f"host-record={name},{records[name]}" for name in sorted(records)]
+    return [f"{records[name]} {name}" for name in sorted(records)]
+
+
+class HostsSync:
+    """
+    Keep hostnames pointing at their addresses in a hosts file, or in a dnsmasq or CoreDNS file.
+    In a hosts file only a block between markers is owned by the tool, the rest of the file is kept
+    except for stale lines of the hostnames it manages. Dnsmasq and CoreDNS files are owned entirely.
+    Updates take an exclusive lock, are written with one atomic rename, or in place when the file
+    is a mount point that can not be replaced, and are skipped when nothing changed.
+    """
+
+    def __init__(self, path: str = HOSTS_FILE, output_format: str = HOSTS) -> None:
+        if output_format not in FORMATS:
+            raise ValueError(f"Unknown format {output_format}, expected one of {', '.join(FORMATS)}")
+        self.path = path
+        self.output_format = output_format
+
+    @property
+    def lock_path(self) -> str:
+        # outside of the directory of the file, so that no stray lock is left next to /etc/hosts
+        digest = hashlib.sha256(os.path.abspath(self.path).encode()).hexdigest()[:12]
+        return os.path.join(tempfile.gettempdir(), f"k8s-admin-setup-utils-hosts-{digest}.lock")
+
+    @contextmanager
+    def locked(self):
+        # lock a separate file, the hosts file itself is replaced by the rename
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            try:
+                # shared with runs as another user, e.g. with and without sudo
+                os.fchmod(fd, 0o666)
+            except PermissionError:
+                pass
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+
+    def read(self) -> typing.List[str]:
+        try:
+            with open(self.path, "r") as f:
+                return f.read().splitlines()
+        except FileNotFoundError:
+            return []
+
+    def split(self, lines: typing.List[str]) -> typing.Tuple[typing.List[str], typing.Dict[str, str]]:
+        """
+        Lines outside of the managed block and the records inside of it
+        """
+        if self.output_format != HOSTS:
+            return [], {name: address for line in lines for name, address in parse_record(line, self.output_format)}
+        outside, records, inside = [], {}, False
+        for line in lines:
+            if line.strip() == BEGIN_MARKER:
+                inside = True
+            elif line.strip() == END_MARKER:
+                inside = False
+            elif inside:
+                records.update({name: address for name, address in parse_record(line, HOSTS)})
+            else:
+                outside.append(line)
+        return outside, records
+
+    @staticmethod
+    def without_names(line: str, names: typing.Container[str]) -> typing.Optional[str]:
+        """
+        A line of the unmanaged part of a hosts file without the given hostnames, None if none are left
+        """
+        content, _, comment = line.partition("#")
+        fields = content.split()
+        if len(fields) < 2 or not any(name in names for name in fields[1:]):
+            return line
+        kept = [name for name in fields[1:] if name not in names]
+        if not kept:
+            return None
+        return " ".join([fields[0]] + kept) + (f" #{comment}" if comment else "")
+
+    def render(self, outside: typing.List[str], records: typing.Dict[str, str]) -> str:
+        if self.output_format != HOSTS:
+            return "\n".join(render_records(records, self.output_format)) + "\n"
+        lines = [kept for kept in (self.without_names(line, records) for line in outside) if kept is not None]
+        while lines and not lines[-1].strip():
+            lines.pop()
+        if records:
+            lines += ["", BEGIN_MARKER] + render_records(records, HOSTS) + [END_MARKER]
+        return "\n".join(lines) + "\n"
+
+    def write(self, content: str) -> None:
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(self.path)}.")
+        replaced = False
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(content)
+                f.flush()
+                os.fsync(f.fileno())
+            if os.path.exists(self.path):
+                stat = os.stat(self.path)
+                os.chmod(tmp_path, stat.st_mode)
+                try:
+                    os.chown(tmp_path, stat.st_uid, stat.st_gid)
+                except PermissionError:
+                    pass
+            else:
+                os.chmod(tmp_path, 0o644)
+            try:
+                os.replace(tmp_path, self.path)
+                replaced = True
+            except OSError as e:
+                if e.errno != errno.EBUSY:
+                    raise
+        finally:
+            if not replaced:
+                os.unlink(tmp_path)
+        if not replaced:
+            # a bind-mounted file, like /etc/hosts in a container, can not be renamed over. It is rewritten
+            # in place instead, other writers are kept out by the lock held while syncing.
+            with open(self.path, "w") as f:
+                f.write(content)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def sync(self, records: typing.Dict[str, str], prune: bool = False) -> bool:
+        """
+        Point the hostnames at their addresses, and with prune remove the other managed hostnames.
+        Returns whether the file had to be changed.
+        """
+        with self.locked():
+            lines = self.read()
+            outside, managed = self.split(lines)
+            managed = dict(records) if prune else dict(managed, **records)
+            content = self.render(outside, managed)
+            if lines and content == "\n".join(lines) + "\n":
+                return False
+            self.write(content)
+            return True
@@ -0,0 +1,138 @@
+import time
+import typing
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from api.core.events import event_key
+
+
+DEFAULT_WINDOW = 30
+DEFAULT_TOP = 5
+# Upper bound on the (object, reason) pairs remembered between digests
+DEFAULT_MAX_KEYS = 5000
+# Reasons tracked by the top-N counter, more than shown so that the shown ones are accurate
+REASON_CAPACITY = 64
+
+
+class SpaceSaving:
+    """
+    Approximate top-N counter over an unbounded stream in fixed memory (Metwally et al.).
+    When a new item arrives while all slots are taken, it replaces the least counted item and
+    inherits its count, which is kept as the possible over-estimate of the new item.
+    """
+
+    def __init__(self, capacity: int = REASON_CAPACITY) -> None:
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+
+    def add(self, item, count: int = 1) -> None:
+        if item in self.counts:
+            self.counts[item] += count
+            return
+        if len(self.counts) < self.capacity:
+            self.counts[item] = count
+            self.errors[item] = 0
+            return
+        evicted = min(self.counts, key=self.counts.get)
+        floor = self.counts.pop(evicted)
+        self.errors.pop(evicted)
+        self.counts[item] = floor + count
+        self.errors[item] = floor
+
+    def top(self, n: int) -> typing.List[typing.Tuple[typing.Any, int, int]]:
+        """
+        The n most frequent items as (item, count, maximum over-estimate)
+        """
+        items = sorted(self.counts.items(), key=lambda item: item[1], reverse=True)[:n]
+        return [(item, count, self.errors[item]) for item, count in items]
+
+    def clear(self) -> None:
+        self.counts.clear()
+        self.errors.clear()
+
+
+@dataclass
+class Aggregate:
+    event: dict
+    # whether the pair was already shown in the current window
+    shown: bool = False
+    window_count: int = 0
+    total: int = 0
+
+
+class EventAggregator:
+    """
+    Collapse repeated events by (involved object, reason). The first event of a pair is shown
+    immediately; repeats within the window are only counted and summarised in the next digest.
+    Pairs are kept in a bounded LRU, so memory does not grow with the number of distinct objects.
+    """
+
+    def __init__(self, window: float = DEFAULT_WINDOW, top: int = DEFAULT_TOP,
+                 max_keys: int = DEFAULT_MAX_KEYS) -> None:
+        self.window = window
+        self.top_n = top
+        self.max_keys = max_keys
+        self.aggregates = OrderedDict()
+        self.reasons = SpaceSaving()
+        self.window_started = time.monotonic()
+        self.window_events = 0
+        self.evicted = 0
+
+    def add(self, event: dict) -> bool:
+        """
+        Count an event, returns whether it should be shown now
+        """
+        occurrences = 1 + event.get("_merged", 0)
+        key = event_key(event)
+        self.window_events += occurrences
+        self.reasons.add((event.get("type") or "", event.get("reason") or ""), occurrences)
+        aggregate = self.aggregates.pop(key, None)
+        if aggregate is None:
+            aggregate = Aggregate(event=event)
+            if len(self.aggregates) >= self.max_keys:
+                self.aggregates.popitem(last=False)
+                self.evicted += 1
+        first = not aggregate.shown
+        aggregate.event = event
+        aggregate.shown = True
+        aggregate.total += occurrences
+        if not first:
+            aggregate.window_count += occurrences
+        self.aggregates[key] = aggregate
+        return first
+
+    def digest_due(self, now: typing.Optional[float] = None) -> bool:
+        return (now or time.monotonic()) - self.window_started >= self.window
+
+    def digest(self, now: typing.Optional[float] = None) -> typing.List[str]:
+        """
+        Summary of the window that just ended, and start a new one
+        """
+        now = now or time.monotonic()
+        elapsed = max(now - self.window_started, 1e-6)
+        repeated = sorted((a for a in self.aggregates.values() if a.window_count), key=lambda a: a.window_count,
+                          reverse=True)
+        lines = [f"{self.window_events} events in {elapsed:.0f}s ({self.window_events * 60 / elapsed:.0f}/min), "
+                 f"{len(self.aggregates)} objects tracked"
+                 + (f", {self.evicted} forgotten" if self.evicted else "")]
+        for aggregate in repeated[:self.top_n]:
+            involved = aggregate.event.get("involvedObject") or {}
+            lines.append(f"  {involved.get('kind', '')}/{involved.get('name', '')} {aggregate.event.get('reason', '')} "
+                         f"repeated {aggregate.window_count}x ({aggregate.total} total): "
+                         f"{(aggregate.event.get('message') or '').strip()}")
+        if len(repeated) > self.top_n:
+            lines.append(f"  ... and {len(repeated) - self.top_n} more repeating objects")
+        top = self.reasons.top(self.top_n)
+        if top:
+            lines.append("  top reasons: " + ", ".join(
+                f"{reason} ({event_type}) {count}" + (f"±{error}" if error else "")
+                for (event_type, reason), count, error in top))
+        for aggregate in self.aggregates.values():
+            aggregate.shown = False
+            aggregate.window_count = 0
+        self.reasons.clear()
+        self.window_started = now
+        self.window_events = 0
+        self.evicted = 0
+        return lines
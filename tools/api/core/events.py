@@ -0,0 +1,204 @@
+import json
+import socket
+import threading
+import typing
+from collections import OrderedDict
+
+from kubernetes.client.exceptions import ApiException
+from kubernetes.watch.watch import iter_resp_lines
+
+from api.core.resources import ResourceClient
+
+
+DEFAULT_QUEUE_SIZE = 1000
+# Seconds to wait for each stream to end when the watcher stops
+STOP_TIMEOUT = 2
+# Seconds the API server keeps a watch open before it is re-opened from the last resourceVersion
+WATCH_TIMEOUT = 300
+RECONNECT_MAX_DELAY = 30
+
+
+def event_key(event: dict) -> tuple:
+    """
+    Events about the same object for the same reason are coalesced while they wait to be printed
+    """
+    involved = event.get("involvedObject") or {}
+    return (event["metadata"].get("namespace"), involved.get("kind"), involved.get("name"), event.get("reason"))
+
+
+class CoalescingQueue:
+    """
+    Bounded queue of events. An event whose key is already queued replaces the queued one and adds
+    up its count, and once the queue is full events with new keys are dropped and counted, so a
+    slow consumer never builds an unbounded backlog.
+    """
+
+    def __init__(self, maxsize: int = DEFAULT_QUEUE_SIZE) -> None:
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._condition = threading.Condition()
+        self.dropped = 0
+        self.coalesced = 0
+
+    def put(self, event: dict) -> None:
+        key = event_key(event)
+        with self._condition:
+            if key in self._items:
+                queued = self._items[key]
+                event = dict(event, count=max(event.get("count") or 1, (queued.get("count") or 1) + 1),
+                             _merged=queued.get("_merged", 0) + 1)
+                self._items[key] = event
+                self.coalesced += 1
+            elif len(self._items) >= self.maxsize:
+                self.dropped += 1
+                return
+            else:
+                self._items[key] = event
+            self._condition.notify()
+
+    def get(self, timeout: typing.Optional[float] = None) -> typing.Optional[dict]:
+        with self._condition:
+            if not self._items and not self._condition.wait_for(lambda: self._items, timeout=timeout):
+                return None
+            _, event = self._items.popitem(last=False)
+            return event
+
+    def take_dropped(self) -> int:
+        with self._condition:
+            dropped, self.dropped = self.dropped, 0
+            return dropped
+
+
+class EventStream(threading.Thread):
+    """
+    Follow the events of one namespace, or of all of them, from a single long-running watch.
+    The watch asks for bookmarks and is re-opened from the last resourceVersion it saw, so a
+    disconnect neither loses nor replays events. When that resourceVersion has expired the stream
+    continues from the current state and reports the gap.
+    """
+
+    def __init__(self, resources: ResourceClient, namespace: typing.Optional[str], queue: CoalescingQueue,
+                 log: typing.Callable[[str], None] = print) -> None:
+        super().__init__(daemon=True, name=f"events-{namespace or 'all'}")
+        self.resources = resources
+        self.namespace = namespace
+        self.queue = queue
+        self.log = log
+        self.resource_version = None
+        self.stopped = threading.Event()
+        self.response = None
+
+    @property
+    def scope(self) -> str:
+        return f"namespace {self.namespace}" if self.namespace else "all namespaces"
+
+    def current_resource_version(self, path: str) -> str:
+        return self.resources.request("GET", path, query=[("limit", 1)])["metadata"]["resourceVersion"]
+
+    def watch_once(self, path: str) -> None:
+        query = [("watch", "true"), ("allowWatchBookmarks", "true"), ("timeoutSeconds", WATCH_TIMEOUT)]
+        if self.resource_version:
+            query.append(("resourceVersion", self.resource_version))
+        response = self.resources.request("GET", path, query=query, preload_content=False,
+                                          request_timeout=(10, WATCH_TIMEOUT + 30))
+        self.response = response
+        try:
+            for line in iter_resp_lines(response):
+                if self.stopped.is_set():
+                    return
+                if not line or line.isspace():
+                    continue
+                event = json.loads(line)
+                obj = event.get("object") or {}
+                if event["type"] == "ERROR":
+                    raise ApiException(status=obj.get("code"), reason=obj.get("message"))
+                self.resource_version = (obj.get("metadata") or {}).get("resourceVersion") or self.resource_version
+                if event["type"] in ("ADDED", "MODIFIED"):
+                    self.queue.put(obj)
+        finally:
+            self.response = None
+            response.close()
+            response.release_conn()
+
+    def run(self) -> None:
+        path = self.resources.resource("v1", "Event").path(self.namespace)
+        delay = 1
+        while not self.stopped.is_set():
+            try:
+                self.watch_once(path)
+                delay = 1
+            except ApiException as e:
+                if e.status == 410:
+                    self.log(f"Event history of {self.scope} expired, continuing from the current state")
+                    self.resource_version = None
+                    try:
+                        self.resource_version = self.current_resource_version(path)
+                        continue
+                    except Exception:
+                        pass
+                self.log(f"Watch of {self.scope} failed ({e.status} {e.reason}), reconnecting in {delay}s")
+            except Exception as e:
+                if self.stopped.is_set():
+                    return
+                self.log(f"Watch of {self.scope} disconnected ({e.__class__.__name__}), reconnecting in {delay}s")
+            else:
+                continue
+            self.stopped.wait(delay)
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+    def stop(self) -> None:
+        self.stopped.set()
+        # a quiet watch blocks in a read until its timeout, shut its socket down to end the read now
+        sock = getattr(getattr(self.response, "connection", None), "sock", None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class EventWatcher:
+    """
+    Multiplex the event streams of several namespaces, or of the whole cluster, into one bounded queue
+    """
+
+    def __init__(self, resources: ResourceClient, namespaces: typing.Optional[typing.Iterable[str]] = None,
+                 queue_size: int = DEFAULT_QUEUE_SIZE, log: typing.Callable[[str], None] = print) -> None:
+        self.queue = CoalescingQueue(queue_size)
+        scopes = sorted(set(namespaces)) if namespaces else [None]
+        self.streams = [EventStream(resources, namespace, self.queue, log) for namespace in scopes]
+
+    def start(self) -> None:
+        for stream in self.streams:
+            stream.start()
+
+    def stop(self, timeout: float = STOP_TIMEOUT) -> None:
+        for stream in self.streams:
+            stream.stop()
+        for stream in self.streams:
+            if stream.is_alive():
+                stream.join(timeout)
+
+    def events(self, idle_timeout: float = 1.0) -> typing.Iterator[typing.Union[dict, int, None]]:
+        """
+        Yield events as they arrive, the number of events dropped since the last report
+        whenever events had to be dropped, and None when no event arrived within idle_timeout
+        """
+        self.start()
+        try:
+            while True:
+                dropped = self.queue.take_dropped()
+                if dropped:
+                    yield dropped
+                yield self.queue.get(timeout=idle_timeout)
+        finally:
+            self.stop()
+
+
+def format_event(event: dict) -> str:
+    involved = event.get("involvedObject") or {}
+    timestamp = event.get("lastTimestamp") or event.get("eventTime") or event["metadata"].get("creationTimestamp") or ""
+    count = event.get("count") or 1
+    repeated = f" (x{count})" if count > 1 else ""
+    return (f"{timestamp} {event['metadata'].get('namespace', '')} {event.get('type', '')} {event.get('reason', '')} "
+            f"{involved.get('kind', '')}/{involved.get('name', '')}: {(event.get('message') or '').strip()}{repeated}")
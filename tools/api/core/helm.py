@@ -0,0 +1,82 @@
+import os
+import time
+import threading
+import typing
+
+import yaml
+
+from api.core.constants import DEFAULT_REPO_TTL
+
+
+class HelmRepositories:
+    """
+    Add and refresh helm repositories one at a time instead of running a full `helm repo update`.
+    A repository is only re-indexed when its cached index is older than `ttl` seconds, and concurrent
+    requests for the same repository wait for the first one and reuse its fetch.
+    """
+
+    def __init__(self, ttl: float = DEFAULT_REPO_TTL) -> None:
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._repo_locks = {}
+        self._refreshed = set()
+        self._env = None
+
+    def repo_lock(self, name: str) -> threading.Lock:
+        with self._lock:
+            return self._repo_locks.setdefault(name, threading.Lock())
+
+    def env(self, run_process: typing.Callable, log_prefix: str) -> typing.Dict[str, str]:
+        if self._env is not None:
+            return self._env
+        # run outside of the lock, which guards every repository; concurrent first calls may both
+        # run `helm env`, its output is the same and the first result is kept
+        rcode, out, err = run_process(["helm", "env"], log_prefix=log_prefix)
+        env = {}
+        for line in out.splitlines():
+            key, _, value = line.partition("=")
+            env[key.strip()] = value.strip().strip('"')
+        with self._lock:
+            if self._env is None:
+                self._env = env
+            return self._env
+
+    @staticmethod
+    def configured_repositories(repository_config: str) -> typing.Dict[str, str]:
+        if not os.path.exists(repository_config):
+            return {}
+        with open(repository_config, "r") as f:
+            config = yaml.safe_load(f) or {}
+        return {repo["name"]: repo["url"] for repo in config.get("repositories") or []}
+
+    @staticmethod
+    def index_age(repository_cache: str, name: str) -> typing.Optional[float]:
+        index = os.path.join(repository_cache, f"{name}-index.yaml")
+        if not os.path.exists(index):
+            return None
+        return time.time() - os.path.getmtime(index)
+
+    def ensure(self, name: str, url: str, run_process: typing.Callable, log: typing.Callable[[str], None],
+               log_prefix: str) -> None:
+        with self.repo_lock(name):
+            if name in self._refreshed:
+                log(f"Helm repo {name} already refreshed by this run")
+                return
+            env = self.env(run_process, log_prefix)
+            repositories = self.configured_repositories(env["HELM_REPOSITORY_CONFIG"])
+            if repositories.get(name) != url:
+                # `helm repo add` downloads the index, no update needed afterwards
+                with self._write_lock:
+                    run_process(["helm", "repo", "add", name, url, "--force-update"], log_prefix=log_prefix)
+            else:
+                age = self.index_age(env["HELM_REPOSITORY_CACHE"], name)
+                if age is not None and age < self.ttl:
+                    log(f"Helm repo {name} index is {int(age)}s old, skipping update (ttl {int(self.ttl)}s)")
+                    self._refreshed.add(name)
+                    return
+                run_process(["helm", "repo", "update", name], log_prefix=log_prefix)
+            self._refreshed.add(name)
+
+
+helm_repositories = HelmRepositories()
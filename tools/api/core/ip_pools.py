@@ -0,0 +1,167 @@
+import bisect
+import ipaddress
+import typing
+from dataclasses import dataclass, field
+
+
+DEFAULT_WARN_THRESHOLD = 80
+
+
+def parse_range(address: str) -> typing.Tuple[int, int]:
+    """
+    First and last address of a MetalLB pool entry, either a CIDR or a "start-end" range, as integers
+    """
+    if "-" in address:
+        start, end = (ipaddress.ip_address(part.strip()) for part in address.split("-", 1))
+    else:
+        network = ipaddress.ip_network(address.strip(), strict=False)
+        start, end = network.network_address, network.broadcast_address
+    if start.version != end.version or int(start) > int(end):
+        raise ValueError(f"Invalid address range {address}")
+    return int(start), int(end)
+
+
+def format_range(start: int, end: int) -> str:
+    return str(ipaddress.ip_address(start)) if start == end else \
+        f"{ipaddress.ip_address(start)}-{ipaddress.ip_address(end)}"
+
+
+@dataclass
+class AddressPool:
+    name: str
+    ranges: typing.List[typing.Tuple[int, int]]
+    # MetalLB skips the .0 and .255 addresses of a pool with avoidBuggyIPs
+    avoid_buggy_ips: bool = False
+    auto_assign: bool = True
+    # addresses MetalLB does not assign and the number it can, computed once from the ranges
+    reserved: typing.FrozenSet[int] = field(init=False, repr=False)
+    size: int = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.reserved = frozenset(self.buggy_addresses()) if self.avoid_buggy_ips else frozenset()
+        self.size = sum(end - start + 1 for start, end in self.ranges) - len(self.reserved)
+
+    @classmethod
+    def from_object(cls, obj: dict) -> "AddressPool":
+        spec = obj.get("spec") or {}
+        return cls(name=obj["metadata"]["name"],
+                   ranges=sorted(parse_range(address) for address in spec.get("addresses") or []),
+                   avoid_buggy_ips=bool(spec.get("avoidBuggyIPs")),
+                   auto_assign=spec.get("autoAssign", True))
+
+    def buggy_addresses(self) -> typing.Iterator[int]:
+        for start, end in self.ranges:
+            if end > 0xFFFFFFFF:
+                continue
+            first = start - start % 256
+            for block in range(first, end + 1, 256):
+                yield from (address for address in (block, block + 255) if start <= address <= end)
+
+
+@dataclass
+class PoolUsage:
+    pool: AddressPool
+    # address to the namespace/name of the services holding it
+    allocations: typing.Dict[int, typing.List[str]] = field(default_factory=dict)
+    free: typing.List[typing.Tuple[int, int]] = field(default_factory=list)
+
+    @property
+    def used(self) -> int:
+        # a reserved address held through an explicit loadBalancerIP is listed, but is not part of the size
+        return len([address for address in self.allocations if address not in self.pool.reserved])
+
+    @property
+    def available(self) -> int:
+        return sum(end - start + 1 for start, end in self.free)
+
+    @property
+    def utilization(self) -> float:
+        return 100.0 * self.used / self.pool.size if self.pool.size else 100.0
+
+    @property
+    def largest_free(self) -> typing.Optional[typing.Tuple[int, int]]:
+        return max(self.free, key=lambda free: free[1] - free[0], default=None)
+
+
+class IntervalIndex:
+    """
+    Sorted, non-overlapping address intervals looked up by bisection
+    """
+
+    def __init__(self, intervals: typing.Iterable[typing.Tuple[int, int, typing.Any]]) -> None:
+        self.intervals = sorted(intervals, key=lambda interval: interval[0])
+        self.starts = [start for start, _, _ in self.intervals]
+
+    def find(self, address: int) -> typing.Optional[typing.Any]:
+        idx = bisect.bisect_right(self.starts, address) - 1
+        if idx >= 0 and self.intervals[idx][0] <= address <= self.intervals[idx][1]:
+            return self.intervals[idx][2]
+        return None
+
+
+def free_ranges(ranges: typing.List[typing.Tuple[int, int]], taken: typing.Iterable[int]) -> \
+        typing.List[typing.Tuple[int, int]]:
+    """
+    Parts of sorted ranges not covered by the taken addresses
+    """
+    taken = sorted(set(taken))
+    free = []
+    idx = 0
+    for start, end in ranges:
+        cursor = start
+        idx = bisect.bisect_left(taken, start, idx)
+        while idx < len(taken) and taken[idx] <= end:
+            if taken[idx] > cursor:
+                free.append((cursor, taken[idx] - 1))
+            cursor = taken[idx] + 1
+            idx += 1
+        if cursor <= end:
+            free.append((cursor, end))
+    return free
+
+
+def service_addresses(service: dict) -> typing.List[str]:
+    ingress = ((service.get("status") or {}).get("loadBalancer") or {}).get("ingress") or []
+    return [item["ip"] for item in ingress if item.get("ip")]
+
+
+def pool_usage(pools: typing.List[AddressPool], services: typing.List[dict]) -> \
+        typing.Tuple[typing.List[PoolUsage], typing.Dict[str, typing.List[str]], typing.List[str]]:
+    """
+    Usage of every pool by the given LoadBalancer services, plus the addresses held outside of
+    any pool and the services still waiting for an address
+    """
+    usages = [PoolUsage(pool) for pool in pools]
+    index = IntervalIndex((start, end, usage) for usage in usages for start, end in usage.pool.ranges)
+    outside, pending = {}, []
+    for service in services:
+        holder = f"{service['metadata'].get('namespace')}/{service['metadata']['name']}"
+        addresses = service_addresses(service)
+        if not addresses:
+            pending.append(holder)
+        for address in addresses:
+            usage = index.find(int(ipaddress.ip_address(address)))
+            if usage is None:
+                outside.setdefault(address, []).append(holder)
+            else:
+                usage.allocations.setdefault(int(ipaddress.ip_address(address)), []).append(holder)
+    for usage in usages:
+        usage.free = free_ranges(usage.pool.ranges, usage.pool.reserved.union(usage.allocations))
+    return usages, outside, pending
+
+
+def find_overlaps(ranges: typing.Iterable[typing.Tuple[int, int, typing.Any]]) -> \
+        typing.List[typing.Tuple[typing.Tuple[int, int, typing.Any], typing.Tuple[int, int, typing.Any]]]:
+    """
+    Pairs of overlapping ranges, found with one sweep over the ranges sorted by their start.
+    Each range is reported against the range reaching furthest before it, so n ranges cost
+    O(n log n) however large the CIDRs are.
+    """
+    overlaps = []
+    furthest = None
+    for current in sorted(ranges, key=lambda item: (item[0], item[1])):
+        if furthest is not None and current[0] <= furthest[1]:
+            overlaps.append((furthest, current))
+        if furthest is None or current[1] > furthest[1]:
+            furthest = current
+    return overlaps
@@ -0,0 +1,41 @@
+import threading
+
+from kubernetes.client.exceptions import ApiException
+
+from api.core.readiness import ReadinessWaiter, loadbalancer_ip, DEFAULT_TIMEOUT
+
+
+class LoadBalancerResolver:
+    """
+    External address of LoadBalancer Services, read through the API. A Service without an address
+    yet is watched until MetalLB assigns one. Addresses are cached per cluster for the rest of the
+    process, and concurrent lookups of the same Service share one read.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._service_locks = {}
+        self._addresses = {}
+
+    def service_lock(self, key: tuple) -> threading.Lock:
+        with self._lock:
+            return self._service_locks.setdefault(key, threading.Lock())
+
+    def resolve(self, waiter: ReadinessWaiter, namespace: str, name: str, timeout: float = DEFAULT_TIMEOUT) -> str:
+        key = (waiter.core_v1.api_client.configuration.host, namespace, name)
+        with self.service_lock(key):
+            if key in self._addresses:
+                return self._addresses[key]
+            try:
+                address = loadbalancer_ip(waiter.core_v1.read_namespaced_service(name, namespace))
+            except ApiException as e:
+                if e.status != 404:
+                    raise
+                address = None
+            if address is None:
+                address = waiter.loadbalancer_ip(namespace, name, timeout)
+            self._addresses[key] = address
+            return address
+
+
+loadbalancers = LoadBalancerResolver()
@@ -0,0 +1,137 @@
+import os
+import json
+import time
+import threading
+import typing
+from collections import defaultdict
+
+
+PROMETHEUS_PREFIX = "k8s_admin_setup"
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def write_atomically(path: str, content: str) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+class MetricsRecorder:
+    """
+    Collect timings of configuration steps, external processes and Kubernetes API calls for the
+    whole process, and export them as a JSON report and a Prometheus textfile.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.steps = []
+        self.processes = []
+        self.api_calls = []
+
+    def record_step(self, configuration: str, step: str, status: str, duration: float) -> None:
+        with self._lock:
+            self.steps.append({
+                "configuration": configuration, "step": step, "status": status, "duration": duration,
+            })
+
+    def record_process(self, command: typing.List[str], exit_code: typing.Optional[int], duration: float,
+                       bytes_out: int, bytes_err: int) -> None:
+        with self._lock:
+            self.processes.append({
+                "command": command, "exit_code": exit_code, "duration": duration,
+                "bytes_out": bytes_out, "bytes_err": bytes_err,
+            })
+
+    def record_api_call(self, method: str, path: str, status: typing.Optional[int], duration: float,
+                        bytes_read: int) -> dict:
+        call = {"method": method, "path": path, "status": status, "duration": duration, "bytes_read": bytes_read}
+        with self._lock:
+            self.api_calls.append(call)
+        return call
+
+    def add_bytes_read(self, call: dict, bytes_read: int) -> None:
+        with self._lock:
+            call["bytes_read"] += bytes_read
+
+    def report(self) -> dict:
+        with self._lock:
+            return {
+                "started": self.started,
+                "duration": time.time() - self.started,
+                "steps": list(self.steps),
+                "processes": list(self.processes),
+                "api_calls": list(self.api_calls),
+                "totals": {
+                    "steps": len(self.steps),
+                    "processes": len(self.processes),
+                    "process_seconds": sum(p["duration"] for p in self.processes),
+                    "process_bytes_out": sum(p["bytes_out"] for p in self.processes),
+                    "api_calls": len(self.api_calls),
+                    "api_seconds": sum(c["duration"] for c in self.api_calls),
+                    "api_bytes_read": sum(c["bytes_read"] for c in self.api_calls),
+                },
+            }
+
+    def prometheus(self) -> str:
+        report = self.report()
+        lines = []
+
+        def metric(name: str, kind: str, help_text: str, samples: typing.Iterable[typing.Tuple[dict, float]]):
+            lines.append(f"# HELP {PROMETHEUS_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {PROMETHEUS_PREFIX}_{name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{key}="{escape_label(val)}"' for key, val in labels.items())
+                label_text = f"{{{label_text}}}" if label_text else ""
+                lines.append(f"{PROMETHEUS_PREFIX}_{name}{label_text} {value}")
+
+        steps = defaultdict(float)
+        for s in report["steps"]:
+            steps[(s["configuration"], s["step"], s["status"])] += s["duration"]
+        metric("step_duration_seconds", "gauge", "Duration of a configuration step",
+               ((dict(configuration=c, step=st, status=status), v) for (c, st, status), v in steps.items()))
+
+        processes = defaultdict(lambda: [0, 0.0, 0])
+        for p in report["processes"]:
+            key = (p["command"][0] if p["command"] else "", str(p["exit_code"]))
+            processes[key][0] += 1
+            processes[key][1] += p["duration"]
+            processes[key][2] += p["bytes_out"] + p["bytes_err"]
+        metric("process_runs_total", "counter", "External processes run",
+               ((dict(command=c, exit_code=e), v[0]) for (c, e), v in processes.items()))
+        metric("process_duration_seconds_total", "counter", "Time spent in external processes",
+               ((dict(command=c, exit_code=e), v[1]) for (c, e), v in processes.items()))
+        metric("process_output_bytes_total", "counter", "Bytes written by external processes",
+               ((dict(command=c, exit_code=e), v[2]) for (c, e), v in processes.items()))
+
+        api_calls = defaultdict(lambda: [0, 0.0, 0])
+        for c in report["api_calls"]:
+            key = (c["method"], str(c["status"]))
+            api_calls[key][0] += 1
+            api_calls[key][1] += c["duration"]
+            api_calls[key][2] += c["bytes_read"]
+        metric("api_requests_total", "counter", "Kubernetes API requests",
+               ((dict(method=m, status=s), v[0]) for (m, s), v in api_calls.items()))
+        metric("api_request_duration_seconds_total", "counter", "Time spent in Kubernetes API requests",
+               ((dict(method=m, status=s), v[1]) for (m, s), v in api_calls.items()))
+        metric("api_response_bytes_total", "counter", "Bytes read from the Kubernetes API",
+               ((dict(method=m, status=s), v[2]) for (m, s), v in api_calls.items()))
+
+        metric("run_duration_seconds", "gauge", "Duration of the command", [({}, report["duration"])])
+        return "\n".join(lines) + "\n"
+
+    def export(self, prefix: str) -> typing.Tuple[str, str]:
+        """
+        Write <prefix>.json and <prefix>.prom
+        """
+        json_path, prometheus_path = f"{prefix}.json", f"{prefix}.prom"
+        write_atomically(json_path, json.dumps(self.report(), indent=4))
+        write_atomically(prometheus_path, self.prometheus())
+        return json_path, prometheus_path
+
+
+metrics = MetricsRecorder()
@@ -0,0 +1,24 @@
+import ipaddress
+import typing
+
+
+# Role labels of control-plane nodes, the second one is set by clusters created before Kubernetes 1.24
+CONTROL_PLANE_LABELS = ["node-role.kubernetes.io/control-plane", "node-role.kubernetes.io/master"]
+
+
+def node_address(node, address_type: str = "InternalIP") -> typing.Optional[str]:
+    for address in (node.status.addresses if node.status and node.status.addresses else []):
+        if address.type == address_type:
+            return address.address
+    return None
+
+
+def control_plane_addresses(nodes: typing.Iterable, labels: typing.Iterable[str] = CONTROL_PLANE_LABELS) -> \
+        typing.List[str]:
+    """
+    Sorted, unique InternalIPs of the nodes carrying any of the control-plane role labels
+    """
+    labels = list(labels)
+    addresses = {node_address(node) for node in nodes
+                 if any(label in (node.metadata.labels or {}) for label in labels)}
+    return sorted((address for address in addresses if address), key=ipaddress.ip_address)
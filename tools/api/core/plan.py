@@ -0,0 +1,182 @@
+import base64
+import difflib
+import hashlib
+import json
+import subprocess
+import time
+import typing
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+import yaml
+from kubernetes.client.exceptions import ApiException
+
+from api.core.apply import ApplyEngine
+from api.core.desired_state import HASH_ANNOTATION
+from api.core.metrics import metrics
+
+
+CREATE = "create"
+UPDATE = "update"
+UNCHANGED = "unchanged"
+
+# Metadata that is compared, everything else in metadata is owned by the API server
+COMPARED_METADATA = ["name", "namespace", "labels", "annotations"]
+
+
+@dataclass
+class HelmRelease:
+    name: str
+    namespace: str
+    chart: str
+    values: dict = field(default_factory=dict)
+
+    @property
+    def description(self) -> str:
+        return f"HelmRelease {self.namespace}/{self.name} ({self.chart})"
+
+
+@dataclass
+class PlannedChange:
+    description: str
+    action: str
+    diff: typing.List[str] = field(default_factory=list)
+    note: str = ""
+
+
+def merge_values(base: dict, override: dict) -> dict:
+    merged = dict(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_values(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def helm_values(files: typing.Iterable[str] = (), set_values: typing.Iterable[str] = ()) -> dict:
+    """
+    Values helm computes from `-f` files and `--set key.path=value` flags, in that order
+    """
+    values = {}
+    for path in files:
+        with open(path, "r") as f:
+            values = merge_values(values, yaml.safe_load(f) or {})
+    for assignment in set_values:
+        path, _, raw = assignment.partition("=")
+        override = yaml.safe_load(raw) if raw else None
+        for key in reversed(path.split(".")):
+            override = {key: override}
+        values = merge_values(values, override)
+    return values
+
+
+def prune(live, desired):
+    """
+    Keep only the parts of a live object that the desired manifest sets, so that defaults
+    filled in by the API server do not show up as changes
+    """
+    if isinstance(desired, dict) and isinstance(live, dict):
+        return {key: prune(live[key], value) for key, value in desired.items() if key in live}
+    if isinstance(desired, list) and isinstance(live, list) and len(desired) == len(live):
+        return [prune(l, d) for l, d in zip(live, desired)]
+    return live
+
+
+def mask_secret(obj: dict) -> dict:
+    if obj.get("kind") != "Secret":
+        return obj
+    obj = dict(obj)
+    data = dict(obj.get("data") or {})
+    for key, value in (obj.pop("stringData", None) or {}).items():
+        data[key] = base64.b64encode(str(value).encode()).decode()
+    if data:
+        obj["data"] = {key: f"<sha256:{hashlib.sha256(str(value).encode()).hexdigest()[:12]}>"
+                       for key, value in data.items()}
+    return obj
+
+
+def comparable(obj: typing.Optional[dict]) -> typing.Optional[dict]:
+    if obj is None:
+        return None
+    obj = {key: value for key, value in obj.items() if key != "status"}
+    metadata = obj.get("metadata") or {}
+    metadata = {key: metadata[key] for key in COMPARED_METADATA if metadata.get(key)}
+    annotations = {key: value for key, value in (metadata.get("annotations") or {}).items() if key != HASH_ANNOTATION}
+    if annotations:
+        metadata["annotations"] = annotations
+    else:
+        metadata.pop("annotations", None)
+    obj["metadata"] = metadata
+    return mask_secret(obj)
+
+
+def api_error(error: Exception) -> str:
+    if isinstance(error, ApiException):
+        return f"{error.status} {error.reason}"
+    return str(error)
+
+
+def diff(live: typing.Optional[dict], desired: dict) -> typing.List[str]:
+    before = yaml.safe_dump(live, sort_keys=True).splitlines() if live is not None else []
+    after = yaml.safe_dump(desired, sort_keys=True).splitlines()
+    return list(difflib.unified_diff(before, after, "live", "desired", lineterm=""))
+
+
+class Planner:
+    """
+    Compare the manifests and helm releases a configuration would apply with what is live in the
+    cluster. Live objects are read with concurrent GETs over the shared ApiClient, nothing is changed.
+    """
+
+    def __init__(self, apply_engine: ApplyEngine, max_workers: int = 8) -> None:
+        self.apply_engine = apply_engine
+        self.resources = apply_engine.resources
+        self.max_workers = max_workers
+
+    def plan_object(self, obj: dict) -> PlannedChange:
+        try:
+            resource, desired = self.apply_engine.prepare(obj)
+        except (ValueError, ApiException) as e:
+            return PlannedChange(f"{obj.get('kind')} {obj.get('metadata', {}).get('name')}", CREATE,
+                                 diff(None, comparable(obj)), note=api_error(e))
+        metadata = desired["metadata"]
+        name = f"{metadata['namespace']}/{metadata['name']}" if metadata.get("namespace") else metadata["name"]
+        description = f"{desired['kind']} {name}"
+        try:
+            live = self.resources.get(resource, metadata["name"], metadata.get("namespace"))
+        except ApiException as e:
+            # one object that can not be read (403, 5xx) does not stop the plan of the others
+            return PlannedChange(description, CREATE, diff(None, comparable(desired)),
+                                 note=f"live object could not be read, {api_error(e)}")
+        desired = comparable(desired)
+        if live is None:
+            return PlannedChange(description, CREATE, diff(None, desired))
+        changes = diff(comparable(prune(live, desired)), desired)
+        return PlannedChange(description, UPDATE if changes else UNCHANGED, changes)
+
+    def plan_release(self, release: HelmRelease) -> PlannedChange:
+        cmd = ["helm", "get", "values", release.name, "--namespace", release.namespace, "-o", "json"]
+        start = time.monotonic()
+        completed = subprocess.run(cmd, capture_output=True)
+        metrics.record_process(cmd, completed.returncode, time.monotonic() - start,
+                               len(completed.stdout), len(completed.stderr))
+        if completed.returncode != 0:
+            return PlannedChange(release.description, CREATE, diff(None, release.values))
+        live = json.loads(completed.stdout or b"null") or {}
+        changes = diff(live, release.values)
+        return PlannedChange(release.description, UPDATE if changes else UNCHANGED, changes)
+
+    def plan_one(self, item: typing.Union[dict, HelmRelease]) -> PlannedChange:
+        if isinstance(item, HelmRelease):
+            return self.plan_release(item)
+        return self.plan_object(item)
+
+    def plan(self, items: typing.Iterable[typing.Union[dict, HelmRelease]]) -> typing.List[PlannedChange]:
+        items = list(items)
+        items = [item for item in items if isinstance(item, HelmRelease)] + \
+            self.apply_engine.flatten(item for item in items if not isinstance(item, HelmRelease))
+        if not items:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(items))) as executor:
+            return list(executor.map(self.plan_one, items))
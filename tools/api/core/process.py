@@ -0,0 +1,75 @@
+import threading
+import typing
+from collections import deque
+
+
+DEFAULT_TAIL_LINES = 200
+
+
+class OutputTail:
+    """
+    Keep the last `max_lines` lines of a process output and count every byte seen,
+    so arbitrarily large outputs are relayed with bounded memory.
+    """
+
+    def __init__(self, max_lines: int = DEFAULT_TAIL_LINES) -> None:
+        self.lines = deque(maxlen=max_lines)
+        self.bytes = 0
+
+    def append(self, line: str) -> None:
+        self.lines.append(line)
+        self.bytes += len(line)
+
+    def text(self) -> str:
+        return "".join(self.lines)
+
+
+class StreamedOutput:
+    """
+    The stdout of a running process, counting the bytes read from it. Iterating yields lines, and `read`
+    makes it usable wherever a file object is expected (e.g. yaml.safe_load).
+    `returncode` and `stderr` are filled in once the process has exited.
+    """
+
+    def __init__(self, stream: typing.TextIO) -> None:
+        self.stream = stream
+        self.bytes = 0
+        self.returncode = None
+        self.stderr = ""
+
+    def read(self, size: int = -1) -> str:
+        data = self.stream.read(size)
+        self.bytes += len(data)
+        return data
+
+    def readline(self) -> str:
+        line = self.stream.readline()
+        self.bytes += len(line)
+        return line
+
+    def __iter__(self) -> typing.Iterator[str]:
+        for line in self.stream:
+            self.bytes += len(line)
+            yield line
+
+
+def drain(stream: typing.TextIO, tail: OutputTail) -> threading.Thread:
+    """
+    Read `stream` into `tail` on a background thread so the process never blocks on a full pipe
+    """
+    def read():
+        for line in stream:
+            tail.append(line)
+
+    thread = threading.Thread(target=read, daemon=True)
+    thread.start()
+    return thread
+
+
+def kill_after(proc, timeout: typing.Optional[float]) -> typing.Optional[threading.Timer]:
+    if timeout is None:
+        return None
+    timer = threading.Timer(timeout, proc.kill)
+    timer.daemon = True
+    timer.start()
+    return timer
@@ -0,0 +1,127 @@
+import time
+import typing
+
+from kubernetes import client, watch
+from kubernetes.client import ApiClient
+
+from api.core.resources import ResourceClient
+
+
+DEFAULT_TIMEOUT = 300
+
+
+def deployment_progress(deployment) -> typing.Tuple[bool, str]:
+    """
+    Mirror the checks of `kubectl rollout status deployment/<name>`
+    """
+    spec, status = deployment.spec, deployment.status
+    replicas = spec.replicas if spec.replicas is not None else 1
+    updated = status.updated_replicas or 0
+    available = status.available_replicas or 0
+    total = status.replicas or 0
+    if (deployment.metadata.generation or 0) > (status.observed_generation or 0):
+        return False, "waiting for the deployment spec update to be observed"
+    if updated < replicas:
+        return False, f"{updated} of {replicas} updated replicas"
+    if total > updated:
+        return False, f"{total - updated} old replicas pending termination"
+    if available < updated:
+        return False, f"{available} of {updated} updated replicas available"
+    return True, f"{available} of {replicas} replicas available"
+
+
+def daemonset_progress(daemonset) -> typing.Tuple[bool, str]:
+    """
+    Mirror the checks of `kubectl rollout status daemonset/<name>`
+    """
+    status = daemonset.status
+    desired = status.desired_number_scheduled or 0
+    updated = status.updated_number_scheduled or 0
+    available = status.number_available or 0
+    if (daemonset.metadata.generation or 0) > (status.observed_generation or 0):
+        return False, "waiting for the daemonset spec update to be observed"
+    if updated < desired:
+        return False, f"{updated} of {desired} pods updated"
+    if available < desired:
+        return False, f"{available} of {desired} updated pods available"
+    return True, f"{available} of {desired} pods available"
+
+
+def loadbalancer_ip(service) -> typing.Optional[str]:
+    load_balancer = service.status.load_balancer if service.status else None
+    for ingress in (load_balancer.ingress if load_balancer and load_balancer.ingress else []):
+        if ingress.ip or ingress.hostname:
+            return ingress.ip or ingress.hostname
+    return None
+
+
+def condition_progress(obj: dict, condition: str) -> typing.Tuple[bool, str]:
+    for item in obj.get("status", {}).get("conditions", []) or []:
+        if item.get("type") == condition:
+            message = item.get("message") or item.get("reason") or ""
+            return item.get("status") == "True", f"{condition}={item.get('status')} {message}".strip()
+    return False, f"condition {condition} not reported yet"
+
+
+class ReadinessWaiter:
+    """
+    Block until an object reaches a desired state by watching it through the API server.
+    The current state arrives as the first event of the watch, so a condition that already
+    holds returns immediately. Progress is reported through `log` whenever it changes.
+    """
+
+    def __init__(self, api_client: ApiClient, resources: ResourceClient,
+                 log: typing.Callable[[str], None] = print) -> None:
+        self.apps_v1 = client.AppsV1Api(api_client=api_client)
+        self.core_v1 = client.CoreV1Api(api_client=api_client)
+        self.resources = resources
+        self.log = log
+
+    def wait(self, list_function, name: str, namespace: typing.Optional[str],
+             progress: typing.Callable[[typing.Any], typing.Tuple[bool, str]], timeout: float):
+        deadline = time.monotonic() + timeout
+        last_message = f"{name} does not exist yet"
+        kwargs = {"field_selector": f"metadata.name={name}"}
+        if namespace is not None:
+            kwargs["namespace"] = namespace
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"Timed out after {timeout}s waiting for {name}: {last_message}")
+            event_watcher = watch.Watch()
+            for event in event_watcher.stream(list_function, timeout_seconds=max(1, int(remaining)), **kwargs):
+                if event["type"] == "DELETED":
+                    message, done = f"{name} was deleted", False
+                else:
+                    done, message = progress(event["object"])
+                if message != last_message:
+                    self.log(f"{name}: {message}")
+                    last_message = message
+                if done:
+                    event_watcher.stop()
+                    return event["object"]
+
+    def deployment(self, namespace: str, name: str, timeout: float = DEFAULT_TIMEOUT):
+        self.log(f"Waiting for deployment {namespace}/{name} to roll out")
+        return self.wait(self.apps_v1.list_namespaced_deployment, name, namespace, deployment_progress, timeout)
+
+    def daemonset(self, namespace: str, name: str, timeout: float = DEFAULT_TIMEOUT):
+        self.log(f"Waiting for daemonset {namespace}/{name} to roll out")
+        return self.wait(self.apps_v1.list_namespaced_daemon_set, name, namespace, daemonset_progress, timeout)
+
+    def loadbalancer_ip(self, namespace: str, name: str, timeout: float = DEFAULT_TIMEOUT) -> str:
+        self.log(f"Waiting for service {namespace}/{name} to get a LoadBalancer IP")
+
+        def progress(service):
+            ip = loadbalancer_ip(service)
+            return (True, f"LoadBalancer IP {ip}") if ip else (False, "LoadBalancer IP pending")
+
+        service = self.wait(self.core_v1.list_namespaced_service, name, namespace, progress, timeout)
+        return loadbalancer_ip(service)
+
+    def condition(self, api_version: str, kind: str, name: str, namespace: typing.Optional[str] = None,
+                  condition: str = "Ready", timeout: float = DEFAULT_TIMEOUT) -> dict:
+        self.log(f"Waiting for {kind} {name} to report {condition}")
+        resource = self.resources.resource(api_version, kind)
+        return self.wait(self.resources.list_function(resource), name, namespace if resource.namespaced else None,
+                         lambda obj: condition_progress(obj, condition), timeout)
@@ -0,0 +1,156 @@
+import json
+import inspect
+import threading
+import typing
+from dataclasses import dataclass
+from urllib.parse import urlencode
+
+from kubernetes.client import ApiClient
+from kubernetes.client.exceptions import ApiException
+from kubernetes.client.rest import RESTResponse
+
+
+def response_body(response) -> bytes:
+    """
+    Body of a REST client response, read on demand by newer clients and up front by older ones
+    """
+    if getattr(response, "data", None) is None and callable(getattr(response, "read", None)):
+        return response.read()
+    return response.data
+
+
+@dataclass(frozen=True)
+class Resource:
+    api_version: str
+    kind: str
+    plural: str
+    namespaced: bool
+
+    def path(self, namespace: typing.Optional[str] = None, name: typing.Optional[str] = None) -> str:
+        path = "/api/v1" if self.api_version == "v1" else f"/apis/{self.api_version}"
+        if self.namespaced and namespace:
+            path += f"/namespaces/{namespace}"
+        path += f"/{self.plural}"
+        if name:
+            path += f"/{name}"
+        return path
+
+
+class ResourceClient:
+    """
+    Generic access to any built-in or custom resource through an ApiClient.
+    Resources are looked up by apiVersion and kind with the discovery API, one request
+    per group version, and cached for the lifetime of the client.
+    """
+
+    def __init__(self, api_client: ApiClient) -> None:
+        self.api_client = api_client
+        self._discovery = {}
+        self._discovery_lock = threading.Lock()
+        self._preloads = None
+
+    def discover(self, api_version: str) -> typing.Dict[str, Resource]:
+        with self._discovery_lock:
+            if api_version not in self._discovery:
+                path = "/api/v1" if api_version == "v1" else f"/apis/{api_version}"
+                resource_list = self.request("GET", path)
+                self._discovery[api_version] = {
+                    item["kind"]: Resource(
+                        api_version=api_version,
+                        kind=item["kind"],
+                        plural=item["name"],
+                        namespaced=item["namespaced"]
+                    )
+                    for item in resource_list.get("resources", [])
+                    if "/" not in item["name"]
+                }
+            return self._discovery[api_version]
+
+    def resource(self, api_version: str, kind: str) -> Resource:
+        try:
+            resources = self.discover(api_version)
+        except ApiException as e:
+            if e.status == 404:
+                raise ValueError(f"API {api_version} is not served by the cluster, is its CRD installed?") from e
+            raise
+        if kind not in resources:
+            raise ValueError(f"Kind {kind} is not served by {api_version}, is its CRD installed?")
+        return resources[kind]
+
+    def resource_for(self, obj: dict) -> Resource:
+        return self.resource(obj["apiVersion"], obj["kind"])
+
+    def request(self, method: str, path: str, body=None, query: typing.Optional[list] = None,
+                content_type: str = "application/json", preload_content: bool = True, request_timeout=None):
+        """
+        Send a request through the REST client of the ApiClient, whose request method is the same in
+        old and new versions of the kubernetes client, unlike ApiClient.call_api. Returns the decoded
+        JSON body, or the raw urllib3 response to stream from without preload_content.
+        """
+        configuration = self.api_client.configuration
+        headers = dict(self.api_client.default_headers, **{"Accept": "application/json", "Content-Type": content_type})
+        for auth in configuration.auth_settings().values():
+            if auth.get("in") == "header" and auth.get("value"):
+                headers[auth["key"]] = auth["value"]
+        url = configuration.host + path + (f"?{urlencode(query)}" if query else "")
+        kwargs = {}
+        if self.rest_client_preloads():
+            # older clients read the body in the request unless told not to
+            kwargs["_preload_content"] = preload_content
+        response = self.api_client.rest_client.request(
+            method, url, headers=headers, body=self.api_client.sanitize_for_serialization(body),
+            _request_timeout=request_timeout, **kwargs
+        )
+        if not 200 <= response.status <= 299:
+            error = ApiException(status=response.status, reason=response.reason)
+            data = response_body(response)
+            error.body = data.decode("utf-8", "replace") if isinstance(data, bytes) else data
+            error.headers = getattr(response, "headers", None) or response.getheaders()
+            raise error
+        if not preload_content:
+            return response.response if isinstance(response, RESTResponse) else response
+        data = response_body(response)
+        return json.loads(data) if data else None
+
+    def rest_client_preloads(self) -> bool:
+        if self._preloads is None:
+            self._preloads = "_preload_content" in inspect.signature(self.api_client.rest_client.request).parameters
+        return self._preloads
+
+    def get(self, resource: Resource, name: str, namespace: typing.Optional[str] = None) -> typing.Optional[dict]:
+        try:
+            return self.request("GET", resource.path(namespace, name))
+        except ApiException as e:
+            if e.status == 404:
+                return None
+            raise
+
+    def list(self, resource: Resource, namespace: typing.Optional[str] = None, **query) -> dict:
+        return self.request("GET", resource.path(namespace), query=list(query.items()))
+
+    def patch(self, resource: Resource, name: str, namespace: typing.Optional[str], body,
+              content_type: str = "application/merge-patch+json", **query) -> dict:
+        return self.request("PATCH", resource.path(namespace, name), body=body,
+                            query=list(query.items()), content_type=content_type)
+
+    def list_function(self, resource: Resource):
+        """
+        Wrap list requests for a resource in a function that kubernetes.watch.Watch can stream from.
+        Watch passes snake_case keyword arguments, which are sent as camelCase query parameters.
+        """
+        def list_resource(namespace: typing.Optional[str] = None, **kwargs):
+            query = []
+            for key, value in kwargs.items():
+                if key.startswith("_") or value is None:
+                    continue
+                head, *tail = key.split("_")
+                if isinstance(value, bool):
+                    value = str(value).lower()
+                query.append((head + "".join(part.capitalize() for part in tail), value))
+            return self.request("GET", resource.path(namespace), query=query,
+                                preload_content=kwargs.get("_preload_content", True),
+                                request_timeout=kwargs.get("_request_timeout"))
+        return list_resource
+
+    def delete(self, resource: Resource, name: str, namespace: typing.Optional[str] = None, **query) -> dict:
+        return self.request("DELETE", resource.path(namespace, name), query=list(query.items()))
@@ -3,12 +3,22 @@ import subprocess
 import sys
 import io
 import os
+import time
 from contextlib import contextmanager
 
-from kubernetes import client
+from kubernetes import client, config
 from kubernetes.client import Configuration, ApiClient
 
 
+PROXY_PORT = 8080
+PROXY_HOST = f"http://127.0.0.1:{PROXY_PORT}"
+PROXY_READY_TIMEOUT = 30
+PROBE_REQUEST_TIMEOUT = 5
+PROBE_MAX_DELAY = 2
+
+_connection = {"direct": False, "configuration": None}
+
+
 @contextmanager
 def run(
     *args, check=False, return_stdout=False, env=None
@@ -39,28 +49,82 @@ def run(
     if return_stdout:
         return proc.stdout
 
+def use_direct_connection(direct: bool) -> None:
+    """
+    Select how kube_proxy connects: straight to the API server from the kubeconfig, or through
+    a `kubectl proxy` on PROXY_HOST.
+    """
+    _connection["direct"] = direct
+    _connection["configuration"] = None
+
+
+def api_configuration() -> Configuration:
+    """
+    Configuration for the connection opened by kube_proxy, the proxy address if none is open yet.
+    The same object is returned until the connection changes.
+    """
+    if _connection["configuration"] is None:
+        configuration = Configuration()
+        configuration.host = PROXY_HOST
+        _connection["configuration"] = configuration
+    return _connection["configuration"]
+
+
+def direct_configuration(kubeconfig) -> Configuration:
+    configuration = Configuration()
+    config.load_kube_config(config_file=kubeconfig, client_configuration=configuration)
+    return configuration
+
+
+def wait_for_api(configuration: Configuration, proc=None, timeout=PROXY_READY_TIMEOUT):
+    """
+    Probe the API server with exponential backoff until it answers or the deadline passes.
+    A single client is reused for every attempt.
+    """
+    deadline = time.monotonic() + timeout
+    delay = 0.1
+    api_client = ApiClient(configuration=configuration)
+    kubectl = client.CoreV1Api(api_client=api_client)
+    try:
+        while True:
+            if proc is not None and proc.poll() is not None:
+                raise RuntimeError(f"kubectl proxy exited with code {proc.returncode}")
+            try:
+                kubectl.list_node(limit=1, _request_timeout=PROBE_REQUEST_TIMEOUT)
+                return
+            except Exception as e:
+                if time.monotonic() + delay > deadline:
+                    raise TimeoutError(f"Kubernetes API at {configuration.host} not ready after {timeout}s: {e}") from e
+                print(f"Kubernetes API is not ready yet, retrying in {delay:.1f}s")
+            time.sleep(delay)
+            delay = min(delay * 2, PROBE_MAX_DELAY)
+    finally:
+        api_client.close()
+
+
 @contextmanager
 def kube_proxy(kubeconfig):
+    if _connection["direct"]:
+        configuration = direct_configuration(kubeconfig)
+        print(f"Connecting directly to {configuration.host}")
+        wait_for_api(configuration)
+        _connection["configuration"] = configuration
+        try:
+            yield None
+        finally:
+            _connection["configuration"] = None
+        return
+
     with run(
         "kubectl",
         "proxy",
-        "--port=8080",
+        f"--port={PROXY_PORT}",
         env={"KUBECONFIG": kubeconfig, "PATH": os.environ["PATH"]},
     ) as proc:
         print("Kubectl proxy started")
         print("Waiting for kubectl proxy to start")
-        while True:
-            try:
-                kubeconfig = Configuration()
-                kubeconfig.host = "http://127.0.0.1:8080"
-                api_client = ApiClient(configuration=kubeconfig)
-                kubectl = client.CoreV1Api(api_client=api_client)
-                kubectl.list_node()
-                print("Kubectl proxy is ready")
-                break
-            except Exception as e:
-                print("Kubectl proxy is not ready yet")
-                pass
+        wait_for_api(api_configuration(), proc=proc)
+        print("Kubectl proxy is ready")
         yield proc
         proc.terminate()
-        proc.kill()
\ No newline at end of file
+        proc.kill()
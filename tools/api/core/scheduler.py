@@ -0,0 +1,229 @@
+import time
+import threading
+import typing
+from concurrent.futures import Future, FIRST_COMPLETED, wait
+from dataclasses import dataclass
+
+from termcolor import colored
+
+
+PENDING = "pending"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+# completed by a previous run of the configuration
+RESUMED = "resumed"
+
+
+@dataclass
+class StepResult:
+    index: int
+    name: str
+    status: str = PENDING
+    duration: float = 0.0
+    error: typing.Optional[BaseException] = None
+    output: typing.Any = None
+
+    @property
+    def key(self) -> str:
+        # the same step can be listed more than once, so its position is part of its identity
+        return f"{self.index}:{self.name}"
+
+
+class StepScheduler:
+    """
+    Run the steps of a configuration as a dependency graph on at most `max_workers` threads.
+    A strictly sequential graph runs in the calling thread, so that Ctrl+C reaches its steps;
+    otherwise an interrupt cancels the run without waiting for the steps still running.
+    A step starts as soon as every step it depends on has succeeded. When a step fails,
+    every step that depends on it (directly or transitively) is cancelled, steps that are
+    already running are allowed to finish and the first failure is re-raised.
+    Steps listed in `completed` (step key to output) are not run again, and `on_success`
+    is called with the result of every step that succeeds.
+    """
+
+    def __init__(self, steps: typing.List[typing.Callable], dependencies: typing.Optional[dict] = None,
+                 max_workers: int = 4, completed: typing.Optional[typing.Dict[str, typing.Any]] = None,
+                 on_success: typing.Optional[typing.Callable[[StepResult], None]] = None) -> None:
+        self.steps = steps
+        self.max_workers = max(1, max_workers)
+        self.requirements = self.resolve_dependencies(steps, dependencies)
+        self.print_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.first_error = None
+        self.results = [StepResult(index=idx, name=step.__name__) for idx, step in enumerate(steps)]
+        self.completed = completed or {}
+        self.on_success = on_success
+
+    @staticmethod
+    def resolve_dependencies(steps: typing.List[typing.Callable], dependencies: typing.Optional[dict]):
+        """
+        Map every step index to the set of step indices it requires.
+        Without declared dependencies each step requires the one before it, which keeps
+        the original strictly sequential behaviour.
+        """
+        if dependencies is None:
+            return {idx: {idx - 1} if idx > 0 else set() for idx in range(len(steps))}
+
+        index_of = {}
+        for idx, step in enumerate(steps):
+            if step in index_of:
+                raise ValueError(
+                    f"Step {step.__name__} is listed more than once, dependencies can not be resolved")
+            index_of[step] = idx
+
+        requirements = {idx: set() for idx in range(len(steps))}
+        for step, required_steps in dependencies.items():
+            if step not in index_of:
+                raise ValueError(f"Dependencies declared for unknown step {step.__name__}")
+            for required_step in required_steps:
+                if required_step not in index_of:
+                    raise ValueError(
+                        f"Step {step.__name__} depends on unknown step {required_step.__name__}")
+                requirements[index_of[step]].add(index_of[required_step])
+
+        StepScheduler.check_acyclic(steps, requirements)
+        return requirements
+
+    @staticmethod
+    def check_acyclic(steps, requirements):
+        visiting, visited = set(), set()
+
+        def visit(idx):
+            if idx in visited:
+                return
+            if idx in visiting:
+                raise ValueError(f"Dependency cycle detected at step {steps[idx].__name__}")
+            visiting.add(idx)
+            for required in requirements[idx]:
+                visit(required)
+            visiting.remove(idx)
+            visited.add(idx)
+
+        for idx in requirements:
+            visit(idx)
+
+    def dependents_of(self, idx: int) -> typing.Set[int]:
+        dependents = set()
+        frontier = [idx]
+        while frontier:
+            current = frontier.pop()
+            for candidate, required in self.requirements.items():
+                if current in required and candidate not in dependents:
+                    dependents.add(candidate)
+                    frontier.append(candidate)
+        return dependents
+
+    def log(self, message, color=None, attrs=None):
+        with self.print_lock:
+            print(colored(message, color, attrs=attrs) if color else message, flush=True)
+
+    def execute(self, result: StepResult, step: typing.Callable, log_prefix: str, kwargs: dict):
+        start = time.monotonic()
+        try:
+            result.output = step(log_prefix, **kwargs)
+        finally:
+            result.duration = time.monotonic() - start
+
+    def is_chain(self) -> bool:
+        """
+        Whether no two steps can ever run at the same time, then they are run in the calling thread
+        """
+        return self.max_workers == 1 or all(idx - 1 in self.requirements[idx] for idx in range(1, len(self.steps)))
+
+    def start(self, result: StepResult, step: typing.Callable, log_prefix: str, kwargs: dict) -> Future:
+        """
+        Run a step on a daemon thread, so that an interrupted run does not wait for steps that never end
+        """
+        future = Future()
+        future.set_running_or_notify_cancel()
+
+        def work():
+            try:
+                self.execute(result, step, log_prefix, kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result.output)
+
+        threading.Thread(target=work, daemon=True, name=f"step-{result.name}").start()
+        return future
+
+    def finish(self, idx: int, error: typing.Optional[BaseException], done: set,
+               log_prefix_for: typing.Callable[[int, typing.Callable], str]) -> None:
+        result = self.results[idx]
+        if error is None:
+            result.status = SUCCEEDED
+            done.add(idx)
+            if self.on_success is not None:
+                self.on_success(result)
+            return
+        result.status = FAILED
+        result.error = error
+        self.first_error = self.first_error or error
+        self.log(f"{log_prefix_for(idx, self.steps[idx])}Failed: {error!r}", "red", attrs=["bold"])
+        for dependent in self.dependents_of(idx):
+            if self.results[dependent].status == PENDING:
+                self.results[dependent].status = CANCELLED
+                self.log(f"{log_prefix_for(dependent, self.steps[dependent])}Cancelled, "
+                         f"depends on failed step {result.name}", "yellow")
+
+    def interrupt(self, log_prefix_for: typing.Callable[[int, typing.Callable], str]) -> None:
+        self.stopped.set()
+        for idx, result in enumerate(self.results):
+            if result.status in (PENDING, RUNNING):
+                result.status = CANCELLED
+                self.log(f"{log_prefix_for(idx, self.steps[idx])}Interrupted", "yellow")
+
+    def run(self, log_prefix_for: typing.Callable[[int, typing.Callable], str], kwargs: dict) -> typing.List[StepResult]:
+        results = self.results
+        done = set()
+        running = {}
+
+        for idx, step in enumerate(self.steps):
+            result = results[idx]
+            if result.key in self.completed:
+                result.status = RESUMED
+                result.output = self.completed[result.key]
+                done.add(idx)
+                self.log(log_prefix_for(idx, step) + "Completed in a previous run, skipping", "cyan")
+
+        inline = self.is_chain()
+        try:
+            while not self.stopped.is_set():
+                for idx, step in enumerate(self.steps):
+                    result = results[idx]
+                    if len(running) >= self.max_workers:
+                        break
+                    if result.status != PENDING or not self.requirements[idx] <= done:
+                        continue
+                    log_prefix = log_prefix_for(idx, step)
+                    self.log(log_prefix + "Starting", "magenta", attrs=["bold"])
+                    result.status = RUNNING
+                    if inline:
+                        error = None
+                        try:
+                            self.execute(result, step, log_prefix, kwargs)
+                        except (Exception, SystemExit) as e:
+                            error = e
+                        self.finish(idx, error, done, log_prefix_for)
+                        break
+                    running[self.start(result, step, log_prefix, kwargs)] = idx
+                else:
+                    if not running:
+                        break
+
+                if inline or not running:
+                    continue
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    self.finish(running.pop(future), future.exception(), done, log_prefix_for)
+        except KeyboardInterrupt:
+            self.interrupt(log_prefix_for)
+            raise
+
+        if self.first_error is not None:
+            raise self.first_error
+        return results
@@ -0,0 +1,171 @@
+import time
+import typing
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from kubernetes import watch
+from kubernetes.client.exceptions import ApiException
+
+from api.core.resources import ResourceClient
+
+
+DEFAULT_TEARDOWN_TIMEOUT = 300
+# How long to wait for an object to go away after its finalizers were purged
+PURGE_TIMEOUT = 30
+
+DELETED = "deleted"
+ABSENT = "absent"
+STUCK = "stuck"
+FAILED = "failed"
+
+_options = {"purge_finalizers": False}
+
+
+def purge_finalizers(purge: bool) -> None:
+    """
+    Remove the finalizers of objects that are still terminating when a teardown times out
+    """
+    _options["purge_finalizers"] = purge
+
+
+def is_purging_finalizers() -> bool:
+    return _options["purge_finalizers"]
+
+
+@dataclass
+class DeletionTarget:
+    api_version: str
+    kind: str
+    name: str
+    namespace: typing.Optional[str] = None
+
+    @property
+    def description(self) -> str:
+        return f"{self.kind} {self.namespace}/{self.name}" if self.namespace else f"{self.kind} {self.name}"
+
+
+@dataclass
+class TeardownResult:
+    target: DeletionTarget
+    status: str = FAILED
+    duration: float = 0.0
+    finalizers: typing.List[str] = field(default_factory=list)
+    blocked_by: typing.List[str] = field(default_factory=list)
+    purged: bool = False
+    error: typing.Optional[Exception] = None
+
+
+def pending_finalizers(obj: dict) -> typing.List[str]:
+    finalizers = list((obj.get("metadata") or {}).get("finalizers") or [])
+    finalizers += [f for f in (obj.get("spec") or {}).get("finalizers") or [] if f not in finalizers]
+    return finalizers
+
+
+def blocking_conditions(obj: dict) -> typing.List[str]:
+    """
+    Messages of the conditions a terminating namespace reports about the content it still waits for
+    """
+    return [condition.get("message") for condition in (obj.get("status") or {}).get("conditions") or []
+            if condition.get("status") == "True" and condition.get("message")
+            and condition.get("type") in ("NamespaceContentRemaining", "NamespaceFinalizersRemaining",
+                                          "NamespaceDeletionContentFailure")]
+
+
+class TeardownEngine:
+    """
+    Delete objects concurrently through the API and watch each one until it is really gone,
+    not just marked for deletion. Objects still terminating at the deadline are reported with
+    the finalizers holding them, and their finalizers are removed when purging is enabled.
+    """
+
+    def __init__(self, resources: ResourceClient, log: typing.Callable[[str], None] = print,
+                 max_workers: int = 8) -> None:
+        self.resources = resources
+        self.log = log
+        self.max_workers = max_workers
+
+    def wait_until_gone(self, target: DeletionTarget, result: TeardownResult, timeout: float) -> bool:
+        resource = self.resources.resource(target.api_version, target.kind)
+        namespace = target.namespace if resource.namespaced else None
+        list_function = self.resources.list_function(resource)
+        deadline = time.monotonic() + timeout
+        last_state = None
+        while True:
+            obj = self.resources.get(resource, target.name, namespace)
+            if obj is None:
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            kwargs = {"field_selector": f"metadata.name={target.name}",
+                      "resource_version": obj["metadata"].get("resourceVersion")}
+            if namespace is not None:
+                kwargs["namespace"] = namespace
+            event_watcher = watch.Watch()
+            try:
+                for event in event_watcher.stream(list_function, timeout_seconds=max(1, int(remaining)), **kwargs):
+                    if event["type"] == "DELETED":
+                        event_watcher.stop()
+                        return True
+                    obj = event["object"]
+                    result.finalizers, result.blocked_by = pending_finalizers(obj), blocking_conditions(obj)
+                    state = (tuple(result.finalizers), tuple(result.blocked_by))
+                    if state != last_state and (result.finalizers or result.blocked_by):
+                        self.log(f"{target.description} terminating, finalizers: {', '.join(result.finalizers) or '-'}"
+                                 + "".join(f"; {message}" for message in result.blocked_by))
+                        last_state = state
+            except ApiException as e:
+                # the resourceVersion expired, start over from the current state
+                if e.status != 410:
+                    raise
+
+    def purge(self, target: DeletionTarget) -> None:
+        resource = self.resources.resource(target.api_version, target.kind)
+        namespace = target.namespace if resource.namespaced else None
+        obj = self.resources.get(resource, target.name, namespace)
+        if obj is None:
+            return
+        if (obj["metadata"].get("finalizers")):
+            self.resources.patch(resource, target.name, namespace, {"metadata": {"finalizers": None}})
+        if target.kind == "Namespace" and (obj.get("spec") or {}).get("finalizers"):
+            obj["spec"]["finalizers"] = []
+            self.resources.request("PUT", f"{resource.path(None, target.name)}/finalize", body=obj)
+
+    def teardown_one(self, target: DeletionTarget, timeout: float, purge: bool) -> TeardownResult:
+        result = TeardownResult(target=target)
+        start = time.monotonic()
+        try:
+            resource = self.resources.resource(target.api_version, target.kind)
+            try:
+                self.resources.delete(resource, target.name, target.namespace if resource.namespaced else None,
+                                      propagationPolicy="Background")
+            except ApiException as e:
+                if e.status != 404:
+                    raise
+                result.status = ABSENT
+                return result
+            if self.wait_until_gone(target, result, timeout):
+                result.status = DELETED
+            elif purge:
+                self.log(f"{target.description} still terminating after {timeout}s, purging finalizers "
+                         f"{', '.join(result.finalizers) or '-'}")
+                self.purge(target)
+                result.purged = True
+                result.status = DELETED if self.wait_until_gone(target, result, PURGE_TIMEOUT) else STUCK
+            else:
+                result.status = STUCK
+        except ValueError as e:
+            # the kind is not served anymore, so neither are its objects
+            result.status, result.error = ABSENT, e
+        except Exception as e:
+            result.status, result.error = FAILED, e
+        finally:
+            result.duration = time.monotonic() - start
+        return result
+
+    def teardown(self, targets: typing.List[DeletionTarget], timeout: float = DEFAULT_TEARDOWN_TIMEOUT,
+                 purge: bool = False) -> typing.List[TeardownResult]:
+        if not targets:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(targets))) as executor:
+            return list(executor.map(lambda target: self.teardown_one(target, timeout, purge), targets))
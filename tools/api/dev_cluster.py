@@ -1,6 +1,6 @@
 from termcolor import colored
 from api.core.base_configuration import BaseConfiguration
-import time
+from api.core.plan import HelmRelease, helm_values
 import os
 
 class DevClusterConfiguration(BaseConfiguration):
@@ -13,6 +13,14 @@ class DevClusterConfiguration(BaseConfiguration):
             self.restart_coredns_pods,
             self.restart_metrics_server,
         ]
+        self.dependencies = {
+            self.restart_coredns_pods: [self.check_config],
+            self.restart_metrics_server: [self.check_config],
+        }
+
+    def desired_state(self):
+        # only restarts deployments, there is no declarative state to compare
+        return []
 
     def check_config(self, log_prefix: str | None = None, **kwargs):
         if self.kubeconfig is None:
@@ -28,16 +36,14 @@ class DevClusterConfiguration(BaseConfiguration):
         self.run_process([
             "kubectl", "rollout", "restart", "deployment/coredns", "-n", "kube-system"
         ], log_prefix=log_prefix)
-        self.log(log_prefix, colored("Sleeping for 10s", "yellow"))
-        time.sleep(10)
+        self.wait_for_deployment(log_prefix, "kube-system", "coredns")
 
     def restart_metrics_server(self, log_prefix: str | None = None, **kwargs):
         self.log(log_prefix, colored("Restarting metrics server", "green"))
         self.run_process([
             "kubectl", "rollout", "restart", "deployment/metrics-server", "-n", "kube-system"
         ], log_prefix=log_prefix)
-        self.log(log_prefix, colored("Sleeping for 20s", "yellow"))
-        time.sleep(20)
+        self.wait_for_deployment(log_prefix, "kube-system", "metrics-server")
 
 
 class InstallCilium(BaseConfiguration):
@@ -45,6 +51,12 @@ class InstallCilium(BaseConfiguration):
         super().__init__()
         self.kubeconfig = kubeconfig
         self.kubemaster_ip = kubemaster_ip
+        self.cilium_set_values = [
+            f"global.k8sServiceHost={self.kubemaster_ip}",
+            f"global.k8sServicePort=6443",
+            "hubble.ui.enabled=true",
+            "hubble.relay.enabled=true",
+        ]
 
         self.steps = [
             self.check_config,
@@ -55,6 +67,9 @@ class InstallCilium(BaseConfiguration):
             self.wait_for_cilium_status
         ]
 
+    def desired_state(self):
+        return [HelmRelease("cilium", "kube-system", "cilium/cilium", helm_values(set_values=self.cilium_set_values))]
+
     def check_config(self, log_prefix: str | None = None, **kwargs):
         if self.kubeconfig is None:
             self.log(self.__class__.__name__, colored(
@@ -83,33 +98,24 @@ class InstallCilium(BaseConfiguration):
 
     def add_helm_repo(self, log_prefix: str | None = None, **kwargs):
         self.log(log_prefix, colored("Installing cilium helm repo", "green"))
-        self.run_process([
-            "helm", "repo", "add", "cilium", "https://helm.cilium.io/"
-        ], log_prefix=log_prefix)
+        self.ensure_helm_repo(log_prefix, "cilium", "https://helm.cilium.io/")
         
     def install_cilium(self, log_prefix: str | None = None, **kwargs):
         self.log(log_prefix, colored("Installing cilium", "green"))
-        self.run_process([
-            "helm", "install", "cilium", "cilium/cilium",
-            "--version", "1.12.3",
-            "--namespace", "kube-system",
-            "--set", f"global.k8sServiceHost={self.kubemaster_ip}",
-            "--set", f"global.k8sServicePort=6443",
-            "--set", "hubble.ui.enabled=true",
-            "--set", "hubble.relay.enabled=true",
-        ], log_prefix=log_prefix)
+        self.helm_upgrade(log_prefix, "cilium", "cilium/cilium", "kube-system", version="1.12.3",
+                          set_values=self.cilium_set_values)
 
     def restart_hubble(self, log_prefix: str | None = None, **kwargs):
         self.log(log_prefix, colored("Restarting hubble", "green"))
         self.run_process([
             "kubectl", "rollout", "restart", "deployment/hubble-relay", "-n", "kube-system"
         ], log_prefix=log_prefix)
-        self.log(log_prefix, colored("Sleeping for 10s", "yellow"))
-        time.sleep(10)
+        self.wait_for_deployment(log_prefix, "kube-system", "hubble-relay")
         self.log(log_prefix, colored("Restarting hubble-ui", "green"))
         self.run_process([
             "kubectl", "rollout", "restart", "deployment/hubble-ui", "-n", "kube-system"
         ], log_prefix=log_prefix)
+        self.wait_for_deployment(log_prefix, "kube-system", "hubble-ui")
 
 
 class ExposeHubble(BaseConfiguration):
@@ -120,7 +126,6 @@ class ExposeHubble(BaseConfiguration):
         self.steps = [
             self.check_config,
             self.expose_hubble_ui,
-            self.wait_10s,
             self.get_loadbalancer_ip
         ]
 
@@ -141,7 +146,5 @@ class ExposeHubble(BaseConfiguration):
 
     def get_loadbalancer_ip(self, log_prefix: str | None = None, **kwargs):
         self.log(log_prefix, colored("Getting loadbalancer ip", "green"))
-        rcode, out, err = self.run_process([
-            "kubectl", "-n", "kube-system", "get", "svc", "hubble-ui", "-o", "jsonpath='{.status.loadBalancer.ingress[0].ip}'"
-        ], log_prefix=log_prefix)
-        self.log(log_prefix, colored(f"Loadbalancer ip: {out}", "green", "on_yellow"))
+        ip = self.wait_for_loadbalancer_ip(log_prefix, "kube-system", "hubble-ui")
+        self.log(log_prefix, colored(f"Loadbalancer ip: {ip}", "green", "on_yellow"))
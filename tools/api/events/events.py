@@ -0,0 +1,22 @@
+from api.core.base_configuration import BaseConfiguration
+from api.core.events import DEFAULT_QUEUE_SIZE
+from api.core.event_digest import DEFAULT_WINDOW, DEFAULT_TOP
+
+
+class WatchEvents(BaseConfiguration):
+    def __init__(self, kubeconfig: str, namespaces: list, queue_size: int = DEFAULT_QUEUE_SIZE,
+                 aggregate: bool = False, window: float = DEFAULT_WINDOW, top: int = DEFAULT_TOP) -> None:
+        super().__init__()
+        self.kubeconfig = kubeconfig
+        self.namespaces = list(namespaces)
+        self.queue_size = queue_size
+        self.aggregate = aggregate
+        self.window = window
+        self.top = top
+        self.steps = [
+            self.watch_events,
+        ]
+
+    def watch_events(self, log_prefix: str):
+        super().watch_events(log_prefix, self.namespaces, queue_size=self.queue_size, aggregate=self.aggregate,
+                             window=self.window, top=self.top)
@@ -1,5 +1,7 @@
 import logging
 from api.core.base_configuration import BaseConfiguration
+from api.core.event_digest import DEFAULT_WINDOW, DEFAULT_TOP
+from api.core.plan import HelmRelease, helm_values
 from termcolor import colored
 
 class InstallLonghorn(BaseConfiguration):
@@ -9,34 +11,28 @@ class InstallLonghorn(BaseConfiguration):
         self.longhorn_values = longhorn_values
         self.steps = [
             self.add_longhorn_helm_repo,
-            self.update_helm_repo,
             self.install_longhorn_helm_chart,
         ]
 
+    def desired_state(self):
+        return [HelmRelease("longhorn", "longhorn-system", "longhorn/longhorn", helm_values([self.longhorn_values]))]
+
     def add_longhorn_helm_repo(self, log_prefix: str):
         self.log(log_prefix, "Adding Longhorn Helm repo", logging.INFO)
-        self.run_process(["helm", "repo", "add", "longhorn", "https://charts.longhorn.io"],
-                         log_prefix=log_prefix)
-    
-    def update_helm_repo(self, log_prefix: str):
-        self.log(log_prefix, colored("Updating Helm repo", "blue"), logging.INFO)
-        self.run_process(["helm", "repo", "update"], log_prefix=log_prefix)
+        self.ensure_helm_repo(log_prefix, "longhorn", "https://charts.longhorn.io")
 
     def install_longhorn_helm_chart(self, log_prefix: str):
         self.log(log_prefix, colored("Installing Longhorn Helm chart", "blue"), logging.INFO)
-        self.run_process([
-            "helm", "install", "longhorn", "longhorn/longhorn", 
-            "-f", self.longhorn_values, 
-            "--create-namespace",
-            "-n", "longhorn-system"
-            ],
-            log_prefix=log_prefix
-        )
+        self.helm_upgrade(log_prefix, "longhorn", "longhorn/longhorn", "longhorn-system",
+                          values=[self.longhorn_values], create_namespace=True, stream=True)
 
 class WatchLonghornEvents(BaseConfiguration):
-    def __init__(self, kubeconfig: str):
+    def __init__(self, kubeconfig: str, aggregate: bool = False, window: float = DEFAULT_WINDOW, top: int = DEFAULT_TOP):
         super().__init__()
         self.kubeconfig = kubeconfig
+        self.aggregate = aggregate
+        self.window = window
+        self.top = top
         self.steps = [
             self.watch_longhorn_events,
         ]
@@ -45,7 +41,10 @@ class WatchLonghornEvents(BaseConfiguration):
         self.log(log_prefix, colored("Watching Longhorn events", "blue"), logging.INFO)
         self.watch_namespace_events(
             namespace="longhorn-system",
-            log_prefix=log_prefix
+            log_prefix=log_prefix,
+            aggregate=self.aggregate,
+            window=self.window,
+            top=self.top
         )
 
 class ExposeLonghornUIMetalLB(BaseConfiguration):
@@ -54,7 +53,6 @@ class ExposeLonghornUIMetalLB(BaseConfiguration):
         self.kubeconfig = kubeconfig
         self.steps = [
             self.expose_longhorn_ui_metallb,
-            self.wait_10s,
             self.get_loadbalancer_ip,
         ]
 
@@ -67,11 +65,8 @@ class ExposeLonghornUIMetalLB(BaseConfiguration):
     
     def get_loadbalancer_ip(self, log_prefix: str):
         self.log(log_prefix, colored("Getting LoadBalancer IP", "blue"), logging.INFO)
-        rcode, out, err = self.run_process([
-            "kubectl", "-n", "longhorn-system", "get", "svc", "longhorn-frontend",
-            "-o", "jsonpath='{.status.loadBalancer.ingress[0].ip}'"
-        ], log_prefix=log_prefix)
-        self.log(log_prefix, colored(f"LoadBalancer IP: {out}", "green", "on_yellow"), logging.INFO)
+        ip = self.wait_for_loadbalancer_ip(log_prefix, "longhorn-system", "longhorn-frontend")
+        self.log(log_prefix, colored(f"LoadBalancer IP: {ip}", "green", "on_yellow"), logging.INFO)
 
 class ExposeLonghornUI(BaseConfiguration):
     def __init__(self, kubeconfig: str, port: int):
@@ -88,5 +83,6 @@ class ExposeLonghornUI(BaseConfiguration):
             "kubectl", "port-forward", "svc/longhorn-frontend", f"{self.port}:80", 
             "-n", "longhorn-system"
             ],
-            log_prefix=log_prefix
+            log_prefix=log_prefix,
+            stream=True
         )
@@ -1,12 +1,14 @@
+import sys
+import typing
 import logging
-import tempfile
-import time
-import json
+import yaml
 from termcolor import colored
 
-from kubernetes.client.exceptions import ApiException
-
 from api.core.base_configuration import BaseConfiguration
+from api.core.event_digest import DEFAULT_WINDOW, DEFAULT_TOP
+from api.core.plan import HelmRelease, helm_values
+from api.core.teardown import DeletionTarget
+from api.core.ip_pools import AddressPool, pool_usage, format_range, find_overlaps, parse_range, DEFAULT_WARN_THRESHOLD
 
 
 class InstallMetalLbHelmChart(BaseConfiguration):
@@ -17,35 +19,25 @@ class InstallMetalLbHelmChart(BaseConfiguration):
        
         self.steps = [
             self.add_metallb_helm_repo,
-            self.update_helm_repo,
             self.install_metallb_helm_chart,
             self.add_namespace_labels,
         ]
 
+    def desired_state(self):
+        return [HelmRelease("metallb", "metallb-system", "metallb/metallb", helm_values([self.metallb_values]))]
+
     def add_metallb_helm_repo(self, log_prefix: str):
         self.log(log_prefix, "Adding MetalLB Helm repo", logging.INFO)
-        self.run_process(["helm", "repo", "add", "metallb", "https://metallb.github.io/metallb"],
-                         log_prefix=log_prefix)
-
-    def update_helm_repo(self, log_prefix: str):
-        self.log(log_prefix, colored(
-            "Updating Helm repo", "blue"), logging.INFO)
-        self.run_process(["helm", "repo", "update"], log_prefix=log_prefix)
+        self.ensure_helm_repo(log_prefix, "metallb", "https://metallb.github.io/metallb")
 
     def install_metallb_helm_chart(self, log_prefix: str):
         self.log(log_prefix, colored(
             "Installing MetalLB Helm chart", "blue"), logging.INFO)
-        self.run_process([
-            "helm", "install", "metallb", "metallb/metallb",
-            "-f", self.metallb_values,
-            "--create-namespace",
-            "-n", "metallb-system"
-        ],
-            log_prefix=log_prefix
-        )
+        self.helm_upgrade(log_prefix, "metallb", "metallb/metallb", "metallb-system",
+                          values=[self.metallb_values], create_namespace=True)
 
-        self.log(log_prefix, colored("Sleeping for 15 seconds", "blue"), logging.INFO)
-        time.sleep(15)
+        self.wait_for_deployment(log_prefix, "metallb-system", "metallb-controller")
+        self.wait_for_daemonset(log_prefix, "metallb-system", "metallb-speaker")
 
     def add_namespace_labels(self, log_prefix: str):
         self.log(log_prefix, colored(
@@ -101,32 +93,158 @@ class InstallCustomResources(BaseConfiguration):
             }
         }
 
+    def desired_state(self):
+        return [self.ip_address_pool, self.l2_advertisement]
+
     def create_metallb_custom_resources(self, log_prefix: str):
         self.log(log_prefix, colored(
             "Creating MetalLB custom resources", "blue"), logging.INFO)
 
-        self.log(log_prefix, colored(f"Creating MetalLB IPAddressPool", "yellow"), logging.INFO)
         self.log(log_prefix, colored(f"IPAddressPool: {self.ip_address_pool}", "yellow"), logging.INFO)
-        with tempfile.NamedTemporaryFile(mode="w") as f:
-            f.write(json.dumps(self.ip_address_pool))
-            f.flush()
-            self.run_process([
-                "kubectl", "apply", "-f", f.name
-            ],
-                log_prefix=log_prefix
-            )
-
-        self.log(log_prefix, colored(f"Creating MetalLB L2Advertisement", "yellow"), logging.INFO)
         self.log(log_prefix, colored(f"L2Advertisement: {self.l2_advertisement}", "yellow"), logging.INFO)
-        with tempfile.NamedTemporaryFile(mode="w") as f:
-            f.write(json.dumps(self.l2_advertisement))
-            f.flush()
-            self.run_process([
-                "kubectl", "apply", "-f", f.name
-            ],
-                log_prefix=log_prefix
-            )
+        self.apply_objects(log_prefix, [self.ip_address_pool, self.l2_advertisement])
+
+
+NODE_ROLE_LABEL = "node-role.kubernetes.io"
+
+
+class InstallAddressPools(BaseConfiguration):
+    """
+    IPAddressPools and their L2Advertisements from a spec file of the form
+
+        pools:
+          - name: infra
+            addresses: [172.16.16.200-172.16.16.220, 172.16.17.0/28]
+            autoAssign: true          # optional
+            avoidBuggyIPs: false      # optional
+            nodeRoles: [infra]        # optional, announce only from nodes with these roles
+            nodeSelectors: []         # optional, raw L2Advertisement node selectors
+            interfaces: []            # optional
+    """
+
+    def __init__(self, kubeconfig: str, spec_file: str) -> None:
+        super().__init__()
+        self.kubeconfig = kubeconfig
+        self.spec_file = spec_file
+        self.steps = [
+            self.validate_pools,
+            self.apply_pools,
+        ]
+
+    def load_spec(self) -> list:
+        with open(self.spec_file, "r") as f:
+            spec = yaml.safe_load(f)
+        if spec is None:
+            return []
+        if not isinstance(spec, dict) or not isinstance(spec.get("pools") or [], list):
+            self.log(self.__class__.__name__, colored(
+                f"{self.spec_file} must be a mapping with a list of pools under 'pools'", "red", attrs=["bold"]))
+            sys.exit(1)
+        return spec.get("pools") or []
+
+    def live_pools(self, log_prefix: str) -> list:
+        try:
+            pools = self.resources.list(self.resources.resource("metallb.io/v1beta1", "IPAddressPool"))["items"]
+        except ValueError as e:
+            self.log(log_prefix, colored(str(e), "red"))
+            sys.exit(1)
+        return [AddressPool.from_object(pool) for pool in pools]
+
+    def check_pools(self, pools: list, live_pools: typing.Optional[list] = None) -> list:
+        """
+        Errors of the pools in the spec, including overlaps with each other and with the live
+        pools that the spec does not replace
+        """
+        errors, names, ranges = [], set(), []
+        for idx, pool in enumerate(pools):
+            if not isinstance(pool, dict):
+                errors.append(f"pool #{idx + 1} must be a mapping, got {pool!r}")
+                continue
+            name = pool.get("name")
+            if not name:
+                errors.append(f"pool #{idx + 1} has no name")
+                continue
+            if name in names:
+                errors.append(f"pool {name} is defined more than once")
+            names.add(name)
+            addresses = pool.get("addresses")
+            if not addresses:
+                errors.append(f"pool {name} has no addresses")
+                continue
+            if not isinstance(addresses, list):
+                errors.append(f"pool {name}: addresses must be a list, got {addresses!r}")
+                continue
+            for address in addresses:
+                try:
+                    start, end = parse_range(str(address))
+                except ValueError as e:
+                    errors.append(f"pool {name}: {e}")
+                    continue
+                ranges.append((start, end, (f"{name} {address}", False)))
+        for live in live_pools or []:
+            if live.name not in names:
+                ranges += [(start, end, (f"{live.name} {format_range(start, end)} (in the cluster)", True))
+                           for start, end in live.ranges]
+        for (start, end, (first, first_live)), (other_start, other_end, (second, second_live)) in \
+                find_overlaps(ranges):
+            if first_live and second_live:
+                continue
+            overlap = format_range(max(start, other_start), min(end, other_end))
+            errors.append(f"pool {first} overlaps pool {second} at {overlap}")
+        return errors
 
+    def pool_objects(self, pool: dict) -> list:
+        ip_address_pool = {
+            "apiVersion": "metallb.io/v1beta1",
+            "kind": "IPAddressPool",
+            "metadata": {
+                "name": pool["name"],
+                "namespace": "metallb-system"
+            },
+            "spec": {
+                "addresses": [str(address) for address in pool["addresses"]],
+                "autoAssign": pool.get("autoAssign", True),
+                "avoidBuggyIPs": pool.get("avoidBuggyIPs", False),
+            }
+        }
+        node_selectors = list(pool.get("nodeSelectors") or [])
+        node_selectors += [{"matchExpressions": [{"key": f"{NODE_ROLE_LABEL}/{role}", "operator": "Exists"}]}
+                           for role in pool.get("nodeRoles") or []]
+        l2_advertisement = {
+            "apiVersion": "metallb.io/v1beta1",
+            "kind": "L2Advertisement",
+            "metadata": {
+                "name": f"{pool['name']}-advertisement",
+                "namespace": "metallb-system"
+            },
+            "spec": {
+                "ipAddressPools": [pool["name"]]
+            }
+        }
+        if node_selectors:
+            l2_advertisement["spec"]["nodeSelectors"] = node_selectors
+        if pool.get("interfaces"):
+            l2_advertisement["spec"]["interfaces"] = list(pool["interfaces"])
+        return [ip_address_pool, l2_advertisement]
+
+    def desired_state(self):
+        return [obj for pool in self.load_spec() for obj in self.pool_objects(pool)]
+
+    def validate_pools(self, log_prefix: str):
+        pools = self.load_spec()
+        errors = self.check_pools(pools, self.live_pools(log_prefix))
+        if errors:
+            for error in errors:
+                self.log(log_prefix, colored(error, "red"))
+            self.log(log_prefix, colored(f"{self.spec_file} is invalid, nothing was applied", "red", attrs=["bold"]))
+            sys.exit(1)
+        self.log(log_prefix, colored(f"{len(pools)} pools in {self.spec_file} are valid", "green"))
+
+    def apply_pools(self, log_prefix: str):
+        self.log(log_prefix, colored(
+            "Applying MetalLB address pools", "blue"), logging.INFO)
+        # pools that did not change since they were applied are skipped by their desired state hash
+        self.apply_objects(log_prefix, self.desired_state())
 
 
 class UninstallMetalLb(BaseConfiguration):
@@ -167,22 +285,65 @@ class UninstallMetalLb(BaseConfiguration):
     def delete_metallb_namespace(self, log_prefix: str):
         self.log(log_prefix, colored(
             "Deleting MetalLB namespace", "blue"), logging.INFO)
-        try:
-            self.v1.delete_namespace(name="metallb-system")
-        except ApiException as e:
-            if e.status == 404:
-                self.log(log_prefix, colored(
-                    "MetalLB namespace does not exist", "blue"), logging.INFO)
-            else:
-                self.log(log_prefix, colored(
-                    f"Error deleting MetalLB namespace: {e}", "red"), logging.ERROR)
-                raise e
+        self.delete_objects(log_prefix, [DeletionTarget("v1", "Namespace", "metallb-system")])
 
         
 class WatchMetalLbEvents(BaseConfiguration):
-    def __init__(self, **kwargs) -> None:
-        super().__init__(**kwargs)
+    def __init__(self, kubeconfig: str, aggregate: bool = False, window: float = DEFAULT_WINDOW,
+                 top: int = DEFAULT_TOP) -> None:
+        super().__init__()
+        self.kubeconfig = kubeconfig
+        self.aggregate = aggregate
+        self.window = window
+        self.top = top
         self.steps = [self.watch_namespace_events]
 
     def watch_namespace_events(self, log_prefix: str):
-        super().watch_namespace_events("metallb-system", log_prefix)
\ No newline at end of file
+        super().watch_namespace_events("metallb-system", log_prefix, aggregate=self.aggregate, window=self.window,
+                                       top=self.top)
+
+class ReportMetalLbPools(BaseConfiguration):
+    def __init__(self, kubeconfig: str, warn_threshold: float = DEFAULT_WARN_THRESHOLD, summary: bool = False) -> None:
+        super().__init__()
+        self.kubeconfig = kubeconfig
+        self.warn_threshold = warn_threshold
+        self.summary = summary
+        self.steps = [
+            self.report_pools,
+        ]
+
+    def report_pools(self, log_prefix: str):
+        try:
+            pools = self.resources.list(self.resources.resource("metallb.io/v1beta1", "IPAddressPool"))["items"]
+        except ValueError as e:
+            self.log(log_prefix, colored(str(e), "red"))
+            sys.exit(1)
+        services = [service for service in self.resources.list(self.resources.resource("v1", "Service"))["items"]
+                    if (service.get("spec") or {}).get("type") == "LoadBalancer"]
+        usages, outside, pending = pool_usage([AddressPool.from_object(pool) for pool in pools], services)
+        exhausted = []
+        for usage in usages:
+            pool = usage.pool
+            largest = usage.largest_free
+            self.log(log_prefix, colored(
+                f"{pool.name} {', '.join(format_range(start, end) for start, end in pool.ranges)}: "
+                f"{usage.used}/{pool.size} used ({usage.utilization:.0f}%), {usage.available} free"
+                + (f" in {len(usage.free)} ranges, largest {format_range(*largest)}" if largest else "")
+                + ("" if pool.auto_assign else ", not auto-assigned"), "green", attrs=["bold"]))
+            if not self.summary:
+                for address, holders in sorted(usage.allocations.items()):
+                    self.log(log_prefix, f"  {format_range(address, address)} {', '.join(holders)}")
+                for start, end in usage.free:
+                    self.log(log_prefix, colored(f"  {format_range(start, end)} free", "cyan"))
+            if usage.utilization >= self.warn_threshold:
+                exhausted.append(usage)
+        for address, holders in sorted(outside.items()):
+            self.log(log_prefix, colored(f"{address} held by {', '.join(holders)} is outside of every pool", "yellow"))
+        if pending:
+            self.log(log_prefix, colored(f"{len(pending)} LoadBalancer services without an address: "
+                                         f"{', '.join(pending)}", "red"))
+        for usage in exhausted:
+            self.log(log_prefix, colored(
+                f"Pool {usage.pool.name} is {usage.utilization:.0f}% used, {usage.available} addresses left",
+                "red", attrs=["bold"]))
+        return {usage.pool.name: {"size": usage.pool.size, "used": usage.used} for usage in usages}
@@ -1,10 +1,13 @@
+import sys
 import yaml
-import json
-from tempfile import NamedTemporaryFile
+import ipaddress
 
 from termcolor import colored
 
 from api.core.base_configuration import BaseConfiguration
+from api.core.plan import HelmRelease
+from api.core.nodes import control_plane_addresses
+from api.core.teardown import DeletionTarget
 
 
 class InstallKubePrometheusStack(BaseConfiguration):
@@ -12,23 +15,54 @@ class InstallKubePrometheusStack(BaseConfiguration):
         super().__init__()
         self.kubeconfig = kubeconfig
         self.values = values
-        self.control_plane_nodes = [str(node).replace("'", "") for node in control_plane_nodes]
+        # discovered from the node role labels when none are given
+        self.control_plane_nodes = [str(node).replace("'", "") for node in control_plane_nodes or []]
         self.grafana_user = grafana_user
         self.grafana_password = grafana_password
+        self.grafana_secret = {
+            "apiVersion": "v1",
+            "kind": "Secret",
+            "metadata": {"name": "grafana-admin-credentials", "namespace": "monitoring"},
+            "type": "Opaque",
+            "stringData": {"admin-user": self.grafana_user, "admin-password": self.grafana_password},
+        }
+        self._rendered_values = None
         self.steps = [
             self.create_namespace,
             self.create_grafana_secret,
+            self.add_helm_repo,
             self.install_helm_repo
         ]
+        self.dependencies = {
+            self.create_grafana_secret: [self.create_namespace],
+            self.install_helm_repo: [self.create_grafana_secret, self.add_helm_repo],
+        }
+
+    def control_plane_endpoints(self) -> list:
+        if self.control_plane_nodes:
+            return sorted(set(self.control_plane_nodes), key=ipaddress.ip_address)
+        return control_plane_addresses(self.v1.list_node().items)
 
     def update_endpoints(self):
-        with open(self.values, "r") as f:
-            values = yaml.safe_load(f)
-        values['kubeControllerManager']['endpoints'] = self.control_plane_nodes
-        values['kubeScheduler']['endpoints'] = self.control_plane_nodes
-        values['kubeEtcd']['endpoints'] = self.control_plane_nodes
-        values['kubeProxy']['endpoints'] = self.control_plane_nodes
-        return values
+        """
+        Values file with the control-plane endpoints filled in, rendered once per run
+        """
+        if self._rendered_values is None:
+            with open(self.values, "r") as f:
+                values = yaml.safe_load(f)
+            endpoints = self.control_plane_endpoints()
+            for component in ["kubeControllerManager", "kubeScheduler", "kubeEtcd", "kubeProxy"]:
+                values.setdefault(component, {})["endpoints"] = endpoints
+            self._rendered_values = values
+        return self._rendered_values
+
+    def desired_state(self):
+        return [
+            {"apiVersion": "v1", "kind": "Namespace", "metadata": {"name": "monitoring"}},
+            self.grafana_secret,
+            HelmRelease("monitoring", "monitoring", "prometheus-community/kube-prometheus-stack",
+                        self.update_endpoints()),
+        ]
 
     def create_namespace(self, log_prefix: str):
         self.log(log_prefix, colored("Creating Monitoring Namespace", "green"))
@@ -42,46 +76,26 @@ class InstallKubePrometheusStack(BaseConfiguration):
         ], log_prefix=log_prefix)
 
     def create_grafana_secret(self, log_prefix: str):
-        secrets = self.v1.list_namespaced_secret(namespace="monitoring")
-        if "grafana-admin-credentials" in [secret.metadata.name for secret in secrets.items]:
-            self.log(log_prefix, colored("Grafana Secret already exists", "yellow"))
-            self.log(log_prefix, colored("Deleting existing secret grafana-admin-credentials", "red"))
-            self.v1.delete_namespaced_secret(
-                name="grafana-credentials",
-                namespace="monitoring"
-            )
-
         self.log(log_prefix, colored("Creating Grafana Secret", "green"))
-        self.run_process([
-            "kubectl", "create", "secret", "generic", "grafana-admin-credentials", 
-            "--from-literal=admin-user={}".format(self.grafana_user),
-            "--from-literal=admin-password={}".format(self.grafana_password), 
-            "--namespace", "monitoring"
-        ], log_prefix=log_prefix)
+        # an unchanged secret is skipped by its desired state hash
+        self.apply_objects(log_prefix, [self.grafana_secret])
 
-    def install_helm_repo(self, log_prefix: str):
-        self.log(log_prefix, colored("Installing Kube Prometheus Stack Helm Repo", "green"))
-        self.run_process([
-            "helm", "repo", "add", "prometheus-community", "https://prometheus-community.github.io/helm-charts"
-        ], log_prefix=log_prefix)
-
-        self.run_process([
-            "helm", "repo", "update"
-        ], log_prefix=log_prefix)
+    def add_helm_repo(self, log_prefix: str):
+        self.log(log_prefix, colored("Adding Kube Prometheus Stack Helm Repo", "green"))
+        self.ensure_helm_repo(log_prefix, "prometheus-community", "https://prometheus-community.github.io/helm-charts")
 
+    def install_helm_repo(self, log_prefix: str):
+        self.log(log_prefix, colored("Installing Kube Prometheus Stack Helm Chart", "green"))
         updated_values = self.update_endpoints()
-        self.log(log_prefix, colored("Updated Kube Prometheus Stack Helm Values ( Master Node IPs)", "green"))
-        with NamedTemporaryFile(mode="w") as values:
-            json_data = json.dumps(updated_values, indent=4)
-            values.write(json_data)
-            self.log(log_prefix, colored(f"Values {json_data}", "green"))
-            self.run_process([
-                "helm", "install", "monitoring", 
-                "prometheus-community/kube-prometheus-stack",
-                "-f", values.name,
-                "--namespace", "monitoring"
-            ], log_prefix=log_prefix)
-     
+        endpoints = updated_values["kubeControllerManager"]["endpoints"]
+        if not endpoints:
+            self.log(log_prefix, colored("No control plane nodes found, pass --control-plane-nodes", "red"))
+            sys.exit(1)
+        self.log(log_prefix, colored(f"Control plane endpoints: {', '.join(endpoints)}", "green"))
+        # the release is only upgraded when the rendered values, and with them the endpoints, changed
+        self.helm_upgrade(log_prefix, "monitoring", "prometheus-community/kube-prometheus-stack", "monitoring",
+                          rendered_values=updated_values)
+
 
 class UninstallKubePrometheusStack(BaseConfiguration):
     def __init__(self, kubeconfig: str):
@@ -93,6 +107,10 @@ class UninstallKubePrometheusStack(BaseConfiguration):
             self.delete_namespace,
             self.remove_crds
         ]
+        self.dependencies = {
+            self.delete_namespace: [self.uninstall_helm_repo],
+            self.remove_crds: [self.uninstall_helm_repo],
+        }
 
     def uninstall_helm_repo(self, log_prefix: str):
         self.log(log_prefix, colored("Uninstalling Kube Prometheus Stack Helm Repo", "green"))
@@ -102,9 +120,7 @@ class UninstallKubePrometheusStack(BaseConfiguration):
 
     def delete_namespace(self, log_prefix: str):
         self.log(log_prefix, colored("Deleting Monitoring Namespace", "green"))
-        self.run_process([
-            "kubectl", "delete", "namespace", "monitoring"
-        ], log_prefix=log_prefix)
+        self.delete_objects(log_prefix, [DeletionTarget("v1", "Namespace", "monitoring")])
 
     def remove_crds(self, log_prefix: str):
         crds = [
@@ -117,8 +133,7 @@ class UninstallKubePrometheusStack(BaseConfiguration):
           "servicemonitors.monitoring.coreos.com",
           "thanosrulers.monitoring.coreos.com",
         ]
-        for crd in crds:
-            self.log(log_prefix, colored(f"Deleting CRD {crd}", "green"))
-            self.run_process([
-                "kubectl", "delete", "crd", crd
-            ], log_prefix=log_prefix)
\ No newline at end of file
+        self.log(log_prefix, colored(f"Deleting {len(crds)} CRDs", "green"))
+        self.delete_objects(log_prefix, [
+            DeletionTarget("apiextensions.k8s.io/v1", "CustomResourceDefinition", crd) for crd in crds
+        ])
\ No newline at end of file
@@ -0,0 +1,162 @@
+import time
+import typing
+
+from termcolor import colored
+
+from api.core.base_configuration import BaseConfiguration
+from api.core.scheduler import SUCCEEDED, FAILED, RESUMED
+from api.dev_cluster import DevClusterConfiguration, InstallCilium
+from api.metallb.metallb import InstallMetalLbHelmChart, InstallCustomResources
+from api.longhorn.longhorn import InstallLonghorn
+from api.traefik.traefik import InstallTraefikHelmChart, InstallTraefikDefaultHeaders
+from api.cert_manager.cert_manager import InstallCertManagerHelmChart
+from api.monitoring.monitoring import InstallKubePrometheusStack
+
+
+STATUS_COLORS = {SUCCEEDED: "green", FAILED: "red", RESUMED: "cyan"}
+
+
+class InstallStack(BaseConfiguration):
+    """
+    Bring up every platform component, each one as a step of a dependency graph so that
+    components that do not depend on each other are installed at the same time.
+    """
+
+    def __init__(self, kubeconfig: str, kubemaster_ip: str,
+                 metallb_values: str, pool_name: str, start_ip: str, end_ip: str,
+                 longhorn_values: str, traefik_values: str, traefik_default_headers: str,
+                 certmanager_values: str, kube_prometheus_values: str, control_plane_nodes: list,
+                 grafana_user: str, grafana_password: str, skip: typing.Iterable[str] = ()) -> None:
+        super().__init__()
+        self.kubeconfig = kubeconfig
+        self.kubemaster_ip = kubemaster_ip
+        self.metallb_values = metallb_values
+        self.pool_name = pool_name
+        self.start_ip = start_ip
+        self.end_ip = end_ip
+        self.longhorn_values = longhorn_values
+        self.traefik_values = traefik_values
+        self.traefik_default_headers = traefik_default_headers
+        self.certmanager_values = certmanager_values
+        self.kube_prometheus_values = kube_prometheus_values
+        self.control_plane_nodes = control_plane_nodes
+        self.grafana_user = grafana_user
+        self.grafana_password = grafana_password
+
+        self.components = {
+            "cilium": self.install_cilium,
+            "dev-cluster": self.reload_dev_cluster,
+            "metallb": self.install_metallb,
+            "metallb-custom-resources": self.configure_metallb,
+            "longhorn": self.install_longhorn,
+            "traefik": self.install_traefik,
+            "traefik-default-headers": self.install_traefik_default_headers,
+            "certmanager": self.install_cert_manager,
+            "monitoring": self.install_monitoring,
+        }
+        self.steps = list(self.components.values())
+        self.dependencies = {
+            self.reload_dev_cluster: [self.install_cilium],
+            self.install_metallb: [self.reload_dev_cluster],
+            self.configure_metallb: [self.install_metallb],
+            self.install_longhorn: [self.reload_dev_cluster],
+            self.install_traefik: [self.configure_metallb],
+            self.install_traefik_default_headers: [self.install_traefik],
+            self.install_cert_manager: [self.reload_dev_cluster],
+            self.install_monitoring: [self.reload_dev_cluster],
+        }
+        self.skip_components(set(skip))
+
+    def skip_components(self, skip: typing.Set[str]):
+        """
+        Drop skipped components from the graph. Their dependents inherit their dependencies,
+        so the remaining ordering is preserved.
+        """
+        for name in skip:
+            step = self.components[name]
+            inherited = self.dependencies.pop(step, [])
+            for dependent, required in self.dependencies.items():
+                if step in required:
+                    self.dependencies[dependent] = [r for r in required if r != step] + \
+                        [r for r in inherited if r not in required]
+            self.steps.remove(step)
+
+    def configuration(self, name: str) -> BaseConfiguration:
+        if name == "cilium":
+            return InstallCilium(kubeconfig=self.kubeconfig, kubemaster_ip=self.kubemaster_ip)
+        if name == "dev-cluster":
+            return DevClusterConfiguration(kubeconfig=self.kubeconfig)
+        if name == "metallb":
+            return InstallMetalLbHelmChart(kubeconfig=self.kubeconfig, metallb_values=self.metallb_values)
+        if name == "metallb-custom-resources":
+            return InstallCustomResources(kubeconfig=self.kubeconfig, pool_name=self.pool_name,
+                                          start_ip=self.start_ip, end_ip=self.end_ip)
+        if name == "longhorn":
+            return InstallLonghorn(kubeconfig=self.kubeconfig, longhorn_values=self.longhorn_values)
+        if name == "traefik":
+            return InstallTraefikHelmChart(kubeconfig=self.kubeconfig, traefik_values=self.traefik_values)
+        if name == "traefik-default-headers":
+            return InstallTraefikDefaultHeaders(kubeconfig=self.kubeconfig,
+                                                traefik_default_headers=self.traefik_default_headers)
+        if name == "certmanager":
+            return InstallCertManagerHelmChart(kubeconfig=self.kubeconfig, certmanager_values=self.certmanager_values)
+        if name == "monitoring":
+            return InstallKubePrometheusStack(
+                kubeconfig=self.kubeconfig,
+                values=self.kube_prometheus_values,
+                control_plane_nodes=self.control_plane_nodes,
+                grafana_user=self.grafana_user,
+                grafana_password=self.grafana_password
+            )
+        raise ValueError(f"Unknown component {name}")
+
+    def desired_state(self):
+        desired = []
+        for name, step in self.components.items():
+            if step in self.steps:
+                desired.extend(self.configuration(name).desired_state() or [])
+        return desired
+
+    def install_cilium(self, log_prefix: str):
+        self.configuration("cilium").run()
+
+    def reload_dev_cluster(self, log_prefix: str):
+        self.configuration("dev-cluster").run()
+
+    def install_metallb(self, log_prefix: str):
+        self.configuration("metallb").run()
+
+    def configure_metallb(self, log_prefix: str):
+        self.configuration("metallb-custom-resources").run()
+
+    def install_longhorn(self, log_prefix: str):
+        self.configuration("longhorn").run()
+
+    def install_traefik(self, log_prefix: str):
+        self.configuration("traefik").run()
+
+    def install_traefik_default_headers(self, log_prefix: str):
+        self.configuration("traefik-default-headers").run()
+
+    def install_cert_manager(self, log_prefix: str):
+        self.configuration("certmanager").run()
+
+    def install_monitoring(self, log_prefix: str):
+        self.configuration("monitoring").run()
+
+    def run(self):
+        start = time.monotonic()
+        try:
+            return super().run()
+        finally:
+            self.print_summary(time.monotonic() - start)
+
+    def print_summary(self, elapsed: float):
+        if self.scheduler is None or not self.scheduler.results:
+            return
+        width = max(len(result.name) for result in self.scheduler.results)
+        print(colored(f"{'Component'.ljust(width)}  {'Status'.ljust(9)}  Duration", attrs=["bold"]))
+        for result in self.scheduler.results:
+            status = colored(result.status.ljust(9), STATUS_COLORS.get(result.status, "yellow"))
+            print(f"{result.name.ljust(width)}  {status}  {result.duration:8.1f}s")
+        print(colored(f"{'Total'.ljust(width)}  {''.ljust(9)}  {elapsed:8.1f}s", attrs=["bold"]))
@@ -1,17 +1,22 @@
 import logging
 import base64
-import tempfile
 import json
 import sys
 import re
 import typing
 
+import yaml
+
 
 from passlib.hash import apr_md5_crypt
+from kubernetes.client.exceptions import ApiException
 from termcolor import colored
-from python_hosts import Hosts, HostsEntry
 
 from api.core.base_configuration import BaseConfiguration
+from api.core.event_digest import DEFAULT_WINDOW, DEFAULT_TOP
+from api.core.dns_sync import HOSTS_FILE, HOSTS
+from api.core.plan import HelmRelease, helm_values
+from api.core.teardown import DeletionTarget
 
 
 class InstallTraefikHelmChart(BaseConfiguration):
@@ -22,10 +27,12 @@ class InstallTraefikHelmChart(BaseConfiguration):
 
         self.steps = [
             self.add_traefik_helm_repo,
-            self.update_helm_repo,
             self.install_traefik_helm_chart,
         ]
 
+    def desired_state(self):
+        return [HelmRelease("traefik", "traefik", "traefik/traefik", helm_values([self.traefik_values]))]
+
     def create_traefik_namespace(self, log_prefix: str):
         self.log(log_prefix, colored(
             "Creating Traefik namespace", "blue"), logging.INFO)
@@ -35,25 +42,13 @@ class InstallTraefikHelmChart(BaseConfiguration):
     def add_traefik_helm_repo(self, log_prefix: str):
         self.log(log_prefix, colored(
             "Adding Traefik Helm repo", "blue"), logging.INFO)
-        self.run_process(["helm", "repo", "add", "traefik", "https://helm.traefik.io/traefik"],
-                         log_prefix=log_prefix)
-
-    def update_helm_repo(self, log_prefix: str):
-        self.log(log_prefix, colored(
-            "Updating Helm repo", "blue"), logging.INFO)
-        self.run_process(["helm", "repo", "update"], log_prefix=log_prefix)
+        self.ensure_helm_repo(log_prefix, "traefik", "https://helm.traefik.io/traefik")
 
     def install_traefik_helm_chart(self, log_prefix: str):
         self.log(log_prefix, colored(
             "Installing Traefik Helm chart", "blue"), logging.INFO)
-        self.run_process([
-            "helm", "install", "traefik", "traefik/traefik",
-            "-f", self.traefik_values,
-            "--create-namespace",
-            "-n", "traefik"
-        ],
-            log_prefix=log_prefix
-        )
+        self.helm_upgrade(log_prefix, "traefik", "traefik/traefik", "traefik",
+                          values=[self.traefik_values], create_namespace=True)
 
 class InstallTraefikDefaultHeaders(BaseConfiguration):
     def __init__(self, kubeconfig: str, traefik_default_headers: str) -> None:
@@ -65,6 +60,10 @@ class InstallTraefikDefaultHeaders(BaseConfiguration):
             self.install_traefik_default_headers,
         ]
 
+    def desired_state(self):
+        with open(self.traefik_default_headers, "r") as f:
+            return [obj for obj in yaml.safe_load_all(f) if obj]
+
     def install_traefik_default_headers(self, log_prefix: str):
         self.log(log_prefix, colored(
             "Installing Traefik default headers", "blue"), logging.INFO)
@@ -80,28 +79,8 @@ class InstallTraefikDashboard(BaseConfiguration):
         self.kubeconfig = kubeconfig
         self.dashboard_username = dashboard_username
         self.dashboard_password = dashboard_password
-        self.hashed_passwd = self.hash_password(self.dashboard_password)
-        self.dashboard_user = f"{self.dashboard_username}:{self.hashed_passwd}"
-        self.loadbalancer_ip = self.get_dashboard_lb_ip()
         self.hostname = hostname
-        self.dashboard_user_b64 = base64.b64encode(
-            self.dashboard_user.encode('utf-8')
-        ).decode("utf-8")
-        
-        self.dashboard_secret = {
-            "apiVersion": "v1",
-            "kind": "Secret",
-            "metadata": {
-                "name": "traefik-dashboard-auth",
-                "namespace": "traefik"
-            },
-            "type": "Opaque",
-            "data": {
-                "users": self.dashboard_user_b64
-            }
-
-
-        }
+        self._dashboard_secret = None
 
         self.dashboard_basic_auth_middleware = {
             "apiVersion": "traefik.containo.us/v1alpha1",
@@ -158,71 +137,80 @@ class InstallTraefikDashboard(BaseConfiguration):
             self.install_traefik_dashboard_ingress_route,
             self.add_dashboard_hostname_to_hosts_file,
         ]
+        self.dependencies = {
+            self.install_traefik_dashboard_ingress_route: [self.install_traefik_dashboard_basic_auth_middleware],
+        }
+
+    def desired_state(self):
+        return [self.dashboard_secret(), self.dashboard_basic_auth_middleware, self.traefik_ingress_route]
+
+    def live_dashboard_users(self) -> list:
+        try:
+            secret = self.resources.get(self.resources.resource("v1", "Secret"), "traefik-dashboard-auth", "traefik")
+        except (ValueError, ApiException):
+            # a secret that can not be read is rendered with a new salt
+            return []
+        users = ((secret or {}).get("data") or {}).get("users")
+        return base64.b64decode(users).decode("utf-8").splitlines() if users else []
 
     def hash_password(self, password: str):
+        """
+        apr1 hash of the password. The hash in the live secret is kept while the password still verifies
+        against it, a new random salt would change the secret and its desired state hash on every run.
+        """
+        for line in self.live_dashboard_users():
+            username, _, hashed = line.partition(":")
+            if username == self.dashboard_username and apr_md5_crypt.identify(hashed) and \
+                    apr_md5_crypt.verify(password, hashed):
+                return hashed
         return apr_md5_crypt.hash(password)
 
-    def get_dashboard_lb_ip(self):
-        rcode, out, err = self.run_process([
-            "kubectl", "get", "service", "traefik", "-n", "traefik", "-o", "jsonpath='{.status.loadBalancer.ingress[0].ip}'"
-        ],
-            log_prefix="InstallTraefikDashboard"
-        )
-        return out.split("'")[1]
+    def dashboard_secret(self) -> dict:
+        """
+        Basic auth secret of the dashboard, rendered once per run
+        """
+        if self._dashboard_secret is None:
+            dashboard_user = f"{self.dashboard_username}:{self.hash_password(self.dashboard_password)}"
+            self._dashboard_secret = {
+                "apiVersion": "v1",
+                "kind": "Secret",
+                "metadata": {
+                    "name": "traefik-dashboard-auth",
+                    "namespace": "traefik"
+                },
+                "type": "Opaque",
+                "data": {
+                    "users": base64.b64encode(dashboard_user.encode('utf-8')).decode("utf-8")
+                }
+            }
+        return self._dashboard_secret
 
     def install_traefik_dashboard_secret(self, log_prefix: str):
-        self.log(log_prefix, colored(f"htpasswd entry with apr1 hash of password: {self.dashboard_user}", "blue"), logging.INFO)
-        self.log(log_prefix, f"Secret: {json.dumps(self.dashboard_secret, indent=4)}", logging.INFO)
+        dashboard_secret = self.dashboard_secret()
+        dashboard_user = base64.b64decode(dashboard_secret["data"]["users"]).decode("utf-8")
+        self.log(log_prefix, colored(f"htpasswd entry with apr1 hash of password: {dashboard_user}", "blue"), logging.INFO)
+        self.log(log_prefix, f"Secret: {json.dumps(dashboard_secret, indent=4)}", logging.INFO)
         self.log(log_prefix, colored(
             "Installing Traefik dashboard secret", "blue"), logging.INFO)
         
-        with tempfile.NamedTemporaryFile(mode='w', delete=False) as tmp:
-            tmp.write(json.dumps(self.dashboard_secret, indent=4))
-            tmp.close()
-            self.run_process([
-                "kubectl", "apply", "-f", tmp.name,
-            ],
-                log_prefix=log_prefix
-            )
+        self.apply_objects(log_prefix, [dashboard_secret])
 
     def install_traefik_dashboard_basic_auth_middleware(self, log_prefix: str):
         self.log(log_prefix, f"Middleware: {json.dumps(self.dashboard_basic_auth_middleware, indent=4)}", logging.INFO)
         self.log(log_prefix, colored(
             "Installing Traefik dashboard basic auth middleware", "blue"), logging.INFO)
-        with tempfile.NamedTemporaryFile(mode='w', delete=False) as tmp:
-            tmp.write(json.dumps(self.dashboard_basic_auth_middleware, indent=4))
-            tmp.close()
-            self.run_process([
-                "kubectl", "apply", "-f", tmp.name,
-            ],
-                log_prefix=log_prefix
-            )
+        self.apply_objects(log_prefix, [self.dashboard_basic_auth_middleware])
 
     def install_traefik_dashboard_ingress_route(self, log_prefix: str):
         self.log(log_prefix, f"IngressRoute: {json.dumps(self.traefik_ingress_route, indent=4)}", logging.INFO)
         self.log(log_prefix, colored(
             "Installing Traefik dashboard ingress route", "blue"), logging.INFO)
-        with tempfile.NamedTemporaryFile(mode='w', delete=False) as tmp:
-            tmp.write(json.dumps(self.traefik_ingress_route, indent=4))
-            tmp.close()
-            self.run_process([
-                "kubectl", "apply", "-f", tmp.name,
-            ],
-                log_prefix=log_prefix
-            )
+        self.apply_objects(log_prefix, [self.traefik_ingress_route])
 
     def add_dashboard_hostname_to_hosts_file(self, log_prefix: str):
-        hosts = Hosts()
-        if hosts.exists(names=[self.hostname]):
-            self.log(log_prefix, colored(
-                f"Hostname {self.hostname} already exists in /etc/hosts", "blue"), logging.INFO)
-            self.log(log_prefix, colored(f"Removing existing entry for {self.hostname}", "red"), logging.INFO)
-            hosts.remove_all_matching(name=self.hostname)
-        self.log(log_prefix, colored(f"Adding {self.hostname} -> {self.loadbalancer_ip} to /etc/hosts", "blue"), logging.INFO)
-        hosts.add([
-            HostsEntry(entry_type='ipv4', address=self.loadbalancer_ip, names=[self.hostname])
-            ])
-        hosts.write()
+        loadbalancer_ip = self.wait_for_loadbalancer_ip(log_prefix, "traefik", "traefik")
+        self.log(log_prefix, colored(f"Adding {self.hostname} -> {loadbalancer_ip} to {HOSTS_FILE}", "blue"), logging.INFO)
+        self.sync_hostnames(log_prefix, {self.hostname: loadbalancer_ip})
 
 
 class InstallDefaultTLSStore(BaseConfiguration):
@@ -248,6 +236,9 @@ class InstallDefaultTLSStore(BaseConfiguration):
             self.create_default_tls_store,
         ]
 
+    def desired_state(self):
+        return [self.default_tls_store]
+
     def create_default_tls_store(self, log_prefix: str):
         # check if secret exists
         existing_secrets = self.v1.list_namespaced_secret(namespace="default")
@@ -258,20 +249,16 @@ class InstallDefaultTLSStore(BaseConfiguration):
         
         self.log(log_prefix, colored(f"Creating default TLS store", "blue"), logging.INFO)
         self.log(log_prefix, f"TLSStore: {json.dumps(self.default_tls_store, indent=4)}", logging.INFO)
-        with tempfile.NamedTemporaryFile(mode='w', delete=False) as tmp:
-            tmp.write(json.dumps(self.default_tls_store, indent=4))
-            tmp.close()
-            self.run_process([
-                "kubectl", "apply", "-f", tmp.name,
-            ],
-                log_prefix=log_prefix
-            )
+        self.apply_objects(log_prefix, [self.default_tls_store])
 
 
 class WatchTraefikEvents(BaseConfiguration):
-    def __init__(self, kubeconfig: str):
+    def __init__(self, kubeconfig: str, aggregate: bool = False, window: float = DEFAULT_WINDOW, top: int = DEFAULT_TOP):
         super().__init__()
         self.kubeconfig = kubeconfig
+        self.aggregate = aggregate
+        self.window = window
+        self.top = top
         self.steps = [
             self.watch_traefik_events,
         ]
@@ -281,7 +268,10 @@ class WatchTraefikEvents(BaseConfiguration):
             "Watching Traefik events", "blue"), logging.INFO)
         self.watch_namespace_events(
             namespace="traefik",
-            log_prefix=log_prefix
+            log_prefix=log_prefix,
+            aggregate=self.aggregate,
+            window=self.window,
+            top=self.top
         )
 
 class GetTraefikLoadBalancerIP(BaseConfiguration):
@@ -296,13 +286,9 @@ class GetTraefikLoadBalancerIP(BaseConfiguration):
     def get_traefik_loadbalancer_ip(self, log_prefix: str):
         self.log(log_prefix, colored(
             "Getting Traefik LoadBalancer IP", "blue"), logging.INFO)
-        rcode, out, err = self.run_process([
-            "kubectl", "get", "service", "traefik", "-n", "traefik",
-            "-o", "jsonpath='{.status.loadBalancer.ingress[0].ip}'"
-        ],
-            log_prefix=log_prefix
-        )
-        self.log("Traefik LoadBalancer IP", colored(out, "green", "on_yellow"), logging.INFO)
+        loadbalancer_ip = self.wait_for_loadbalancer_ip(log_prefix, "traefik", "traefik")
+        self.log("Traefik LoadBalancer IP", colored(loadbalancer_ip, "green", "on_yellow"), logging.INFO)
+        return loadbalancer_ip
 
 
 class UninstallTraefikHelmChart(BaseConfiguration):
@@ -354,11 +340,7 @@ class UninstallTraefikNamespace(BaseConfiguration):
     def uninstall_traefik_namespace(self, log_prefix: str):
         self.log(log_prefix, colored(
             "Uninstalling Traefik namespace", "blue"), logging.INFO)
-        self.run_process([
-            "kubectl", "delete", "namespace", "traefik",
-        ],
-            log_prefix=log_prefix
-        )
+        self.delete_objects(log_prefix, [DeletionTarget("v1", "Namespace", "traefik")])
 
 class UninstallDefultTLSStore(BaseConfiguration):
     def __init__(self, kubeconfig: str) -> None:
@@ -379,11 +361,34 @@ class UninstallDefultTLSStore(BaseConfiguration):
         )
 
 
+SERVICE_SPEC = re.compile(
+    r"^(?P<namespace>[a-z0-9-]+)/(?P<service>[a-z0-9-]+):(?P<port>[0-9]+)(/(?P<subdomain>[a-z0-9-]+))?$")
+
+
+def read_service_specs(f: typing.TextIO, name: str) -> typing.List[typing.Tuple[str, str]]:
+    """
+    Service specs of a file, one per line, with the line they were read from. Blank lines and # comments are skipped
+    """
+    specs = []
+    for number, line in enumerate(f, start=1):
+        line = line.split("#", 1)[0].strip()
+        if line:
+            specs.append((f"{name}:{number}", line))
+    return specs
+
+
 class CreateIngressRoute(BaseConfiguration):
-    def __init__(self, kubeconfig: str, services: typing.List[str], domain: str) -> None:
+    def __init__(self, kubeconfig: str, services: typing.List[typing.Union[str, typing.Tuple[str, str]]],
+                 domain: str, hosts_file: typing.Optional[str] = None, hosts_format: str = HOSTS,
+                 prune_hosts: bool = False) -> None:
         super().__init__()
         self.kubeconfig = kubeconfig
-        self.services = services
+        self.hosts_file = hosts_file
+        self.hosts_format = hosts_format
+        self.prune_hosts = prune_hosts
+        # (where the spec came from, spec)
+        self.services = [service if isinstance(service, tuple) else (f"--service {service}", service)
+                         for service in services]
         self.domain = domain
         
         self.steps = [
@@ -424,44 +429,67 @@ class CreateIngressRoute(BaseConfiguration):
         return ingress_route_name, ingress_route
 
 
-    def create_ingress_route(self, log_prefix: str, service: str, port: str, namespace: str, subdomain: str):
-        ingress_route_name, ingress_route = self.get_ingress_route(service, port, namespace, subdomain)
+    def parse_services(self):
+        """
+        Validate every service spec before anything is applied, returns the parsed specs and the errors found
+        """
+        specs, errors, hosts, routes = [], [], {}, {}
+        for source, service in self.services:
+            match = SERVICE_SPEC.match(service.strip())
+            if match is None:
+                errors.append(f"{source}: '{service.strip()}' is not in the format namespace/service:port/subdomain")
+                continue
+            spec = match.groupdict()
+            spec["subdomain"] = spec["subdomain"] or spec["service"]
+            host = f"{spec['subdomain']}.{self.domain}"
+            route = f"{spec['namespace']}/{spec['service']}-ingress-route"
+            if host in hosts:
+                errors.append(f"{source}: {host} is already routed by {hosts[host]}")
+                continue
+            if route in routes:
+                errors.append(f"{source}: IngressRoute {route} is already created by {routes[route]}")
+                continue
+            hosts[host], routes[route] = source, source
+            specs.append(spec)
+        return specs, errors
+
+    def get_ingress_routes(self, log_prefix: str = ""):
+        specs, errors = self.parse_services()
+        if errors:
+            for error in errors:
+                self.log(log_prefix, colored(error, "red"))
+            self.log(log_prefix, colored(f"{len(errors)} of {len(self.services)} service specs are invalid, "
+                                         "nothing was applied", "red", attrs=["bold"]))
+            sys.exit(1)
+        dns_entries = []
+        ingress_routes = []
+        for spec in specs:
+            self.log(log_prefix, colored(f"{spec['namespace']}, {spec['service']}, {spec['port']}, {spec['subdomain']}",
+                                         "cyan"), logging.DEBUG)
+            ingress_route_name, ingress_route = self.get_ingress_route(spec["service"], spec["port"],
+                                                                       spec["namespace"], spec["subdomain"])
+            self.log(log_prefix, f"IngressRoute: {ingress_route}", logging.DEBUG)
+            ingress_routes.append(ingress_route)
+            dns_entries.append(f"{spec['subdomain']}.{self.domain}")
+        return ingress_routes, dns_entries
+
+    def desired_state(self):
+        ingress_routes, dns_entries = self.get_ingress_routes()
+        return ingress_routes
 
-        self.log(log_prefix, colored(
-            f"Creating IngressRoute {ingress_route_name}", "blue"), logging.INFO)
-
-        self.log(log_prefix, f"IngressRoute: {ingress_route}", logging.INFO)
-        with tempfile.NamedTemporaryFile(mode="w", delete=False) as f:
-            f.write(json.dumps(ingress_route, indent=4))
-            f.flush()
-            self.run_process([
-                "kubectl", "apply", "-f", f.name
-            ],
-                log_prefix=log_prefix
-            )
-            self.log(log_prefix, colored(f"Ingress Route {ingress_route_name} created", "green"), logging.INFO)
-            
     def create_ingress_routes(self, log_prefix: str):
-        dns_entries = []
-        for service in self.services:
-            # match regular expression namespace/service:port/subdomain
-            match = re.match(r"^(?P<namespace>[a-z0-9-]+)/(?P<service>[a-z0-9-]+):(?P<port>[0-9]+)(/(?P<subdomain>[a-z0-9-]+))?$", service)
-            namespace = match.group("namespace")
-            service_name = match.group("service")
-            subdomain = match.group("subdomain")
-            port = match.group("port")
-            
-            self.log(log_prefix, colored(f"{namespace}, {service_name}, {port}, {subdomain}", "cyan"), logging.INFO)
-            self.create_ingress_route(log_prefix, service_name, port, namespace, subdomain)
-            dns_entries.append(f"{subdomain}.{self.domain}")
-        
+        ingress_routes, dns_entries = self.get_ingress_routes(log_prefix)
+
+        self.log(log_prefix, colored(
+            f"Creating {len(ingress_routes)} IngressRoutes", "blue"), logging.INFO)
+        self.apply_objects(log_prefix, ingress_routes)
+
         self.log(log_prefix, colored(
             "Getting Traefik LoadBalancer IP", "blue"), logging.INFO)
-        rcode, lb_ip, err = self.run_process([
-            "kubectl", "get", "service", "traefik", "-n", "traefik",
-            "-o", "jsonpath='{.status.loadBalancer.ingress[0].ip}'"
-        ],
-            log_prefix=log_prefix
-        )
+        lb_ip = self.wait_for_loadbalancer_ip(log_prefix, "traefik", "traefik")
+        if self.hosts_file:
+            self.sync_hostnames(log_prefix, {dns_entry: lb_ip for dns_entry in dns_entries}, path=self.hosts_file,
+                                output_format=self.hosts_format, prune=self.prune_hosts)
+            return
         self.log(log_prefix, colored(f"Please add following to your DNS/hosts file", "green", "on_yellow"), logging.INFO)
-        self.log(log_prefix, colored(f"{lb_ip[1:-1]} {' '.join(dns_entries)}", "green", "on_yellow"), logging.INFO)
+        self.log(log_prefix, colored(f"{lb_ip} {' '.join(dns_entries)}", "green", "on_yellow"), logging.INFO)
@@ -0,0 +1,75 @@
+"""
+Cold start benchmark of the k8s_admin_setup_utils CLI.
+
+Runs each command in a fresh interpreter a number of times and fails when the median wall time
+is over its budget, or when the top level help imports a component, so that slow imports do not
+creep back into the startup path. Subcommands import their component, and with it the kubernetes
+client, so they get a larger budget.
+
+    python benchmarks/cli_startup.py --runs 10
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+TOOLS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_RUNS = 10
+
+# command line -> median seconds allowed
+BUDGETS = {
+    ("--help",): 0.3,
+    ("traefik", "--help"): 1.0,
+}
+
+# modules that must not be imported to print the top level help
+HEAVY_MODULES = ["kubernetes", "passlib", "yaml", "click_params", "pkg_resources"]
+
+
+def time_command(args):
+    cmd = [sys.executable, "-c", "from k8s_admin_setup_utils.main import cli; cli()", *args]
+    start = time.perf_counter()
+    subprocess.run(cmd, cwd=TOOLS_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - start
+
+
+def heavy_imports():
+    code = ("import sys\n"
+            "from k8s_admin_setup_utils.main import cli\n"
+            "try:\n"
+            "    cli(['--help'])\n"
+            "except SystemExit:\n"
+            "    pass\n"
+            f"print('imported=' + ','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))\n")
+    out = subprocess.run([sys.executable, "-c", code], cwd=TOOLS_DIR, capture_output=True, text=True, check=True)
+    line = [line for line in out.stdout.splitlines() if line.startswith("imported=")][-1]
+    return [module for module in line[len("imported="):].split(",") if module]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiply every budget, for slower machines")
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS, help="Runs per command")
+    args = parser.parse_args()
+
+    failed = False
+    for command, budget in BUDGETS.items():
+        budget *= args.scale
+        timings = [time_command(command) for _ in range(args.runs)]
+        median = statistics.median(timings)
+        status = "ok" if median <= budget else f"OVER BUDGET ({budget:.2f}s)"
+        failed = failed or median > budget
+        print(f"{' '.join(command):<20} median {median:.3f}s  min {min(timings):.3f}s  max {max(timings):.3f}s  {status}")
+
+    imported = heavy_imports()
+    if imported:
+        failed = True
+        print(f"--help imports {', '.join(imported)}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+import os
+
+import click
+
+from api.core.run_context import kube_proxy
+from api.core.events import DEFAULT_QUEUE_SIZE
+from api.core.event_digest import DEFAULT_WINDOW, DEFAULT_TOP
+from api.events.events import WatchEvents
+
+
+def aggregate_options(command):
+    """
+    Options of the commands that watch events to collapse repeated events into a periodic digest
+    """
+    command = click.option("--top", default=DEFAULT_TOP, show_default=True, type=click.IntRange(min=1),
+                           help="Repeating objects and reasons listed in each digest")(command)
+    command = click.option("--window", default=DEFAULT_WINDOW, show_default=True, type=click.IntRange(min=1),
+                           help="Seconds between digests when aggregating")(command)
+    return click.option("--aggregate", is_flag=True,
+                        help="Show each event once per window and summarise its repeats in a periodic digest")(command)
+
+
+@click.command()
+@click.option("--kubeconfig",
+              default=f"{os.environ.get('HOME', '~')}/.kube/config",
+              type=click.Path(exists=True),
+              help="Path to kubeconfig file")
+@click.option("--namespace", "-n", "namespaces", multiple=True, help="Namespace to watch, can be repeated")
+@click.option("--all-namespaces", "-A", is_flag=True, help="Watch the events of every namespace")
+@click.option("--queue-size", default=DEFAULT_QUEUE_SIZE, show_default=True, type=click.IntRange(min=1),
+              help="Events buffered before new ones are dropped when the output can not keep up")
+@aggregate_options
+def events(kubeconfig, namespaces, all_namespaces, queue_size, aggregate, window, top):
+    """
+    Watch the events of several namespaces at once
+    """
+    if not namespaces and not all_namespaces:
+        raise click.UsageError("Pass --namespace at least once, or --all-namespaces")
+    with kube_proxy(kubeconfig):
+        WatchEvents(
+            kubeconfig=kubeconfig,
+            namespaces=[] if all_namespaces else namespaces,
+            queue_size=queue_size,
+            aggregate=aggregate,
+            window=window,
+            top=top
+        ).run()
@@ -0,0 +1,45 @@
+import importlib
+import typing
+
+import click
+
+
+class LazyGroup(click.Group):
+    """
+    Click group whose subcommands are imported only when they are invoked.
+    `lazy_subcommands` maps a command name to ("module.path", "attribute", "short help"), the help
+    is kept here so that listing the commands does not import them.
+    """
+
+    def __init__(self, *args, lazy_subcommands: typing.Optional[typing.Dict[str, typing.Tuple[str, str, str]]] = None,
+                 **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.lazy_subcommands = lazy_subcommands or {}
+
+    def list_commands(self, ctx: click.Context) -> typing.List[str]:
+        return sorted(set(super().list_commands(ctx)) | set(self.lazy_subcommands))
+
+    def get_command(self, ctx: click.Context, cmd_name: str) -> typing.Optional[click.Command]:
+        if cmd_name in self.lazy_subcommands:
+            return self.load(cmd_name)
+        return super().get_command(ctx, cmd_name)
+
+    def load(self, cmd_name: str) -> click.Command:
+        module_path, attribute, _ = self.lazy_subcommands[cmd_name]
+        command = getattr(importlib.import_module(module_path), attribute)
+        if not isinstance(command, click.Command):
+            raise ValueError(f"{module_path}.{attribute} is not a click command")
+        return command
+
+    def format_commands(self, ctx: click.Context, formatter: click.HelpFormatter) -> None:
+        rows = []
+        for name in self.list_commands(ctx):
+            if name in self.lazy_subcommands:
+                rows.append((name, self.lazy_subcommands[name][2]))
+                continue
+            command = super().get_command(ctx, name)
+            if command is not None and not command.hidden:
+                rows.append((name, command.get_short_help_str()))
+        if rows:
+            with formatter.section("Commands"):
+                formatter.write_dl(rows)
@@ -5,6 +5,7 @@ import click
 
 from api.longhorn.longhorn import InstallLonghorn, WatchLonghornEvents, ExposeLonghornUI, ExposeLonghornUIMetalLB
 from api.core.run_context import kube_proxy
+from k8s_admin_setup_utils.events import aggregate_options
 
 longhorn_values_default_path = Path(
     __file__).parent.parent / "config" / "longhorn-values.yaml"
@@ -42,14 +43,18 @@ def install(ctx, longhorn_values):
 
 
 @cli.command()
+@aggregate_options
 @click.pass_obj
-def watch(ctx):
+def watch(ctx, aggregate, window, top):
     """
     Watch Longhorn events
     """
     with kube_proxy(kubeconfig=ctx.kubeconfig):
         WatchLonghornEvents(
-            kubeconfig=ctx.kubeconfig
+            kubeconfig=ctx.kubeconfig,
+            aggregate=aggregate,
+            window=window,
+            top=top
         ).run()
 
 
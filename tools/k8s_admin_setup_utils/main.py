@@ -1,27 +1,58 @@
 import click
 import logging
+
 from api.core.root_logger import config_root_logger
-from api.core.constants import ASCII_ART
-from k8s_admin_setup_utils import longhorn, metallb
-from k8s_admin_setup_utils import dev_cluster
-from k8s_admin_setup_utils import traefik
-from k8s_admin_setup_utils import cert_manager
-from k8s_admin_setup_utils import monitoring
+from api.core.constants import ASCII_ART, DEFAULT_POOL_SIZE, DEFAULT_REPO_TTL
+from api.core.desired_state import force_reapply, plan_only
+from api.core.checkpoint import resume_runs
+from k8s_admin_setup_utils.lazy_group import LazyGroup
+
+
+# Subcommands are imported when they run, so that `--help` and small commands start fast.
+# The help strings are repeated here for the same reason.
+SUBCOMMANDS = {
+    "dev-cluster": ("k8s_admin_setup_utils.dev_cluster", "cli", "Configure the vagrant development cluster post launch"),
+    "longhorn": ("k8s_admin_setup_utils.longhorn", "cli", "Install or Configure Longhorn Storage on a Kubernetes Cluster"),
+    "metallb": ("k8s_admin_setup_utils.metallb", "cli", "Install or Configure MetalLB on a Kubernetes Cluster"),
+    "traefik": ("k8s_admin_setup_utils.traefik", "cli", "Install or Configure Traefik on a Kubernetes Cluster"),
+    "certmanager": ("k8s_admin_setup_utils.cert_manager", "cli", "Install or Configure cert manager on a Kubernetes Cluster"),
+    "monitoring": ("k8s_admin_setup_utils.monitoring", "cli", "Install and Configure Kube Prometheus Stack"),
+    "up": ("k8s_admin_setup_utils.stack", "up", "Install the whole stack, independent components in parallel"),
+    "events": ("k8s_admin_setup_utils.events", "events", "Watch the events of several namespaces at once"),
+}
 
 
 logger = logging.getLogger(__name__)
 
 
-@click.group()
+@click.group(cls=LazyGroup, lazy_subcommands=SUBCOMMANDS)
 @click.option("--verbosity", "-v", default=1, count=True, help="Verbosity level")
-def cli(verbosity):
+@click.option("--direct", is_flag=True, help="Connect to the API server from the kubeconfig instead of starting kubectl proxy")
+@click.option("--api-pool-size", default=DEFAULT_POOL_SIZE, show_default=True, type=click.IntRange(min=1), help="Maximum number of pooled connections to the Kubernetes API")
+@click.option("--helm-repo-ttl", default=DEFAULT_REPO_TTL, show_default=True, type=click.IntRange(min=0), help="Seconds a cached helm repo index is used before it is updated")
+@click.option("--metrics-out", type=click.Path(dir_okay=False, writable=True), help="Write step, process and API call timings to <path>.json and a Prometheus textfile <path>.prom")
+@click.option("--force", is_flag=True, help="Re-apply manifests and helm releases even when their desired state is unchanged")
+@click.option("--resume", is_flag=True, help="Continue from the steps that did not complete in the previous run of the command")
+@click.option("--plan", is_flag=True, help="Show what install commands would change in the cluster without changing anything")
+@click.option("--purge-finalizers", is_flag=True, help="Remove the finalizers of objects still terminating when an uninstall times out")
+@click.pass_context
+def cli(ctx, verbosity, direct, api_pool_size, helm_repo_ttl, metrics_out, force, resume, plan, purge_finalizers):
+    # the kubernetes client and helm modules are only needed once a subcommand runs
+    from api.core.run_context import use_direct_connection
+    from api.core.client_factory import clients
+    from api.core.helm import helm_repositories
+    from api.core.metrics import metrics
+    from api.core.teardown import purge_finalizers as purge_stuck_finalizers
+
     config_root_logger(verbosity=verbosity)
+    if metrics_out:
+        ctx.call_on_close(lambda: metrics.export(metrics_out))
+    use_direct_connection(direct)
+    clients.configure(pool_size=api_pool_size)
+    helm_repositories.ttl = helm_repo_ttl
+    force_reapply(force)
+    resume_runs(resume)
+    plan_only(plan)
+    purge_stuck_finalizers(purge_finalizers)
     print(ASCII_ART)
 
-
-cli.add_command(dev_cluster.cli, name="dev-cluster")
-cli.add_command(longhorn.cli, name="longhorn")
-cli.add_command(metallb.cli, name="metallb")
-cli.add_command(traefik.cli, name="traefik")
-cli.add_command(cert_manager.cli, name="certmanager")
-cli.add_command(monitoring.cli, name="monitoring")
\ No newline at end of file
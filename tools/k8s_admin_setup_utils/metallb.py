@@ -6,8 +6,10 @@ from click_params import IPV4_ADDRESS
 
 
 from api.core.run_context import kube_proxy
-from api.metallb.metallb import InstallMetalLbHelmChart, InstallCustomResources, WatchMetalLbEvents, UninstallMetalLb
-from pkg_resources import cleanup_resources
+from api.metallb.metallb import (InstallMetalLbHelmChart, InstallCustomResources, WatchMetalLbEvents, UninstallMetalLb,
+                                 ReportMetalLbPools, InstallAddressPools)
+from api.core.ip_pools import DEFAULT_WARN_THRESHOLD
+from k8s_admin_setup_utils.events import aggregate_options
 
 
 metallb_values_default_path = Path(
@@ -47,10 +49,11 @@ def helm_chart(ctx, metallb_values):
     """
     Install MetalLB Helm Chart and Custom Resource Definitions
     """
-    InstallMetalLbHelmChart(
-        kubeconfig=ctx.kubeconfig,
-        metallb_values=metallb_values
-    ).run()
+    with kube_proxy(kubeconfig=ctx.kubeconfig):
+        InstallMetalLbHelmChart(
+            kubeconfig=ctx.kubeconfig,
+            metallb_values=metallb_values
+        ).run()
 
 
 @install.command()
@@ -70,10 +73,26 @@ def custom_resources(ctx, pool_name, start_ip, end_ip):
     """
     Configure MetalLB L2Advertisement and AddressPool Custom Resources
     """
-    InstallCustomResources(kubeconfig=ctx.kubeconfig,
-                           pool_name=pool_name,
-                           start_ip=start_ip,
-                           end_ip=end_ip).run()
+    with kube_proxy(kubeconfig=ctx.kubeconfig):
+        InstallCustomResources(kubeconfig=ctx.kubeconfig,
+                               pool_name=pool_name,
+                               start_ip=start_ip,
+                               end_ip=end_ip).run()
+
+
+@install.command(name="pools")
+@click.option("--spec", "-f", "spec_file", required=True, type=click.Path(exists=True, dir_okay=False),
+              help="YAML file describing every address pool and how it is announced")
+@click.pass_obj
+def install_pools(ctx, spec_file):
+    """
+    Configure many IPAddressPools and their L2Advertisements from a spec file
+    """
+    with kube_proxy(kubeconfig=ctx.kubeconfig):
+        InstallAddressPools(
+            kubeconfig=ctx.kubeconfig,
+            spec_file=spec_file
+        ).run()
 
 
 @cli.command()
@@ -89,10 +108,32 @@ def uninstall(ctx):
 
 
 @cli.command()
+@aggregate_options
 @click.pass_obj
-def watch(ctx):
+def watch(ctx, aggregate, window, top):
     """
     Watch MetalLB events
     """
     with kube_proxy(kubeconfig=ctx.kubeconfig):
-        WatchMetalLbEvents().run()
\ No newline at end of file
+        WatchMetalLbEvents(
+            kubeconfig=ctx.kubeconfig,
+            aggregate=aggregate,
+            window=window,
+            top=top
+        ).run()
+
+@cli.command(name="pools")
+@click.option("--warn-at", default=DEFAULT_WARN_THRESHOLD, show_default=True, type=click.FloatRange(0, 100),
+              help="Warn about pools that are used to at least this percentage")
+@click.option("--summary", is_flag=True, help="Only print one line per pool, without the addresses")
+@click.pass_obj
+def report_pools(ctx, warn_at, summary):
+    """
+    Show how much of every IPAddressPool is used and by which services
+    """
+    with kube_proxy(kubeconfig=ctx.kubeconfig):
+        ReportMetalLbPools(
+            kubeconfig=ctx.kubeconfig,
+            warn_threshold=warn_at,
+            summary=summary
+        ).run()
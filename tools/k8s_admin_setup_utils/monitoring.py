@@ -29,7 +29,7 @@ def cli(context, kubeconfig):
 
 @cli.command()
 @click.option("--kube-prometheus-values", "--values", type=click.Path(exists=True), default=str(kube_prometheus_values_default_path), help="Path to Kube Prometheus Stack Helm values file")
-@click.option("--control-plane-nodes", "--control-plane", required=True, type=IPV4_ADDRESS, multiple=True, help="Control Plane Node Names")
+@click.option("--control-plane-nodes", "--control-plane", type=IPV4_ADDRESS, multiple=True, help="Control Plane Node IPs, discovered from the node role labels when omitted")
 @click.option("--grafana-user", "-u", default="admin", help="Grafana User Name")
 @click.password_option("--grafana-password", "-p", default="admin", help="Grafana Password")
 @click.pass_obj
@@ -0,0 +1,61 @@
+import os
+
+import click
+from click_params import IPV4_ADDRESS
+
+from api.core.run_context import kube_proxy
+from api.stack.stack import InstallStack
+from k8s_admin_setup_utils import longhorn, metallb
+from k8s_admin_setup_utils import traefik
+from k8s_admin_setup_utils import cert_manager
+from k8s_admin_setup_utils import monitoring
+
+
+@click.command()
+@click.option("--kubeconfig",
+              default=f"{os.environ.get('HOME', '~')}/.kube/config",
+              type=click.Path(exists=True),
+              help="Path to kubeconfig file")
+@click.option("--kubemaster-ip", default="172.16.16.10", type=IPV4_ADDRESS, help="IP address of the kubemaster")
+@click.option("--metallb-values", default=str(metallb.metallb_values_default_path), type=click.Path(exists=True), help="Path to Metallb Helm values file")
+@click.option("--pool-name", default="default", help="Name of the pool to use for MetalLB")
+@click.option("--start-ip", type=IPV4_ADDRESS, default="172.16.16.200", help="Start IP of the pool to use for MetalLB")
+@click.option("--end-ip", type=IPV4_ADDRESS, default="172.16.16.240", help="End IP of the pool to use for MetalLB")
+@click.option("--longhorn-values", default=str(longhorn.longhorn_values_default_path), type=click.Path(exists=True), help="Path to Longhorn Helm values file")
+@click.option("--traefik-values", default=str(traefik.traefik_values_default_path), type=click.Path(exists=True), help="Path to Traefik Helm values file")
+@click.option("--traefik-default-headers", default=str(traefik.traefik_default_headers_default_path), type=click.Path(exists=True), help="Path to Traefik Default Headers file")
+@click.option("--certmanager-values", default=str(cert_manager.certmanager_values_default_path), type=click.Path(exists=True), help="Path to Cert Manager Helm values file")
+@click.option("--kube-prometheus-values", default=str(monitoring.kube_prometheus_values_default_path), type=click.Path(exists=True), help="Path to Kube Prometheus Stack Helm values file")
+@click.option("--control-plane-nodes", "--control-plane", type=IPV4_ADDRESS, multiple=True, help="Control Plane Node IPs, discovered from the node role labels when omitted")
+@click.option("--grafana-user", "-u", default="admin", help="Grafana User Name")
+@click.option("--grafana-password", "-p", help="Grafana Password, prompted for when monitoring is installed and none is given")
+@click.option("--skip", type=click.Choice(["cilium", "dev-cluster", "metallb", "metallb-custom-resources", "longhorn",
+                                            "traefik", "traefik-default-headers", "certmanager", "monitoring"]),
+              multiple=True, help="Component to leave out, for example when it is already installed")
+def up(kubeconfig, kubemaster_ip, metallb_values, pool_name, start_ip, end_ip, longhorn_values, traefik_values,
+       traefik_default_headers, certmanager_values, kube_prometheus_values, control_plane_nodes,
+       grafana_user, grafana_password, skip):
+    """
+    Install the whole stack, independent components in parallel
+    """
+    # only ask for the password when it is needed, so that non-interactive runs can skip monitoring
+    if grafana_password is None and "monitoring" not in skip:
+        grafana_password = click.prompt("Grafana Password", hide_input=True, confirmation_prompt=True)
+    with kube_proxy(kubeconfig):
+        InstallStack(
+            kubeconfig=kubeconfig,
+            kubemaster_ip=kubemaster_ip,
+            metallb_values=metallb_values,
+            pool_name=pool_name,
+            start_ip=start_ip,
+            end_ip=end_ip,
+            longhorn_values=longhorn_values,
+            traefik_values=traefik_values,
+            traefik_default_headers=traefik_default_headers,
+            certmanager_values=certmanager_values,
+            kube_prometheus_values=kube_prometheus_values,
+            control_plane_nodes=control_plane_nodes,
+            grafana_user=grafana_user,
+            grafana_password=grafana_password,
+            skip=skip
+        ).run()
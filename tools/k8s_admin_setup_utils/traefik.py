@@ -7,9 +7,11 @@ from api.traefik.traefik import (
     InstallTraefikHelmChart, InstallTraefikDefaultHeaders, InstallTraefikDashboard,
     WatchTraefikEvents, GetTraefikLoadBalancerIP, InstallDefaultTLSStore, UninstallDefultTLSStore,
     UninstallTraefikHelmChart, UninstallTraefikDefaultHeaders, UninstallTraefikNamespace,
-    CreateIngressRoute
+    CreateIngressRoute, read_service_specs
 )
 from api.core.run_context import kube_proxy
+from api.core.dns_sync import HOSTS, FORMATS
+from k8s_admin_setup_utils.events import aggregate_options
 
 traefik_values_default_path = Path(
     __file__).parent.parent / "config" / "traefik-values.yaml"
@@ -106,14 +108,18 @@ def default_tls_store(ctx, cert_secret_name):
 
 
 @cli.command()
+@aggregate_options
 @click.pass_obj
-def watch(ctx):
+def watch(ctx, aggregate, window, top):
     """
     Watch Traefik Events
     """
     with kube_proxy(kubeconfig=ctx.kubeconfig):
         WatchTraefikEvents(
-            kubeconfig=ctx.kubeconfig
+            kubeconfig=ctx.kubeconfig,
+            aggregate=aggregate,
+            window=window,
+            top=top
         ).run()
 
 
@@ -189,16 +195,32 @@ def default_tls_store(ctx):
 
 
 @cli.command()
-@click.option("--service", "-s", required=True, multiple=True ,help="Service to expose in the format {namespace}/{service_name}:{port}/{subdomain}")
+@click.option("--service", "-s", multiple=True ,help="Service to expose in the format {namespace}/{service_name}:{port}/{subdomain}")
+@click.option("--file", "-f", "spec_file", type=click.File("r"),
+              help="File with one service spec per line, - to read them from stdin")
 @click.option("--domain", required=True, help="Domain for TLS Cert. Ex: devmaany.com")
+@click.option("--hosts-file", type=click.Path(dir_okay=False),
+              help="Point the hostnames at the Traefik LoadBalancer IP in this file instead of printing them")
+@click.option("--hosts-format", default=HOSTS, show_default=True, type=click.Choice(FORMATS),
+              help="Format of --hosts-file: a managed block in a hosts file, dnsmasq host-record lines, "
+                   "or a file for the CoreDNS hosts plugin")
+@click.option("--prune-hosts", is_flag=True, help="Remove hostnames from --hosts-file that are not in this run")
 @click.pass_obj
-def create_ingress_routes(ctx, service, domain):
+def create_ingress_routes(ctx, service, spec_file, domain, hosts_file, hosts_format, prune_hosts):
     """
     Create IngressRoute for a Service
     """
+    if not service and spec_file is None:
+        raise click.UsageError("Pass --service at least once, or --file")
+    services = list(service)
+    if spec_file is not None:
+        services += read_service_specs(spec_file, spec_file.name)
     with kube_proxy(kubeconfig=ctx.kubeconfig):
         CreateIngressRoute(
             kubeconfig=ctx.kubeconfig,
-            services=service,
-            domain=domain
+            services=services,
+            domain=domain,
+            hosts_file=hosts_file,
+            hosts_format=hosts_format,
+            prune_hosts=prune_hosts
         ).run()
\ No newline at end of file